@@ -1,12 +1,16 @@
 import { Bucket, IBucket } from "aws-cdk-lib/aws-s3";
 import { Asset, AssetProps } from "aws-cdk-lib/aws-s3-assets";
+import * as fs from "fs";
 import * as path from "path";
 import { BuildSpec, LinuxBuildImage, Project } from "aws-cdk-lib/aws-codebuild";
 import { Construct } from "constructs";
 import {
   Annotations,
+  AssetHashType,
+  BundlingOptions,
   CfnResource,
   CustomResource,
+  DockerImage,
   Duration,
   RemovalPolicy,
   Stack,
@@ -62,6 +66,12 @@ export interface GdkPublishProps {
    * @default {}
    */
   readonly buildEnvironment?: { [key: string]: string };
+  /**
+   * Directories merged into the component directory before it is uploaded
+   * (e.g. modules shared by several components, kept once in the repository).
+   * @default []
+   */
+  readonly sharedSources?: string[];
 }
 
 export class GdkPublish extends Construct {
@@ -234,12 +244,23 @@ EOF
       })
     );
 
+    const sharedSources = props.sharedSources ?? [];
     const asset = new Asset(
       this,
       `Source-${props.asset.path.replace("/", "")}`,
       {
         ...props.asset,
         exclude: exclude,
+        ...(sharedSources.length > 0
+          ? {
+              // Hashed after the merge, so a change of a shared module is uploaded
+              assetHashType: AssetHashType.OUTPUT,
+              bundling: mergeDirectories(
+                [props.asset.path, ...sharedSources],
+                ["__pycache__", ...gdkExclude]
+              ),
+            }
+          : {}),
       }
     );
     asset.grantRead(project);
@@ -268,3 +289,28 @@ EOF
     this.componentVersion = custom.getAttString("componentVersion");
   }
 }
+
+/**
+ * Bundling that merges directories into the asset locally (no Docker)
+ * @param sources Directories to merge (a later file replaces an earlier one)
+ * @param skipped Names of the files and directories not copied
+ */
+function mergeDirectories(
+  sources: string[],
+  skipped: string[]
+): BundlingOptions {
+  return {
+    // Not used, the directories are always merged locally
+    image: DockerImage.fromRegistry("public.ecr.aws/docker/library/alpine"),
+    local: {
+      tryBundle(outputDir: string): boolean {
+        const filter = (source: string) =>
+          !skipped.includes(path.basename(source));
+        for (const source of sources) {
+          fs.cpSync(source, outputDir, { recursive: true, filter });
+        }
+        return true;
+      },
+    },
+  };
+}
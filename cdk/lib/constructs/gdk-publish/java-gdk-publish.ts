@@ -8,7 +8,9 @@ export enum JavaVersion {
   CORRETTO17 = "corretto17",
 }
 
-export interface JavaGdkPublishProps extends GdkPublishProps {
+// The shared sources are Python modules, not merged into the Java components
+export interface JavaGdkPublishProps
+  extends Omit<GdkPublishProps, "sharedSources"> {
   /**
    * Java version used in CodeBuild project.
    * @default corretto17
@@ -71,10 +71,14 @@ export class IndustrialDataPlatformStack extends cdk.Stack {
         enforceSSL: true,
       });
 
+      // Modules shared by the Python components, copied into each of them
+      const sharedSources = [path.join(__dirname, "../../components/common")];
+
       // Register OpcArchiver component
       const opcArchiver = new PythonGdkPublish(this, "OpcArchiver", {
         componentBucket: componentBucket,
         asset: { path: path.join(__dirname, "../../components/opc-archiver") },
+        sharedSources: sharedSources,
         pythonVersion: PythonVersion.PYTHON_3_9,
       });
 
@@ -82,6 +86,7 @@ export class IndustrialDataPlatformStack extends cdk.Stack {
       const fileWatcher = new PythonGdkPublish(this, "FileWatcher", {
         componentBucket: componentBucket,
         asset: { path: path.join(__dirname, "../../components/file-watcher") },
+        sharedSources: sharedSources,
         pythonVersion: PythonVersion.PYTHON_3_9,
       });
 
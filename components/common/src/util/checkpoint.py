@@ -0,0 +1,203 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import json
+import logging
+import os
+import threading
+import time
+from threading import Event, Thread
+from typing import Any, List
+
+from util.shadow import ShadowController
+
+# Shared by opc-archiver and file-watcher (kept in `components/common`)
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHECKPOINT_DIR = "./opclogs/checkpoint/"
+DEFAULT_CHECKPOINT_SYNC_INTERVAL_SEC = 60
+
+
+class CheckpointStore:
+    """
+    Write-behind store of stream read positions.
+    Every update is journaled to a small local file (fsync'd), while the device shadow
+    is only updated every `sync_interval_sec` seconds and when the store is closed.
+    A background thread syncs the last update once the interval has elapsed, when no
+    other update follows it.
+    The values that can grow with the data (e.g. the manifests of the pending segments)
+    are kept in the local journal only, so that the shadow document stays small.
+    """
+
+    def __init__(
+        self,
+        shadow_name: str,
+        checkpoint_dir: str = DEFAULT_CHECKPOINT_DIR,
+        sync_interval_sec: int = DEFAULT_CHECKPOINT_SYNC_INTERVAL_SEC,
+        local_keys: List[str] = None,
+    ):
+        """
+        Parameters
+        ----------
+        shadow_name: str
+            Name of the shadow to sync the checkpoint to (also used as the journal file name)
+        checkpoint_dir: str
+            Directory of the local journal
+        sync_interval_sec: int
+            Minimum interval between shadow updates (in seconds)
+        local_keys: List[str]
+            Keys kept in the local journal only, not synced to the shadow
+        """
+        self._shadow = ShadowController(shadow_name)
+        self._path = os.path.join(checkpoint_dir, f"{shadow_name}.json")
+        self._sync_interval_sec = sync_interval_sec
+        self._local_keys = set(local_keys or [])
+        # Local keys synced to the shadow by a previous version, removed on the next sync
+        self._stale_keys = set()
+        self._lock = threading.Lock()
+
+        try:
+            os.makedirs(checkpoint_dir)
+        except FileExistsError as e:
+            pass
+
+        self._values = {}
+        self._dirty = False
+        self._synced_at = time.time()
+
+        self._reconcile()
+
+        # Every update is synced right away without interval
+        self._sync_thread = None
+        if sync_interval_sec > 0:
+            self._sync_thread = CheckpointSyncThread(self, sync_interval_sec)
+            self._sync_thread.start()
+
+    def _reconcile(self) -> None:
+        """Merge the local journal with the shadow
+
+        The journal is written on every update, so it is never older than the shadow and wins.
+        The shadow restores the checkpoint when the journal is lost (e.g. device replaced),
+        except the local keys.
+        """
+        shadow_values = self._shadow.get_thing_shadow_request()
+        self._stale_keys = self._local_keys & shadow_values.keys()
+        self._values = {
+            key: value
+            for key, value in shadow_values.items()
+            if key not in self._local_keys
+        }
+        self._values.update(self._read_journal())
+
+        self._dirty = (
+            self._shadow_values() != shadow_values or len(self._stale_keys) > 0
+        )
+        if self._dirty:
+            logger.info(
+                f"checkpoint {self._path} is ahead of the shadow: {self._values}"
+            )
+            self._sync()
+
+    def _read_journal(self) -> dict:
+        try:
+            with open(self._path, "r") as f:
+                return json.load(f)
+        except FileNotFoundError as e:
+            return {}
+        except ValueError as e:
+            logger.warning(f"ignore broken checkpoint journal {self._path}: {e}")
+            return {}
+
+    def _write_journal(self) -> None:
+        """Atomically replace the journal with the current values"""
+        temp_path = f"{self._path}.tmp"
+        with open(temp_path, "w") as f:
+            json.dump(self._values, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self._path)
+
+    def get(self, key: str, default: Any = None) -> Any:
+        """Get a checkpoint value"""
+        with self._lock:
+            return self._values.get(key, default)
+
+    def update(self, values: dict) -> None:
+        """Journal checkpoint values and sync them to the shadow if the interval has elapsed
+
+        Parameters
+        ----------
+        values: dict
+            Values to update
+        """
+        with self._lock:
+            self._values.update(values)
+            self._write_journal()
+            self._dirty = True
+
+            if time.time() - self._synced_at >= self._sync_interval_sec:
+                self._sync()
+
+    def sync(self) -> None:
+        """Sync the checkpoint to the shadow now"""
+        with self._lock:
+            self._sync()
+
+    def close(self) -> None:
+        """Sync the last checkpoint to the shadow"""
+        if self._sync_thread is not None:
+            self._sync_thread.stop()
+        self.sync()
+
+    def _sync(self) -> None:
+        if not self._dirty:
+            return
+
+        self._synced_at = time.time()
+        try:
+            # A null value deletes the key from the reported state
+            self._shadow.update_thing_shadow_request(
+                {
+                    **self._shadow_values(),
+                    **{key: None for key in self._stale_keys},
+                }
+            )
+            self._dirty = False
+            self._stale_keys = set()
+        except Exception as e:
+            # The journal holds the checkpoint, retry on the next update
+            logger.warning(f"failed to sync checkpoint to the shadow: {e}")
+
+    def _shadow_values(self) -> dict:
+        """Values synced to the shadow (without the local keys)"""
+        return {
+            key: value
+            for key, value in self._values.items()
+            if key not in self._local_keys
+        }
+
+
+class CheckpointSyncThread(Thread):
+    """Syncs a checkpoint store to the shadow at a fixed interval"""
+
+    def __init__(self, store: CheckpointStore, interval_sec: int):
+        """
+        Parameters
+        ----------
+        store: CheckpointStore
+            Store to sync (nothing is sent when it has not been updated)
+        interval_sec: int
+            Interval between syncs (in seconds)
+        """
+        Thread.__init__(self)
+        self._store = store
+        self._interval_sec = interval_sec
+        self._stopped = Event()
+        self.setDaemon(True)
+
+    def run(self):
+        while not self._stopped.wait(self._interval_sec):
+            self._store.sync()
+
+    def stop(self):
+        self._stopped.set()
@@ -0,0 +1,279 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import json
+import logging
+import os
+import platform
+import queue
+import shutil
+import time
+from threading import Condition, Thread
+from typing import List
+
+from stream_manager import (
+    InvalidRequestException,
+    MessageStreamDefinition,
+    NotEnoughMessagesException,
+    ReadMessagesOptions,
+    ResourceNotFoundException,
+    S3ExportTaskDefinition,
+    Status,
+    StatusContext,
+    StatusLevel,
+    StatusMessage,
+    StrategyOnFull,
+    StreamManagerException,
+)
+from stream_manager.data import EventType, Message, MessageStreamInfo
+from stream_manager.util import Util
+
+# Shared by opc-archiver and file-watcher (kept in `components/common`)
+logger = logging.getLogger(__name__)
+
+# Directory of the user metadata of the exported objects (`{bucket}/{key}.json`)
+METADATA_DIR = ".metadata"
+
+
+class _LocalStream:
+    """Messages of a stream kept in memory"""
+
+    def __init__(self, definition: MessageStreamDefinition):
+        self.definition = definition
+        self.messages: List[Message] = []
+        self.head = 0  # Index of the oldest message in `messages`
+        self.next_sequence_number = 0
+        self.total_bytes = 0
+
+    @property
+    def oldest_sequence_number(self) -> int:
+        if self.head >= len(self.messages):
+            return None
+        return self.messages[self.head].sequence_number
+
+    @property
+    def newest_sequence_number(self) -> int:
+        if self.head >= len(self.messages):
+            return None
+        return self.messages[-1].sequence_number
+
+    def append(self, data: bytes) -> int:
+        max_size = self.definition.max_size
+        if max_size and self.total_bytes + len(data) > max_size:
+            if self.definition.strategy_on_full != StrategyOnFull.OverwriteOldestData:
+                raise StreamManagerException(
+                    f"stream {self.definition.name} is full", status=None
+                )
+            while self.head < len(self.messages) and (
+                self.total_bytes + len(data) > max_size
+            ):
+                self.total_bytes -= len(self.messages[self.head].payload)
+                self.head += 1
+            if self.head > len(self.messages) // 2:
+                del self.messages[: self.head]
+                self.head = 0
+
+        message = Message(
+            stream_name=self.definition.name,
+            sequence_number=self.next_sequence_number,
+            ingest_time=int(time.time() * 1000),
+            payload=data,
+        )
+        self.messages.append(message)
+        self.total_bytes += len(data)
+        self.next_sequence_number += 1
+
+        return message.sequence_number
+
+    def read(self, start: int, max_count: int) -> List[Message]:
+        oldest = self.oldest_sequence_number
+        if oldest is None:
+            return []
+
+        index = self.head + max(0, start - oldest)
+        return self.messages[index : index + max_count]
+
+
+class LocalStreamManagerClient:
+    """Stand-in for `StreamManagerClient` that runs in the process, without Greengrass
+
+    Streams are kept in memory with the `max_size` and `strategy_on_full` of their
+    definition. Files appended to a stream with an S3 export definition are copied to
+    `{export_dir}/{bucket}/{key}` by a background thread, which writes the export
+    statuses to the status stream, as the Stream Manager S3 export does.
+    Only the part of the client used by the components is implemented.
+    """
+
+    def __init__(self, export_dir: str):
+        """
+        Parameters
+        ----------
+        export_dir: str
+            Local directory standing in for S3 (one sub-directory per bucket)
+        """
+        self._export_dir = export_dir
+        self._streams = {}
+        self._condition = Condition()
+        self._export_queue = queue.Queue()
+        self._file_url_separator = ":///" if platform.system() == "Windows" else ":"
+        self._closed = False
+
+        self._export_thread = Thread(target=self._export, daemon=True)
+        self._export_thread.start()
+
+    def create_message_stream(self, definition: MessageStreamDefinition) -> None:
+        with self._condition:
+            if definition.name in self._streams:
+                raise InvalidRequestException(
+                    f"stream {definition.name} already exists", status=None
+                )
+            self._streams[definition.name] = _LocalStream(definition)
+
+    def update_message_stream(self, definition: MessageStreamDefinition) -> None:
+        with self._condition:
+            self._get_stream(definition.name).definition = definition
+
+    def delete_message_stream(self, stream_name: str) -> None:
+        with self._condition:
+            self._get_stream(stream_name)
+            del self._streams[stream_name]
+
+    def list_streams(self) -> List[str]:
+        with self._condition:
+            return list(self._streams)
+
+    def describe_message_stream(self, stream_name: str) -> MessageStreamInfo:
+        with self._condition:
+            stream = self._get_stream(stream_name)
+            return MessageStreamInfo(
+                definition=stream.definition,
+                storage_status=MessageStreamInfo.storageStatus(
+                    oldest_sequence_number=stream.oldest_sequence_number,
+                    newest_sequence_number=stream.newest_sequence_number,
+                    total_bytes=stream.total_bytes,
+                ),
+            )
+
+    def append_message(self, stream_name: str, data: bytes) -> int:
+        with self._condition:
+            stream = self._get_stream(stream_name)
+            sequence_number = stream.append(data)
+            self._condition.notify_all()
+
+        export_definition = stream.definition.export_definition
+        if export_definition is not None and export_definition.s3_task_executor:
+            self._export_queue.put((stream, sequence_number, data))
+
+        return sequence_number
+
+    def read_messages(
+        self, stream_name: str, options: ReadMessagesOptions = None
+    ) -> List[Message]:
+        """Read messages with the semantics of `StreamManagerClient.read_messages`
+
+        Waits up to `read_timeout_millis` for `min_message_count` messages and raises
+        `NotEnoughMessagesException` if there are still not enough of them. As with
+        StreamManager, a single message is returned when `max_message_count` is not set.
+        """
+        options = options or ReadMessagesOptions()
+        start = options.desired_start_sequence_number or 0
+        min_count = options.min_message_count or 1
+        max_count = options.max_message_count or 1
+        deadline = time.time() + (options.read_timeout_millis or 0) / 1000
+
+        with self._condition:
+            while True:
+                messages = self._get_stream(stream_name).read(start, max_count)
+                remaining = deadline - time.time()
+                if len(messages) >= min_count or remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+
+        if len(messages) < min_count:
+            raise NotEnoughMessagesException(
+                f"not enough messages in {stream_name} from {start}", status=None
+            )
+
+        return messages
+
+    def close(self) -> None:
+        self._closed = True
+        self._export_queue.put(None)
+
+    def _get_stream(self, stream_name: str) -> _LocalStream:
+        stream = self._streams.get(stream_name)
+        if stream is None:
+            raise ResourceNotFoundException(
+                f"stream {stream_name} not found", status=None
+            )
+        return stream
+
+    def _export(self) -> None:
+        while not self._closed:
+            item = self._export_queue.get()
+            if item is None:
+                break
+
+            stream, sequence_number, data = item
+            try:
+                task = Util.deserialize_json_bytes_to_obj(data, S3ExportTaskDefinition)
+            except Exception as e:
+                logger.warning(
+                    f"invalid s3 export task in {stream.definition.name}: {e}"
+                )
+                continue
+
+            self._write_status(stream, sequence_number, task, Status.InProgress)
+            try:
+                self._copy(task)
+                self._write_status(stream, sequence_number, task, Status.Success)
+            except OSError as e:
+                self._write_status(stream, sequence_number, task, Status.Failure, e)
+
+    def _copy(self, task: S3ExportTaskDefinition) -> None:
+        path = task.input_url.split(self._file_url_separator, 1)[1]
+        # Keys may start with a slash (kept under the bucket directory)
+        key = task.key.lstrip("/")
+        dest = os.path.join(self._export_dir, task.bucket, key)
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        shutil.copyfile(path, dest)
+
+        if task.user_metadata:
+            metadata_path = os.path.join(
+                self._export_dir, METADATA_DIR, task.bucket, f"{key}.json"
+            )
+            os.makedirs(os.path.dirname(metadata_path), exist_ok=True)
+            with open(metadata_path, "w") as f:
+                json.dump(task.user_metadata, f)
+
+    def _write_status(
+        self,
+        stream: _LocalStream,
+        sequence_number: int,
+        task: S3ExportTaskDefinition,
+        status: Status,
+        error: Exception = None,
+    ) -> None:
+        for executor in stream.definition.export_definition.s3_task_executor:
+            if executor.status_config is None:
+                continue
+
+            status_message = StatusMessage(
+                event_type=EventType.S3Task,
+                status_level=(
+                    StatusLevel.ERROR if status == Status.Failure else StatusLevel.INFO
+                ),
+                status=status,
+                status_context=StatusContext(
+                    s3_export_task_definition=task,
+                    export_identifier=executor.identifier,
+                    stream_name=stream.definition.name,
+                    sequence_number=sequence_number,
+                ),
+                message=str(error) if error else None,
+                timestamp_epoch_ms=int(time.time() * 1000),
+            )
+            self.append_message(
+                executor.status_config.status_stream_name,
+                Util.validate_and_serialize_to_json_bytes(status_message),
+            )
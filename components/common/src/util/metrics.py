@@ -0,0 +1,325 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import bisect
+import json
+import logging
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread
+from typing import Dict, List, Tuple
+
+# Shared by the components (kept in `components/common`, copied into each of them when
+# it is built): the logger of opc-archiver and rdb-exporter, propagated to the root
+# logger in file-watcher
+logger = logging.getLogger(__name__)
+
+# EMF records must be alone on their log lines to be extracted by CloudWatch, so they
+# are written to stdout without the prefix of the component log format
+emf_logger = logging.getLogger("emf")
+emf_logger.propagate = False
+emf_logger.setLevel(logging.INFO)
+if len(emf_logger.handlers) == 0:
+    _emf_handler = logging.StreamHandler(sys.stdout)
+    _emf_handler.setFormatter(logging.Formatter("%(message)s"))
+    emf_logger.addHandler(_emf_handler)
+
+METRICS_PATH = "/metrics"
+METRICS_HOST = "127.0.0.1"
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Upper bounds of the histogram buckets (seconds)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+class Counter:
+    """Monotonically increasing value"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._value = 0
+
+    def inc(self, amount: float = 1) -> None:
+        with self._lock:
+            self._value += amount
+
+    @property
+    def value(self) -> float:
+        return self._value
+
+
+class Gauge:
+    """Value that can go up and down"""
+
+    def __init__(self):
+        self._value = 0
+
+    def set(self, value: float) -> None:
+        self._value = value
+
+    @property
+    def value(self) -> float:
+        return self._value
+
+
+class Histogram:
+    """Distribution of observed values in cumulative buckets"""
+
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self._lock = threading.Lock()
+        self._upper_bounds = list(buckets)
+        self._counts = [0] * (len(buckets) + 1)  # Last one is `+Inf`
+        self._sum = 0.0
+        self._count = 0
+
+    def observe(self, value: float) -> None:
+        index = bisect.bisect_left(self._upper_bounds, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+            self._count += 1
+
+    def time(self) -> "_Timer":
+        """Observe the time (in seconds) spent in a `with` block"""
+        return _Timer(self)
+
+    def snapshot(self) -> Tuple[List[Tuple[str, int]], float, int]:
+        """Cumulative counts per upper bound, sum and count of the observed values"""
+        with self._lock:
+            counts = list(self._counts)
+            total, count = self._sum, self._count
+
+        cumulative = []
+        running = 0
+        for upper_bound, bucket_count in zip(self._upper_bounds + ["+Inf"], counts):
+            running += bucket_count
+            cumulative.append((str(upper_bound), running))
+
+        return cumulative, total, count
+
+
+class _Timer:
+    def __init__(self, histogram: Histogram):
+        self._histogram = histogram
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        self._histogram.observe(time.perf_counter() - self._start)
+
+
+class MetricsRegistry:
+    """In-process registry of the metrics of a component
+
+    Metrics are identified by their name and labels, and exported as Prometheus text
+    or as CloudWatch embedded metric format (EMF) records.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics: Dict[str, Tuple[str, str, dict]] = {}
+
+    def counter(self, name: str, description: str, labels: dict = None) -> Counter:
+        return self._get(name, description, "counter", labels, Counter)
+
+    def gauge(self, name: str, description: str, labels: dict = None) -> Gauge:
+        return self._get(name, description, "gauge", labels, Gauge)
+
+    def histogram(
+        self,
+        name: str,
+        description: str,
+        labels: dict = None,
+        buckets: Tuple[float, ...] = DEFAULT_BUCKETS,
+    ) -> Histogram:
+        return self._get(
+            name, description, "histogram", labels, lambda: Histogram(buckets)
+        )
+
+    def _get(
+        self, name: str, description: str, kind: str, labels: dict, factory
+    ) -> object:
+        key = tuple(sorted((labels or {}).items()))
+        with self._lock:
+            if name not in self._metrics:
+                self._metrics[name] = (description, kind, {})
+            description_, kind_, series = self._metrics[name]
+            if kind_ != kind:
+                raise ValueError(f"{name} is already registered as a {kind_}")
+            if key not in series:
+                series[key] = factory()
+
+            return series[key]
+
+    def _items(self) -> List[Tuple[str, str, str, list]]:
+        with self._lock:
+            return [
+                (name, description, kind, list(series.items()))
+                for name, (description, kind, series) in sorted(self._metrics.items())
+            ]
+
+    def render_prometheus(self) -> str:
+        """Render all the metrics in the Prometheus text exposition format"""
+        lines = []
+        for name, description, kind, series in self._items():
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, metric in series:
+                if kind == "histogram":
+                    buckets, total, count = metric.snapshot()
+                    for upper_bound, cumulative in buckets:
+                        bucket_labels = labels + (("le", upper_bound),)
+                        lines.append(
+                            f"{name}_bucket{_format_labels(bucket_labels)} {cumulative}"
+                        )
+                    lines.append(f"{name}_sum{_format_labels(labels)} {total}")
+                    lines.append(f"{name}_count{_format_labels(labels)} {count}")
+                else:
+                    lines.append(f"{name}{_format_labels(labels)} {metric.value}")
+
+        return "\n".join(lines) + "\n"
+
+    def emf_records(self, namespace: str) -> List[dict]:
+        """Build one EMF record per label set with the current value of the metrics
+
+        Histograms are reported as their `_sum` and `_count`.
+        """
+        records = {}
+        for name, description, kind, series in self._items():
+            for labels, metric in series:
+                record = records.setdefault(labels, {})
+                if kind == "histogram":
+                    buckets, total, count = metric.snapshot()
+                    record[f"{name}_sum"] = total
+                    record[f"{name}_count"] = count
+                else:
+                    record[name] = metric.value
+
+        timestamp = int(time.time() * 1000)
+        emf_records = []
+        for labels, values in records.items():
+            dimensions = [key for key, value in labels]
+            emf_records.append(
+                {
+                    "_aws": {
+                        "Timestamp": timestamp,
+                        "CloudWatchMetrics": [
+                            {
+                                "Namespace": namespace,
+                                "Dimensions": [dimensions],
+                                "Metrics": [
+                                    {"Name": name, "Unit": _unit(name)}
+                                    for name in values
+                                ],
+                            }
+                        ],
+                    },
+                    **dict(labels),
+                    **values,
+                }
+            )
+
+        return emf_records
+
+
+def _format_labels(labels: tuple) -> str:
+    if not labels:
+        return ""
+
+    formatted = [f'{key}="{_escape(str(value))}"' for key, value in labels]
+    return "{" + ",".join(formatted) + "}"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _unit(name: str) -> str:
+    if name.endswith("_seconds") or name.endswith("_seconds_sum"):
+        return "Seconds"
+    if name.endswith("_bytes") or name.endswith("_bytes_total"):
+        return "Bytes"
+    if name.endswith("_ratio"):
+        return "None"
+
+    return "Count"
+
+
+# Registry shared by the modules of the component
+REGISTRY = MetricsRegistry()
+
+
+class _MetricsRequestHandler(BaseHTTPRequestHandler):
+    registry = REGISTRY
+
+    def do_GET(self):
+        if self.path.split("?")[0] != METRICS_PATH:
+            self.send_error(404)
+            return
+
+        body = self.registry.render_prometheus().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", PROMETHEUS_CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug(f"metrics request: {format % args}")
+
+
+def start_http_server(
+    port: int, host: str = METRICS_HOST, registry: MetricsRegistry = REGISTRY
+) -> ThreadingHTTPServer:
+    """Serve the metrics as Prometheus text on `http://{host}:{port}/metrics` in a daemon thread"""
+    handler = type(
+        "MetricsRequestHandler", (_MetricsRequestHandler,), {"registry": registry}
+    )
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    thread = Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    logger.info(f"metrics served on http://{host}:{port}{METRICS_PATH}")
+
+    return server
+
+
+class EmfLogThread(Thread):
+    """
+    Periodically writes the metrics as CloudWatch embedded metric format (EMF) log lines
+
+    Each record is a raw JSON line on stdout (no log prefix).
+    """
+
+    def __init__(
+        self, namespace: str, interval_sec: int, registry: MetricsRegistry = REGISTRY
+    ):
+        """
+        Parameters
+        ----------
+        namespace: str
+            CloudWatch namespace of the metrics
+        interval_sec: int
+            Interval to write the metrics (in seconds)
+        registry: MetricsRegistry
+            Registry of the metrics
+        """
+        Thread.__init__(self)
+
+        self._namespace = namespace
+        self._interval_sec = interval_sec
+        self._registry = registry
+        self.setDaemon(True)
+
+    def run(self):
+        while True:
+            time.sleep(self._interval_sec)
+            try:
+                for record in self._registry.emf_records(self._namespace):
+                    emf_logger.info(json.dumps(record))
+            except Exception as e:
+                logger.warning(f"failed to write metrics: {e}")
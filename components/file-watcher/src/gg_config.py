@@ -3,6 +3,7 @@
 
 import logging
 import os
+from typing import List
 
 from awsiot.greengrasscoreipc.clientv2 import GreengrassCoreIPCClientV2
 from cerberus import Validator
@@ -12,10 +13,31 @@ logger = logging.getLogger()
 CONFIG_LOG_LEVEL = "LogLevel"
 CONFIG_TARGET_DIR = "TargetDir"
 CONFIG_FILE_PATTERN = "FilePattern"
+CONFIG_FILE_PATTERNS = "FilePatterns"
+CONFIG_EXCLUDE_PATTERNS = "ExcludePatterns"
+CONFIG_TAIL_PATTERNS = "TailPatterns"
+CONFIG_TAIL_INTERVAL_SEC = "TailIntervalSec"
+CONFIG_EXCLUDE_DIRS = "ExcludeDirs"
+CONFIG_SCAN_MAX_DEPTH = "ScanMaxDepth"
+CONFIG_SCAN_WORKERS = "ScanWorkers"
 CONFIG_S3_BUCKET = "Bucket"
 CONFIG_BUCKET_KEY_PREFIX = "BucketPrefix"
 CONFIG_DELETE_MV_FILES = "DeleteMovedFiles"
 CONFIG_CHECK_INTERVAL_SEC = "CheckIntervalSec"
+CONFIG_SETTLE_SEC = "SettleSec"
+CONFIG_FILE_INDEX_PATH = "FileIndexPath"
+CONFIG_OBSERVER_BACKEND = "ObserverBackend"
+CONFIG_METRICS_PORT = "MetricsPort"
+CONFIG_METRICS_EMF_INTERVAL_SEC = "MetricsEmfIntervalSec"
+
+# Index of the handed off files, in the home directory of the user running the
+# component: outside the `work` directory, the default target directory
+DEFAULT_FILE_INDEX_PATH = "~/.file-watcher/index.db"
+
+OBSERVER_AUTO = "auto"  # inotify, except on network filesystems and outside Linux
+OBSERVER_INOTIFY = "inotify"
+OBSERVER_POLLING = "polling"
+OBSERVER_BACKENDS = [OBSERVER_AUTO, OBSERVER_INOTIFY, OBSERVER_POLLING]
 
 
 class GGConfig:
@@ -23,10 +45,56 @@ class GGConfig:
         config_schema = {
             CONFIG_TARGET_DIR: {"type": "string", "required": True},
             CONFIG_FILE_PATTERN: {"type": "string", "default": "*"},
+            # Other globs of the files to upload, and globs of the files and directories to skip
+            CONFIG_FILE_PATTERNS: {
+                "type": "list",
+                "default": [],
+                "schema": {"type": "string", "empty": False},
+            },
+            CONFIG_EXCLUDE_PATTERNS: {
+                "type": "list",
+                "default": [],
+                "schema": {"type": "string", "empty": False},
+            },
+            # Globs of the growing files uploaded incrementally (only the lines appended)
+            CONFIG_TAIL_PATTERNS: {
+                "type": "list",
+                "default": [],
+                "schema": {"type": "string", "empty": False},
+            },
+            CONFIG_TAIL_INTERVAL_SEC: {"type": "number", "min": 1, "default": 10},
+            CONFIG_EXCLUDE_DIRS: {
+                "type": "list",
+                "default": [],
+                "schema": {"type": "string", "empty": False},
+            },
+            CONFIG_SCAN_MAX_DEPTH: {"type": "integer", "min": 0, "default": 0},
+            CONFIG_SCAN_WORKERS: {"type": "integer", "min": 0, "default": 0},
             CONFIG_S3_BUCKET: {"type": "string", "required": True},
             CONFIG_BUCKET_KEY_PREFIX: {"type": "string"},
             CONFIG_DELETE_MV_FILES: {"type": "boolean", "default": True},
             CONFIG_CHECK_INTERVAL_SEC: {"type": "integer", "default": 0},
+            CONFIG_SETTLE_SEC: {"type": "number", "min": 0, "default": 5},
+            CONFIG_OBSERVER_BACKEND: {
+                "type": "string",
+                "default": OBSERVER_AUTO,
+                "allowed": OBSERVER_BACKENDS,
+            },
+            CONFIG_FILE_INDEX_PATH: {
+                "type": "string",
+                "default": DEFAULT_FILE_INDEX_PATH,
+            },
+            CONFIG_METRICS_PORT: {
+                "type": "integer",
+                "min": 0,
+                "max": 65535,
+                "default": 0,
+            },
+            CONFIG_METRICS_EMF_INTERVAL_SEC: {
+                "type": "integer",
+                "min": 0,
+                "default": 0,
+            },
             CONFIG_LOG_LEVEL: {
                 "type": "string",
                 "default": "info",
@@ -61,6 +129,39 @@ class GGConfig:
     def file_pattern(self) -> str:
         return self._config[CONFIG_FILE_PATTERN]
 
+    @property
+    def file_patterns(self) -> List[str]:
+        """`FilePattern` followed by the other `FilePatterns`"""
+        patterns = [self.file_pattern]
+        for pattern in self._config[CONFIG_FILE_PATTERNS]:
+            if pattern not in patterns:
+                patterns.append(pattern)
+        return patterns
+
+    @property
+    def exclude_patterns(self) -> List[str]:
+        return self._config[CONFIG_EXCLUDE_PATTERNS]
+
+    @property
+    def tail_patterns(self) -> List[str]:
+        return self._config[CONFIG_TAIL_PATTERNS]
+
+    @property
+    def tail_interval_sec(self) -> float:
+        return self._config[CONFIG_TAIL_INTERVAL_SEC]
+
+    @property
+    def exclude_dirs(self) -> List[str]:
+        return self._config[CONFIG_EXCLUDE_DIRS]
+
+    @property
+    def scan_max_depth(self) -> int:
+        return self._config[CONFIG_SCAN_MAX_DEPTH]
+
+    @property
+    def scan_workers(self) -> int:
+        return self._config[CONFIG_SCAN_WORKERS]
+
     @property
     def bucket(self) -> str:
         return self._config[CONFIG_S3_BUCKET]
@@ -77,6 +178,26 @@ class GGConfig:
     def check_interval_sec(self) -> int:
         return self._config[CONFIG_CHECK_INTERVAL_SEC]
 
+    @property
+    def settle_sec(self) -> float:
+        return self._config[CONFIG_SETTLE_SEC]
+
+    @property
+    def observer_backend(self) -> str:
+        return self._config[CONFIG_OBSERVER_BACKEND]
+
+    @property
+    def file_index_path(self) -> str:
+        return os.path.abspath(os.path.expanduser(self._config[CONFIG_FILE_INDEX_PATH]))
+
+    @property
+    def metrics_port(self) -> int:
+        return self._config[CONFIG_METRICS_PORT]
+
+    @property
+    def metrics_emf_interval_sec(self) -> int:
+        return self._config[CONFIG_METRICS_EMF_INTERVAL_SEC]
+
     @property
     def log_level(self) -> str:
         return self._config[CONFIG_LOG_LEVEL]
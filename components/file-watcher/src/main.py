@@ -1,15 +1,21 @@
 # Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
 # SPDX-License-Identifier: MIT-0
 
-import fnmatch
 import logging
 import os
-import re
 import time
+from threading import Lock
+from typing import List, Tuple
 
-from gg_config import GGConfig
+from gg_config import OBSERVER_AUTO, OBSERVER_INOTIFY, OBSERVER_POLLING, GGConfig
 from stream.s3_stream import S3ExportStream
+from util.file_index import STATE_UPLOADED, FileIndex
+from util.inotify_observer import InotifyObserver, inotify_supported
+from util.metrics import REGISTRY, EmfLogThread, start_http_server
+from util.settle_queue import SettleQueue
 from util.shadow import ShadowController
+from util.tail_reader import TailPollThread, TailReader
+from util.tree_scanner import TreeScanner
 from watchdog.events import FileSystemEvent, PatternMatchingEventHandler
 from watchdog.observers.polling import PollingObserver
 
@@ -21,80 +27,247 @@ handler.setFormatter(
 )
 logger.addHandler(handler)
 
+METRICS_NAMESPACE = "IndustrialDataPlatform/file-watcher"
+# Shadow of the last check time of the versions without the file index
+LEGACY_SHADOW_NAME = "latest_check_time"
+LEGACY_SHADOW_PROP_NAME = "latest_time"
+
+FILES_SCANNED = REGISTRY.counter(
+    "file_watcher_files_scanned_total", "Files checked by the directory walks"
+)
+FILES_APPENDED = REGISTRY.counter(
+    "file_watcher_files_appended_total", "Files handed off for upload"
+)
+WALK_SECONDS = REGISTRY.histogram(
+    "file_watcher_walk_seconds", "Time to walk the target directory"
+)
+
 
 class FileStreamAppender:
     """
     Class to add files to Stream Manager
+
+    The files handed off are recorded in a persistent index, so that only the files
+    new or changed since they were handed off are added again (also after a restart).
+    The files uploaded incrementally (`TailPatterns`) are added as parts of the lines
+    appended since the last hand-off, polled at `TailIntervalSec` (not settled).
     """
 
-    def __init__(self, config: GGConfig, stream: S3ExportStream):
+    def __init__(
+        self,
+        config: GGConfig,
+        stream: S3ExportStream,
+        index: FileIndex,
+        tail_reader: TailReader = None,
+        uploaded_before: float = 0,
+    ):
+        """
+        @param uploaded_before: float Files not modified since this time are recorded as
+            uploaded by the first scan, without being handed off (last check time of a
+            version without the index)
+        """
         self._stream = stream
+        self._uploaded_before = uploaded_before
         self._config = config
-        self._target_dir_len = len(config.target_dir) + 1
+        self._index = index
+        self._tail_reader = tail_reader
+        # The paths of the scans and events are absolute, the keys are relative to it
+        self._target_dir_len = len(os.path.abspath(config.target_dir)) + 1
         self._key_prefix = config.bucket_prefix
-        self._includes = r"|".join(
-            [fnmatch.translate(x) for x in [self._config.file_pattern]]
+        self._scanner = TreeScanner(
+            config.target_dir,
+            config.file_patterns,
+            config.exclude_patterns,
+            config.exclude_dirs,
+            config.scan_max_depth,
+            config.scan_workers,
         )
-        self._latest_check_time = 0
+        # Files still written are handed off once complete (from the events and the scans)
+        self._append_lock = Lock()
+        self._settle_queue = None
+        if config.settle_sec > 0:
+            self._settle_queue = SettleQueue(config.settle_sec, self.append_file)
+            self._settle_queue.start()
+        if self._tail_reader is not None:
+            # Parts left in the spool by the previous run (given up or not recorded)
+            with self._append_lock:
+                self._tail_reader.hand_off_parts(
+                    self._stream.append_message, leftover=True
+                )
+            if len(config.tail_patterns) > 0:
+                TailPollThread(config.tail_interval_sec, self.poll_tails).start()
 
     def check(self, interval: int):
         """
         Checks for file updates at specified intervals
         @param interval: int
         """
-        shadow = ShadowController("latest_check_time")
         try:
-            latestConfig = shadow.get_thing_shadow_request()
-            if latestConfig is not None:
-                self._latest_check_time = (
-                    latestConfig.get("state", {})
-                    .get("reported", {})
-                    .get("latest_time", 0)
-                )
-
             while True:
-                self._latest_check_time = self.check_files(self._latest_check_time)
+                self.check_files()
                 time.sleep(interval)
         except (KeyboardInterrupt, SystemExit):
             pass
-        finally:
-            # Last check time is persisted in Shadow
-            shadow.update_thing_shadow_request({"latest_time": self._latest_check_time})
 
-    def check_modified(self, last_check_time: float, path: str):
+    def check_files(self, top: str = None):
+        """
+        Add the files under the target directory that are new or changed to the Stream
+
+        The files modified within the settle period are handed off once complete.
+        The files not found anymore are removed from the index, except in the
+        directories that could not be listed.
+        @param top: str Directory to check (the whole target directory if not specified)
+        """
+        top = top if top is not None else self._config.target_dir
+        found = []
+        changed = []
+        uploaded = []
+        with WALK_SECONDS.time():
+            files, failed_directories = self._scanner.scan(top)
+        FILES_SCANNED.inc(len(files))
+        now = time.time()
+        for target_file, stat in files:
+            if self._index.is_index_file(target_file):
+                continue
+            found.append(target_file)
+            tailed = self.is_tailed(target_file)
+            if tailed:
+                # Polled as well, to flush its last line once settled
+                self._tail_reader.watch(target_file)
+            if not self._index.is_changed(target_file, stat):
+                continue
+            if not tailed and stat.st_mtime <= self._uploaded_before:
+                uploaded.append((target_file, stat))
+            elif (
+                not tailed
+                and self._settle_queue is not None
+                and now - stat.st_mtime < self._config.settle_sec
+            ):
+                self._settle_queue.submit(target_file)
+            else:
+                changed.append((target_file, stat))
+
+        if len(uploaded) > 0:
+            logger.info(
+                f"{len(uploaded)} files already uploaded before {self._uploaded_before}"
+            )
+            self._index.record_appended(uploaded, STATE_UPLOADED)
+        self._uploaded_before = 0
+        self.append_files(changed)
+        self._index.prune(found, top, failed_directories)
+
+    def poll_tails(self):
+        """
+        Add the lines appended to the files uploaded incrementally, and the parts
+        given up by the export, to the Stream
         """
-        Check if the file modification date is later than the last confirmation
-        @param last_check_time: float
+        with self._append_lock:
+            self._tail_reader.hand_off_parts(self._stream.append_message)
+
+        files = []
+        for path in self._tail_reader.active_paths():
+            try:
+                files.append((path, os.stat(path)))
+            except FileNotFoundError as e:
+                self._tail_reader.forget(path)
+        self.append_files(files)
+
+    def is_included(self, path: str) -> bool:
+        """
+        Whether a file matches the patterns of the files to upload
+        (never the index of the component, nor its spooled parts)
+        @param path: str
+        """
+        return not self._index.is_index_file(path) and self._scanner.is_included(path)
+
+    def is_directory_included(self, path: str) -> bool:
+        """
+        Whether the files of a directory can be uploaded (not excluded nor too deep)
         @param path: str
         """
-        return last_check_time < os.path.getmtime(path)
+        return self._scanner.is_directory_included(path)
 
-    def check_files(self, latest_check_time: int = 0):
+    def is_tailed(self, path: str) -> bool:
         """
-        Add updated files under the target directory to the Stream
-        @param latest_check_time: int
+        Whether a file is uploaded incrementally (only the lines appended)
+        @param path: str
         """
-        check_time = time.time()
-        for root, _, files in os.walk(top=self._config.target_dir):
-            files = [f for f in files if re.match(self._includes, f)]
-            for file in files:
-                target_file = os.path.join(root, file)
-                if latest_check_time == 0 or self.check_modified(target_file):
-                    self.append_file(target_file)
+        return self._tail_reader is not None and self._tail_reader.is_tailed(path)
 
-        return check_time
+    def submit_file(self, path: str, closed: bool = False):
+        """
+        Hand off a file reported by an event once it is complete
+        (events of the same file are merged)
+        @param path: str
+        @param closed: bool Whether the file was closed after write (complete now)
+        """
+        # Same path as the scans, with which the index and the settle queue are keyed
+        path = os.path.abspath(path)
+        if self.is_tailed(path):
+            # Never settled while growing, polled instead (flushed now if closed)
+            self._tail_reader.watch(path)
+            if closed:
+                self.append_file(path, closed)
+        elif self._settle_queue is None:
+            self.append_file(path)
+        else:
+            self._settle_queue.submit(path, closed)
 
-    def append_file(self, path: str):
+    def append_file(self, path: str, closed: bool = False):
         """
-        Adding files to Stream manager
+        Adding a file to Stream manager if it is new or changed
         @param path: str
+        @param closed: bool Whether the file was closed after write
         """
-        key = (
-            path[self._target_dir_len :]
-            if not self._key_prefix
-            else f"{self._key_prefix}/{path[self._target_dir_len:]}"
-        )
-        self._stream.append_message(path, key)
+        path = os.path.abspath(path)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError as e:
+            return
+
+        self.append_files([(path, stat)], closed)
+
+    def append_files(
+        self, files: List[Tuple[str, os.stat_result]], closed: bool = False
+    ):
+        """
+        Adding the files new or changed to Stream manager and recording them in the index
+
+        The files uploaded incrementally are handed off whenever lines were appended,
+        with their last line once closed or unchanged for the settle period.
+        @param files: List[Tuple[str, os.stat_result]] (path, stat of the file)
+        @param closed: bool Whether the files were closed after write
+        """
+        now = time.time()
+        # Checked again, the same file may be handed off by a scan and the settle queue.
+        # The index itself is never handed off (its commits would be uploaded in a loop)
+        with self._append_lock:
+            files = [
+                (path, stat)
+                for path, stat in files
+                if not self._index.is_index_file(path)
+                and (self.is_tailed(path) or self._index.is_changed(path, stat))
+            ]
+            for path, stat in files:
+                key = (
+                    path[self._target_dir_len :]
+                    if not self._key_prefix
+                    else f"{self._key_prefix}/{path[self._target_dir_len:]}"
+                )
+                if self.is_tailed(path):
+                    self._tail_reader.hand_off(
+                        path,
+                        stat,
+                        key,
+                        self._stream.append_message,
+                        closed or now - stat.st_mtime >= self._config.settle_sec,
+                    )
+                else:
+                    self._stream.append_message(path, key)
+                FILES_APPENDED.inc()
+
+            if len(files) > 0:
+                self._index.record_appended(files)
 
 
 class FileWatchHandler(PatternMatchingEventHandler):
@@ -102,34 +275,115 @@ class FileWatchHandler(PatternMatchingEventHandler):
     Handler class to receive new or modified files
     """
 
-    def __init__(self, config: GGConfig, stream: S3ExportStream):
-        super(FileWatchHandler, self).__init__(patterns=[config.file_pattern])
+    def __init__(
+        self,
+        config: GGConfig,
+        stream: S3ExportStream,
+        index: FileIndex,
+        tail_reader: TailReader = None,
+    ):
+        # Filtered with the include and exclude globs of the scans
+        super(FileWatchHandler, self).__init__()
         self._config = config
-        self._file_appender = FileStreamAppender(config, stream)
-        self._file_appender.check_files(0)
+        self._file_appender = FileStreamAppender(config, stream, index, tail_reader)
+        self._file_appender.check_files()
 
     def on_created(self, event: FileSystemEvent):
         """
         @param event: watchdog.events.FileSystemEvent
         """
         basename = os.path.basename(event.src_path)
-        if not basename.startswith(".") and not event.is_directory:
+        if (
+            not basename.startswith(".")
+            and not event.is_directory
+            and self._file_appender.is_included(event.src_path)
+        ):
             logger.info(f"file created: {event}")
-            self._file_appender.append_file(event.src_path)
+            self._file_appender.submit_file(event.src_path)
         return super().on_created(event)
 
     def on_modified(self, event):
         """
         @param event: watchdog.events.FileSystemEvent
         """
-        if not self._config.delete_moved_file:
+        # The files uploaded incrementally are not deleted, their changes are handed off
+        if not self._config.delete_moved_file or self._file_appender.is_tailed(
+            event.src_path
+        ):
             basename = os.path.basename(event.src_path)
-            if not basename.startswith(".") and not event.is_directory:
+            if (
+                not basename.startswith(".")
+                and not event.is_directory
+                and self._file_appender.is_included(event.src_path)
+            ):
                 logger.info(f"file modified: {event}")
-                self._file_appender.append_file(event.src_path)
+                self._file_appender.submit_file(event.src_path)
 
         return super().on_modified(event)
 
+    def on_closed(self, event):
+        """
+        File closed after write (inotify), handed off like a modification
+        @param event: watchdog.events.FileSystemEvent
+        """
+        # The files uploaded incrementally are not deleted, their changes are handed off
+        if not self._config.delete_moved_file or self._file_appender.is_tailed(
+            event.src_path
+        ):
+            basename = os.path.basename(event.src_path)
+            if (
+                not basename.startswith(".")
+                and not event.is_directory
+                and self._file_appender.is_included(event.src_path)
+            ):
+                logger.info(f"file closed: {event}")
+                self._file_appender.submit_file(event.src_path, closed=True)
+
+        return super().on_closed(event)
+
+    def is_directory_included(self, path: str) -> bool:
+        """
+        Whether a directory must be watched
+        @param path: str
+        """
+        return self._file_appender.is_directory_included(path)
+
+    def rescan(self, path: str):
+        """
+        Hand off the new or changed files of a directory whose events may have been lost
+        @param path: str
+        """
+        logger.info(f"rescan {path}")
+        self._file_appender.check_files(path)
+
+
+def create_observer(config: GGConfig, event_handler: FileWatchHandler):
+    """
+    Observer of the target directory for the configured backend
+
+    `auto` uses inotify on Linux, except on network filesystems where the changes
+    made by other hosts are not reported, which are polled.
+    @param config: GGConfig
+    @param event_handler: FileWatchHandler
+    """
+    backend = config.observer_backend
+    if backend == OBSERVER_AUTO:
+        backend = (
+            OBSERVER_INOTIFY
+            if inotify_supported(config.target_dir)
+            else OBSERVER_POLLING
+        )
+    logger.info(f"observe {config.target_dir} with {backend}")
+
+    if backend == OBSERVER_INOTIFY:
+        observer = InotifyObserver(
+            event_handler.rescan, event_handler.is_directory_included
+        )
+    else:
+        observer = PollingObserver()
+    observer.schedule(event_handler, config.target_dir, recursive=True)
+    return observer
+
 
 def main():
     try:
@@ -138,17 +392,51 @@ def main():
 
         config.print_config()
 
+        # Local metrics (Prometheus text endpoint and/or periodic EMF log lines)
+        if config.metrics_port > 0:
+            start_http_server(config.metrics_port)
+        if config.metrics_emf_interval_sec > 0:
+            EmfLogThread(METRICS_NAMESPACE, config.metrics_emf_interval_sec).start()
+
+        # Files handed off, confirmed by the upload statuses of the export stream
+        index = FileIndex(config.file_index_path)
+        uploaded_before = 0
+        if index.created:
+            # Upgrade from a version without the index: the files checked by that
+            # version are not uploaded again
+            uploaded_before = float(
+                ShadowController(LEGACY_SHADOW_NAME)
+                .get_thing_shadow_request()
+                .get(LEGACY_SHADOW_PROP_NAME, 0)
+            )
+        tail_reader = TailReader(index, config.target_dir, config.tail_patterns)
+
+        def record_uploaded(path: str):
+            if tail_reader.is_part(path):
+                tail_reader.record_uploaded(path)
+            else:
+                index.record_uploaded(path)
+
+        def record_failed(path: str):
+            if tail_reader.is_part(path):
+                tail_reader.record_failed(path)
+            else:
+                index.record_failed(path)
+
         stream = S3ExportStream(
             stream_name="com.example.file_watcher.s3",
             bucket=config.bucket,
             delete_moved_file=config.delete_moved_file,
+            uploaded_callback=record_uploaded,
+            failed_callback=record_failed,
+            # Named after the index, so that the scans skip it as well
+            checkpoint_dir=config.file_index_path + ".checkpoint",
         )
 
         if config.check_interval_sec == 0:
-            event_handler = FileWatchHandler(config, stream)
+            event_handler = FileWatchHandler(config, stream, index, tail_reader)
             try:
-                observer = PollingObserver()
-                observer.schedule(event_handler, config.target_dir, recursive=True)
+                observer = create_observer(config, event_handler)
                 observer.start()
                 while True:
                     time.sleep(1)
@@ -156,8 +444,12 @@ def main():
                 observer.stop()
             observer.join()
         else:
-            file_appender = FileStreamAppender(config, stream)
+            file_appender = FileStreamAppender(
+                config, stream, index, tail_reader, uploaded_before
+            )
             file_appender.check(config.check_interval_sec)
+        stream.close()
+        index.close()
 
     except Exception as ex:
         logger.exception(ex)
@@ -19,16 +19,23 @@ logger = logging.getLogger()
 class AbstractStreamManager:
     """Base class for StreamManager use class"""
 
-    def __init__(self, stream_name: str, clear_stream: bool = False):
+    def __init__(
+        self,
+        stream_name: str,
+        clear_stream: bool = False,
+        client: StreamManagerClient = None,
+    ):
         """
         :param stream_name: Name of the stream to create.
         :param bool clear_stream: Whether or not to delete the existing stream at runtime.
             (If a stream is deleted, all data currently stored in the queue will be deleted.)
+        :param client: Client of StreamManager (a new `StreamManagerClient` if not specified,
+            e.g. `LocalStreamManagerClient` to run without Greengrass)
         """
         self._stream_name = stream_name
         self._clear_stream = clear_stream
         self._stream_created = False
-        self._client = StreamManagerClient()
+        self._client = client if client is not None else StreamManagerClient()
         self._newest_seq_num = None
 
         self.create_stream()
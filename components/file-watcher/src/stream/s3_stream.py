@@ -5,7 +5,8 @@ import logging
 import os
 import platform
 import time
-from threading import Thread
+from threading import Lock, Thread
+from typing import Callable
 
 from stream.abstract_streammanager import AbstractStreamManager
 from stream_manager import (
@@ -24,13 +25,29 @@ from stream_manager import (
     StreamManagerException,
 )
 from stream_manager.util import Util
-from util.shadow import ShadowController
+from util.checkpoint import (
+    DEFAULT_CHECKPOINT_DIR,
+    DEFAULT_CHECKPOINT_SYNC_INTERVAL_SEC,
+    CheckpointStore,
+)
+from util.metrics import REGISTRY
 
 TIMEOUT = 10
 UPLOAD_MAX_RETRY_COUNT = 3
 UPLOAD_CHECK_INTERVAL = 3
+# Shadow (and local journal) of the read position of the status stream
+SEQUENCE_SHADOW_NAME = "sequence_no_config"
+SEQUENCE_PROP_NAME = "next_seq"
+# Upper bounds of the upload latency buckets (seconds)
+UPLOAD_LATENCY_BUCKETS = (1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
 logger = logging.getLogger()
 
+UPLOAD_LATENCY = REGISTRY.histogram(
+    "s3_export_upload_latency_seconds",
+    "Time from the hand-off of a file to its successful upload",
+    buckets=UPLOAD_LATENCY_BUCKETS,
+)
+
 
 class UploadCheckThread(Thread):
     """
@@ -44,31 +61,51 @@ class UploadCheckThread(Thread):
         clear_stream: bool,
         delete_moved_file: bool,
         retry_count: int = UPLOAD_MAX_RETRY_COUNT,
+        client: StreamManagerClient = None,
+        uploaded_callback: Callable[[str], None] = None,
+        failed_callback: Callable[[str], None] = None,
+        checkpoint_dir: str = DEFAULT_CHECKPOINT_DIR,
+        checkpoint_sync_interval_sec: int = DEFAULT_CHECKPOINT_SYNC_INTERVAL_SEC,
     ):
         """
         :param str status_stream_name: The name of the StreamManager stream used to store the status of S3 uploads.
         :param bool clear_stream: Whether or not to delete the existing stream at runtime.
             (Deleting a stream will delete all data currently stored in the queue.)
+        :param client: Client of StreamManager (a new one if not specified)
+        :param uploaded_callback: Called with the path of each file uploaded successfully
+        :param failed_callback: Called with the path of each file given up (failed too many times or canceled)
+        :param str checkpoint_dir: Directory of the local journal of the status stream read position
+        :param int checkpoint_sync_interval_sec: Interval to sync the read position to the shadow (in seconds)
         """
         Thread.__init__(self)
 
         self._file_url_separator = ":///" if platform.system() == "Windows" else ":"
         self.stream_name = stream_name
         self.status_stream_name = status_stream_name
-        self._shadow = ShadowController("sequence_no_config")
-        self.client = StreamManagerClient()
+        self._checkpoint = CheckpointStore(
+            SEQUENCE_SHADOW_NAME, checkpoint_dir, checkpoint_sync_interval_sec
+        )
+        self.client = client if client is not None else StreamManagerClient()
         self.delete_moved_file = delete_moved_file
         self.retry_max_count = retry_count
+        self._uploaded_callback = uploaded_callback
+        self._failed_callback = failed_callback
         self.setDaemon(True)
+        self._appended_at = {}  # input url -> time appended to the export stream
+        self._appended_at_lock = Lock()
+        self._upload_counters = {
+            status: REGISTRY.counter(
+                "s3_export_uploads_total",
+                "Files exported to S3 by status",
+                {"status": status},
+            )
+            for status in ["success", "failure", "canceled"]
+        }
 
-        latestConfig = self._shadow.get_thing_shadow_request()
-
-        if latestConfig is None or clear_stream is True:
+        if clear_stream is True:
             self.next_seq = 0
         else:
-            self.next_seq = (
-                latestConfig.get("state", {}).get("reported", {}).get("next_seq", 0)
-            )
+            self.next_seq = self._checkpoint.get(SEQUENCE_PROP_NAME, 0)
             logger.info(
                 f"Sequence number of the stream to start checking {self.next_seq}"
             )
@@ -104,21 +141,24 @@ class UploadCheckThread(Thread):
                         logger.info(
                             f"Successfully uploaded file at path: {target_file} to S3."
                         )
-                        self.next_seq = (
-                            status_message.status_context.sequence_number + 1
+                        self._upload_counters["success"].inc()
+                        self._observe_latency(
+                            status_message.status_context.s3_export_task_definition.input_url
                         )
+                        self.next_seq = message.sequence_number + 1
                         try:
                             if self.delete_moved_file:
                                 os.remove(target_file)
                         except FileNotFoundError as e:
                             logger.warning(e)
+                        if self._uploaded_callback is not None:
+                            self._uploaded_callback(target_file)
 
                     elif status_message.status == Status.InProgress:
                         logger.debug("File upload is in Progress.")
-                        self.next_seq = (
-                            status_message.status_context.sequence_number + 1
-                        )
+                        self.next_seq = message.sequence_number + 1
                     elif status_message.status == Status.Failure:
+                        self._upload_counters["failure"].inc()
                         s3_export_task_definition = (
                             status_message.status_context.s3_export_task_definition
                         )
@@ -130,6 +170,9 @@ class UploadCheckThread(Thread):
                             logger.error(
                                 f"{target_file} has been sent to S3 more than the max number of times.: {status_message.message}"
                             )
+                            self._forget(s3_export_task_definition.input_url)
+                            if self._failed_callback is not None:
+                                self._failed_callback(target_file)
                         else:
                             logger.warn(
                                 f"Unable to upload file at path {target_file} to S3. Message: {status_message.message}"
@@ -145,22 +188,23 @@ class UploadCheckThread(Thread):
                             )
                             self.client.append_message(self.stream_name, data)
 
-                        self.next_seq = (
-                            status_message.status_context.sequence_number + 1
-                        )
+                        self.next_seq = message.sequence_number + 1
                     elif status_message.status == Status.Canceled:
                         logger.error(
                             f"{target_file} has been cancelled to be sent to S3. Message: {status_message.message}"
                         )
-
-                        self.next_seq = (
-                            status_message.status_context.sequence_number + 1
+                        self._upload_counters["canceled"].inc()
+                        self._forget(
+                            status_message.status_context.s3_export_task_definition.input_url
                         )
+                        if self._failed_callback is not None:
+                            self._failed_callback(target_file)
 
-                    # Persist next_seq
-                    self._shadow.update_thing_shadow_request(
-                        {"next_seq": self.next_seq}
-                    )
+                        self.next_seq = message.sequence_number + 1
+
+                # Persist next_seq (synced to the shadow in the background)
+                if len(messages_list) > 0:
+                    self._checkpoint.update({SEQUENCE_PROP_NAME: self.next_seq})
 
                 time.sleep(UPLOAD_CHECK_INTERVAL)
             except NotEnoughMessagesException as e:
@@ -173,6 +217,27 @@ class UploadCheckThread(Thread):
                 logger.exception(e)
                 time.sleep(UPLOAD_CHECK_INTERVAL)
 
+    def close(self):
+        """Sync the read position of the status stream to the shadow"""
+        self._checkpoint.close()
+
+    def mark_appended(self, input_url: str):
+        """Record when a file was handed off, to measure its upload latency
+
+        :param str input_url: URL of the file in the export task
+        """
+        with self._appended_at_lock:
+            self._appended_at[input_url] = time.time()
+
+    def _observe_latency(self, input_url: str):
+        appended_at = self._forget(input_url)
+        if appended_at is not None:
+            UPLOAD_LATENCY.observe(time.time() - appended_at)
+
+    def _forget(self, input_url: str) -> float:
+        with self._appended_at_lock:
+            return self._appended_at.pop(input_url, None)
+
 
 class S3ExportStream(AbstractStreamManager):
     """Stream Manager stream operations with Export settings to S3"""
@@ -184,19 +249,30 @@ class S3ExportStream(AbstractStreamManager):
         clear_stream: bool = False,
         delete_moved_file: bool = True,
         retry_count: int = 3,
+        client: StreamManagerClient = None,
+        uploaded_callback: Callable[[str], None] = None,
+        failed_callback: Callable[[str], None] = None,
+        checkpoint_dir: str = DEFAULT_CHECKPOINT_DIR,
+        checkpoint_sync_interval_sec: int = DEFAULT_CHECKPOINT_SYNC_INTERVAL_SEC,
     ):
         """
         :param str stream_name: The name of the stream to create.
         :param str bucket: The S3 bucket to export to.
         :param bool clear_stream: Whether or not to delete the existing stream at runtime.
             (Deleting a stream will delete all data currently in the queue.)
+        :param client: Client of StreamManager (a new one if not specified,
+            shared with the upload check thread)
+        :param uploaded_callback: Called with the path of each file uploaded successfully
+        :param failed_callback: Called with the path of each file given up by the export
+        :param str checkpoint_dir: Directory of the local journal of the upload statuses read
+        :param int checkpoint_sync_interval_sec: Interval to sync the statuses read to the shadow (in seconds)
         """
         self.status_stream_name = stream_name + "_status"
         self.bucket = bucket
         self._file_url_prefix = (
             "file:///" if platform.system() == "Windows" else "file:"
         )
-        super(S3ExportStream, self).__init__(stream_name, clear_stream)
+        super(S3ExportStream, self).__init__(stream_name, clear_stream, client)
 
         # Create thread for deleting uploaded files
         self.upload_check_thread = UploadCheckThread(
@@ -205,6 +281,11 @@ class S3ExportStream(AbstractStreamManager):
             clear_stream,
             delete_moved_file,
             retry_count,
+            client,
+            uploaded_callback,
+            failed_callback,
+            checkpoint_dir,
+            checkpoint_sync_interval_sec,
         )
         self.upload_check_thread.start()
 
@@ -263,4 +344,9 @@ class S3ExportStream(AbstractStreamManager):
 
         data = Util.validate_and_serialize_to_json_bytes(s3_export_task_definition)
 
+        self.upload_check_thread.mark_appended(s3_export_task_definition.input_url)
         super(S3ExportStream, self).append_message(data)
+
+    def close(self):
+        """Sync the upload statuses read to the shadow"""
+        self.upload_check_thread.close()
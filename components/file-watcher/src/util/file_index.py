@@ -0,0 +1,347 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterable, List, Tuple
+
+logger = logging.getLogger()
+
+STATE_PENDING = "pending"  # Handed off to the export stream, upload not confirmed yet
+STATE_UPLOADED = "uploaded"  # Upload confirmed by the export status stream
+STATE_FAILED = "failed"  # Upload failed or canceled, handed off again by the next scan
+
+# Files written next to the database by SQLite
+SQLITE_JOURNAL_SUFFIXES = ["-journal", "-wal", "-shm"]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    inode INTEGER NOT NULL,
+    state TEXT NOT NULL,
+    updated_at REAL NOT NULL
+)
+"""
+# Position of the data already handed off of the files uploaded incrementally
+TAILS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS tails (
+    path TEXT PRIMARY KEY,
+    inode INTEGER NOT NULL,
+    offset INTEGER NOT NULL,
+    part INTEGER NOT NULL,
+    updated_at REAL NOT NULL
+)
+"""
+# Parts of the files uploaded incrementally in the spool, until their upload is confirmed
+PARTS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS parts (
+    path TEXT PRIMARY KEY,
+    key TEXT NOT NULL,
+    state TEXT NOT NULL,
+    updated_at REAL NOT NULL
+)
+"""
+
+
+class FileIndex:
+    """
+    Persistent index of the files handed off for upload, keyed by path
+
+    Each file is recorded with the size, mtime and inode it had when it was handed off,
+    and its upload state. A scan only hands off the files that are new, changed since
+    they were recorded, or whose upload failed, so a restart does not upload the whole
+    tree again. The index is kept in memory and written through to a SQLite database.
+
+    For the files uploaded incrementally, it also records the offset up to which the
+    data was handed off and the number of the next part, and the state of each part
+    until its upload is confirmed.
+
+    Files still pending when the index is loaded (handed off by a previous run, upload
+    not confirmed) are handed off again by the next scan, unless their upload is
+    confirmed by then: their export task may have been lost with the previous run.
+    """
+
+    def __init__(self, path: str):
+        """
+        @param path: str Path of the SQLite database (created if it does not exist)
+        """
+        self.path = os.path.abspath(path)
+        # The database and its journals
+        self._files = {self.path} | {
+            f"{self.path}{suffix}" for suffix in SQLITE_JOURNAL_SUFFIXES
+        }
+        # Whether the database was created now (first start, or removed)
+        self.created = not os.path.exists(self.path)
+        directory = os.path.dirname(self.path)
+        try:
+            os.makedirs(directory)
+        except FileExistsError as e:
+            pass
+
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(self.path, check_same_thread=False)
+        self._connection.execute(SCHEMA)
+        self._connection.execute(TAILS_SCHEMA)
+        self._connection.execute(PARTS_SCHEMA)
+        self._connection.commit()
+
+        # path -> (size, mtime_ns, inode, state), the files pending since a previous run
+        # are handed off again like the failed ones (only in memory)
+        self._entries: Dict[str, Tuple[int, int, int, str]] = {
+            path: (
+                size,
+                mtime_ns,
+                inode,
+                STATE_FAILED if state == STATE_PENDING else state,
+            )
+            for path, size, mtime_ns, inode, state in self._connection.execute(
+                "SELECT path, size, mtime_ns, inode, state FROM files"
+            )
+        }
+        # path -> (inode, offset, next part)
+        self._tails: Dict[str, Tuple[int, int, int]] = {
+            path: (inode, offset, part)
+            for path, inode, offset, part in self._connection.execute(
+                "SELECT path, inode, offset, part FROM tails"
+            )
+        }
+        # part path -> (key, state)
+        self._parts: Dict[str, Tuple[str, str]] = {
+            path: (key, state)
+            for path, key, state in self._connection.execute(
+                "SELECT path, key, state FROM parts"
+            )
+        }
+        logger.info(f"{len(self._entries)} files in the index {self.path}")
+        pending = self._connection.execute(
+            "SELECT COUNT(*) FROM files WHERE state = ?", (STATE_PENDING,)
+        ).fetchone()[0]
+        if pending > 0:
+            logger.info(f"{pending} files left pending, handed off again")
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def is_index_file(self, path: str) -> bool:
+        """Whether a path is the database of the index, one of its journals, or a file
+        of the directories named after it (e.g. the spool of the parts `index.db.parts`)
+
+        @param path: str Path of a file
+        """
+        path = os.path.abspath(path)
+        if path in self._files:
+            return True
+
+        # `{index}.{name}/...`, not a file next to the index (e.g. `index.db.bak`)
+        if not path.startswith(f"{self.path}."):
+            return False
+        return os.sep in path[len(self.path) + 1 :]
+
+    def is_changed(self, path: str, stat: os.stat_result) -> bool:
+        """Whether a file has to be handed off (new, changed or failed upload)
+
+        @param path: str Absolute path of the file
+        @param stat: os.stat_result Current stat of the file
+        """
+        entry = self._entries.get(path)
+        if entry is None:
+            return True
+
+        size, mtime_ns, inode, state = entry
+        return (
+            state == STATE_FAILED
+            or size != stat.st_size
+            or mtime_ns != stat.st_mtime_ns
+            or inode != stat.st_ino
+        )
+
+    def record_appended(
+        self, files: List[Tuple[str, os.stat_result]], state: str = STATE_PENDING
+    ):
+        """Record files handed off to the export stream (in one transaction)
+
+        @param files: List[Tuple[str, os.stat_result]] (absolute path, stat of the file
+            when it was handed off)
+        @param state: str State of the files (`STATE_UPLOADED` for the files known to be
+            uploaded already, e.g. by a previous version)
+        """
+        now = time.time()
+        rows = [
+            (path, stat.st_size, stat.st_mtime_ns, stat.st_ino, state, now)
+            for path, stat in files
+        ]
+        with self._lock:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO files "
+                "(path, size, mtime_ns, inode, state, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+            self._connection.commit()
+            for path, size, mtime_ns, inode, state, _ in rows:
+                self._entries[path] = (size, mtime_ns, inode, state)
+
+    def record_uploaded(self, path: str):
+        """Record the upload of a file confirmed by the export status stream
+
+        @param path: str Absolute path of the file
+        """
+        self._set_state(path, STATE_UPLOADED)
+
+    def record_failed(self, path: str):
+        """Record a file given up by the export, to hand it off again on the next scan
+
+        @param path: str Absolute path of the file
+        """
+        self._set_state(path, STATE_FAILED)
+
+    def tail_position(self, path: str) -> Tuple[int, int, int]:
+        """Position of the data handed off of a file uploaded incrementally
+
+        @param path: str Absolute path of the file
+        @return: (inode, offset, number of the next part), None if nothing was handed
+            off
+        """
+        return self._tails.get(path)
+
+    def record_tail_part(
+        self,
+        path: str,
+        inode: int,
+        offset: int,
+        part: int,
+        part_path: str,
+        part_key: str,
+    ):
+        """Record a part handed off of a file uploaded incrementally (in one transaction)
+
+        The position is kept when the file is removed, so that a file created again at
+        the same path does not overwrite the parts already uploaded.
+
+        @param path: str Absolute path of the file
+        @param inode: int Inode of the file
+        @param offset: int Offset of the end of the data handed off
+        @param part: int Number of the next part
+        @param part_path: str Absolute path of the part handed off
+        @param part_key: str Key of the part
+        """
+        now = time.time()
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO tails (path, inode, offset, part, updated_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (path, inode, offset, part, now),
+            )
+            self._connection.execute(
+                "INSERT OR REPLACE INTO parts (path, key, state, updated_at) "
+                "VALUES (?, ?, ?, ?)",
+                (part_path, part_key, STATE_PENDING, now),
+            )
+            self._connection.commit()
+            self._tails[path] = (inode, offset, part)
+            self._parts[part_path] = (part_key, STATE_PENDING)
+
+    def parts(self) -> Dict[str, Tuple[str, str]]:
+        """Parts whose upload is not confirmed yet
+
+        @return: part path -> (key, state)
+        """
+        with self._lock:
+            return dict(self._parts)
+
+    def record_part_state(self, path: str, key: str, state: str):
+        """Record the state of a part (recorded if it was not, e.g. found in the spool)
+
+        @param path: str Absolute path of the part
+        @param key: str Key of the part
+        @param state: str `STATE_PENDING` or `STATE_FAILED`
+        """
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO parts (path, key, state, updated_at) "
+                "VALUES (?, ?, ?, ?)",
+                (path, key, state, time.time()),
+            )
+            self._connection.commit()
+            self._parts[path] = (key, state)
+
+    def record_part_failed(self, path: str):
+        """Record a part given up by the export, to hand it off again
+
+        @param path: str Absolute path of the part
+        """
+        with self._lock:
+            entry = self._parts.get(path)
+        if entry is not None:
+            self.record_part_state(path, entry[0], STATE_FAILED)
+
+    def remove_part(self, path: str):
+        """Forget a part uploaded (or removed from the spool)
+
+        @param path: str Absolute path of the part
+        """
+        with self._lock:
+            if self._parts.pop(path, None) is None:
+                return
+
+            self._connection.execute("DELETE FROM parts WHERE path = ?", (path,))
+            self._connection.commit()
+
+    def prune(
+        self,
+        paths: Iterable[str],
+        directory: str = None,
+        kept_directories: Iterable[str] = None,
+    ):
+        """Remove the files that are not found anymore (e.g. deleted once uploaded)
+
+        @param paths: Iterable[str] Absolute paths of all the files found by a scan
+        @param directory: str Directory scanned (only its files are removed, all if not
+            specified)
+        @param kept_directories: Iterable[str] Directories that could not be listed
+            (their files are kept)
+        """
+        kept_prefixes = tuple(
+            os.path.join(kept, "") for kept in (kept_directories or [])
+        )
+        with self._lock:
+            removed = self._entries.keys() - set(paths)
+            if directory is not None:
+                prefix = os.path.join(os.path.abspath(directory), "")
+                removed = {path for path in removed if path.startswith(prefix)}
+            if len(kept_prefixes) > 0:
+                removed = {
+                    path for path in removed if not path.startswith(kept_prefixes)
+                }
+            if len(removed) == 0:
+                return
+
+            self._connection.executemany(
+                "DELETE FROM files WHERE path = ?", [(path,) for path in removed]
+            )
+            self._connection.commit()
+            for path in removed:
+                del self._entries[path]
+        logger.debug(f"{len(removed)} files removed from the index")
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+    def _set_state(self, path: str, state: str):
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is None:
+                return
+
+            self._connection.execute(
+                "UPDATE files SET state = ?, updated_at = ? WHERE path = ?",
+                (state, time.time(), path),
+            )
+            self._connection.commit()
+            self._entries[path] = (*entry[:3], state)
@@ -0,0 +1,318 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import ctypes
+import ctypes.util
+import errno
+import logging
+import os
+import platform
+import select
+import struct
+import time
+from threading import Event, Thread
+from typing import Callable, Dict, Set
+
+from util.metrics import REGISTRY
+from watchdog.events import (
+    FileClosedEvent,
+    FileCreatedEvent,
+    FileSystemEventHandler,
+)
+
+logger = logging.getLogger()
+
+# inotify(7)
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0x00000800
+IN_CLOEXEC = 0x00080000
+
+# Created, moved in, and completed files (a write in progress is not reported),
+# and the directories created or moved to watch them as well
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE_SELF
+EVENT_HEADER = struct.Struct("iIII")  # wd, mask, cookie, len
+READ_BUFFER_SIZE = 64 * 1024
+
+# Interval to check whether the observer is stopped (sec)
+STOP_CHECK_INTERVAL_SEC = 1
+# Interval to rescan (and try to watch again) the directories left unwatched
+# when the watch limit (`fs.inotify.max_user_watches`) is reached (sec)
+UNWATCHED_RESCAN_INTERVAL_SEC = 60
+
+# Filesystems where the changes made by other hosts are not reported by inotify
+NETWORK_FILESYSTEMS = frozenset(
+    [
+        "nfs",
+        "nfs4",
+        "cifs",
+        "smb3",
+        "smbfs",
+        "9p",
+        "afs",
+        "ceph",
+        "glusterfs",
+        "lustre",
+        "gpfs",
+        "fuse.sshfs",
+        "fuse.glusterfs",
+        "fuse.cephfs",
+        "davfs",
+    ]
+)
+
+WATCHES = REGISTRY.gauge("file_watcher_inotify_watches", "Directories watched")
+RESCANS = {
+    reason: REGISTRY.counter(
+        "file_watcher_rescans_total",
+        "Directories rescanned because their events may be lost",
+        {"reason": reason},
+    )
+    for reason in ["new_directory", "overflow", "unwatched"]
+}
+
+
+def mount_filesystem(path: str) -> str:
+    """Filesystem type of the mount point containing a path (None if unknown)
+
+    @param path: str Absolute path
+    """
+    filesystem = None
+    mount_point_len = -1
+    try:
+        with open("/proc/self/mounts") as f:
+            for line in f:
+                fields = line.split()
+                if len(fields) < 3:
+                    continue
+                # Spaces are escaped as `\040` in the mount points
+                mount_point = fields[1].replace("\\040", " ")
+                if (
+                    path == mount_point
+                    or path.startswith(mount_point.rstrip("/") + "/")
+                ) and len(mount_point) > mount_point_len:
+                    filesystem = fields[2]
+                    mount_point_len = len(mount_point)
+    except OSError as e:
+        logger.warning(f"failed to read the mount points: {e}")
+
+    return filesystem
+
+
+def inotify_supported(path: str) -> bool:
+    """Whether the changes of a directory are reported by inotify
+
+    Only on Linux, and not on network filesystems (changes made by other hosts).
+
+    @param path: str Absolute path of the directory
+    """
+    if platform.system() != "Linux":
+        return False
+
+    filesystem = mount_filesystem(path)
+    if filesystem in NETWORK_FILESYSTEMS:
+        logger.info(f"{path} is on {filesystem}, inotify is not used")
+        return False
+
+    return True
+
+
+class InotifyObserver(Thread):
+    """
+    Observer of a directory tree with Linux inotify, instead of polling the whole tree
+
+    Every directory of the tree is watched, the new ones as soon as they are created.
+    Created, moved in and completed (closed after write) files are dispatched to the
+    event handler as `FileCreatedEvent` and `FileClosedEvent`.
+    When events may have been lost, the directories are rescanned with the rescan
+    callback instead: a new directory (files created before it was watched), an
+    overflow of the event queue (whole tree), and the directories left unwatched
+    when the watch limit is reached (periodically, until they can be watched).
+    """
+
+    def __init__(
+        self,
+        rescan_callback: Callable[[str], None],
+        directory_filter: Callable[[str], bool] = None,
+    ):
+        """
+        @param rescan_callback: Callable[[str], None] Called with a directory whose
+            files must be checked (e.g. `FileWatchHandler.rescan`)
+        @param directory_filter: Callable[[str], bool] Whether a directory must be
+            watched (all if not specified)
+        """
+        Thread.__init__(self)
+        self._rescan_callback = rescan_callback
+        self._directory_filter = directory_filter
+        self._libc = ctypes.CDLL(
+            ctypes.util.find_library("c") or "libc.so.6", use_errno=True
+        )
+        self._fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            code = ctypes.get_errno()
+            raise OSError(code, f"inotify_init1: {os.strerror(code)}")
+
+        self._event_handler: FileSystemEventHandler = None
+        self._path = None
+        self._paths: Dict[int, str] = {}  # watch descriptor -> directory
+        self._unwatched: Set[str] = set()
+        self._unwatched_rescan_at = 0.0
+        self._stopped = Event()
+        self.setDaemon(True)
+
+    def schedule(
+        self,
+        event_handler: FileSystemEventHandler,
+        path: str,
+        recursive: bool = True,
+    ):
+        """Watch a directory tree (only one, always recursive)
+
+        @param event_handler: FileSystemEventHandler Handler of the file events
+        @param path: str Root of the tree
+        @param recursive: bool Only recursive watches are supported
+        """
+        self._event_handler = event_handler
+        self._path = os.path.abspath(path)
+        self._watch_tree(self._path)
+        logger.info(f"{len(self._paths)} directories watched with inotify")
+
+    def run(self):
+        try:
+            while not self._stopped.is_set():
+                readable, _, _ = select.select(
+                    [self._fd], [], [], STOP_CHECK_INTERVAL_SEC
+                )
+                if len(readable) > 0:
+                    self._read_events()
+                self._rescan_unwatched()
+        finally:
+            os.close(self._fd)
+
+    def stop(self):
+        """Stop the observer (`join` to wait for it)"""
+        self._stopped.set()
+
+    def _read_events(self):
+        try:
+            buffer = os.read(self._fd, READ_BUFFER_SIZE)
+        except BlockingIOError as e:
+            return
+
+        offset = 0
+        while offset + EVENT_HEADER.size <= len(buffer):
+            wd, mask, _, name_len = EVENT_HEADER.unpack_from(buffer, offset)
+            offset += EVENT_HEADER.size
+            name = buffer[offset : offset + name_len].rstrip(b"\0")
+            offset += name_len
+
+            try:
+                self._handle_event(wd, mask, os.fsdecode(name))
+            except Exception as e:
+                logger.exception(e)
+
+    def _handle_event(self, wd: int, mask: int, name: str):
+        if mask & IN_Q_OVERFLOW:
+            logger.warning("inotify event queue overflowed, rescan the whole tree")
+            RESCANS["overflow"].inc()
+            self._rescan_callback(self._path)
+            return
+
+        directory = self._paths.get(wd)
+        if mask & IN_IGNORED:
+            # Directory removed (or its watch was)
+            self._paths.pop(wd, None)
+            WATCHES.set(len(self._paths))
+            return
+        if directory is None or mask & IN_DELETE_SELF:
+            return
+
+        path = os.path.join(directory, name)
+        if mask & IN_ISDIR:
+            if mask & (IN_CREATE | IN_MOVED_TO):
+                # Files may have been added before the directory was watched
+                self._watch_tree(path)
+                RESCANS["new_directory"].inc()
+                self._rescan_callback(path)
+            elif mask & IN_MOVED_FROM:
+                self._unwatch_tree(path)
+        elif mask & (IN_CREATE | IN_MOVED_TO):
+            self._event_handler.dispatch(FileCreatedEvent(path))
+        elif mask & IN_CLOSE_WRITE:
+            self._event_handler.dispatch(FileClosedEvent(path))
+
+    def _watch_tree(self, top: str):
+        """Watch a directory and its subdirectories"""
+        if self._directory_filter is not None and not self._directory_filter(top):
+            return
+
+        for root, dirs, _ in os.walk(top):
+            if not self._watch(root):
+                # The subdirectories are rescanned with it
+                dirs.clear()
+            elif self._directory_filter is not None:
+                dirs[:] = [
+                    name
+                    for name in dirs
+                    if self._directory_filter(os.path.join(root, name))
+                ]
+        WATCHES.set(len(self._paths))
+
+    def _watch(self, directory: str) -> bool:
+        wd = self._libc.inotify_add_watch(
+            self._fd, os.fsencode(directory), WATCH_MASK | IN_ONLYDIR
+        )
+        if wd >= 0:
+            self._paths[wd] = directory
+            self._unwatched.discard(directory)
+            return True
+
+        code = ctypes.get_errno()
+        if code == errno.ENOSPC:
+            if len(self._unwatched) == 0:
+                logger.warning(
+                    "inotify watch limit reached (fs.inotify.max_user_watches), "
+                    f"the unwatched directories are rescanned every {UNWATCHED_RESCAN_INTERVAL_SEC} sec"
+                )
+            self._unwatched.add(directory)
+        elif code != errno.ENOENT:
+            logger.warning(f"failed to watch {directory}: {os.strerror(code)}")
+        return False
+
+    def _unwatch_tree(self, top: str):
+        """Stop watching a directory moved out of its parent, and its subdirectories"""
+        prefix = top + os.sep
+        for wd, directory in list(self._paths.items()):
+            if directory == top or directory.startswith(prefix):
+                self._libc.inotify_rm_watch(self._fd, wd)
+                del self._paths[wd]
+        self._unwatched = {
+            directory
+            for directory in self._unwatched
+            if directory != top and not directory.startswith(prefix)
+        }
+        WATCHES.set(len(self._paths))
+
+    def _rescan_unwatched(self):
+        if (
+            len(self._unwatched) == 0
+            or time.time() - self._unwatched_rescan_at < UNWATCHED_RESCAN_INTERVAL_SEC
+        ):
+            return
+
+        self._unwatched_rescan_at = time.time()
+        for directory in sorted(self._unwatched):
+            if not os.path.isdir(directory):
+                self._unwatched.discard(directory)
+                continue
+            # Watched again if watches were released meanwhile
+            self._watch_tree(directory)
+            RESCANS["unwatched"].inc()
+            self._rescan_callback(directory)
@@ -0,0 +1,117 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import logging
+import os
+import time
+from threading import Event, Lock, Thread
+from typing import Callable, Dict, Tuple
+
+from util.metrics import REGISTRY
+
+logger = logging.getLogger()
+
+# Interval to check the size and mtime of the pending files (sec)
+SETTLE_CHECK_INTERVAL_SEC = 0.5
+
+PENDING_FILES = REGISTRY.gauge(
+    "file_watcher_settling_files", "Files waiting for their writes to settle"
+)
+EVENTS_COALESCED = REGISTRY.counter(
+    "file_watcher_events_coalesced_total",
+    "File events merged into the pending hand-off of the same file",
+)
+
+
+class SettleQueue(Thread):
+    """
+    Holds the files being written until they are complete, then hands each off once
+
+    A file is handed off when its size and mtime have not changed for the quiet period,
+    or as soon as it is closed after write (when the observer reports it). The events
+    of a file already pending are merged into its pending hand-off.
+    """
+
+    def __init__(
+        self, quiet_period_sec: float, settled_callback: Callable[[str], None]
+    ):
+        """
+        @param quiet_period_sec: float Time without any change of size or mtime after
+            which a file is complete
+        @param settled_callback: Callable[[str], None] Called with the path of each
+            complete file
+        """
+        Thread.__init__(self)
+        self._quiet_period_sec = quiet_period_sec
+        self._settled_callback = settled_callback
+        # path -> (size, mtime_ns, time of the last change, closed after write)
+        self._pending: Dict[str, Tuple[int, int, float, bool]] = {}
+        self._lock = Lock()
+        self._stopped = Event()
+        self.setDaemon(True)
+
+    def submit(self, path: str, closed: bool = False):
+        """
+        Hand off a file once it is complete
+
+        @param path: str Path of the file
+        @param closed: bool Whether the file was closed after write (complete now)
+        """
+        with self._lock:
+            entry = self._pending.get(path)
+            if entry is None:
+                self._pending[path] = (-1, -1, time.monotonic(), closed)
+            else:
+                EVENTS_COALESCED.inc()
+                if closed:
+                    self._pending[path] = (*entry[:3], True)
+            PENDING_FILES.set(len(self._pending))
+
+    def run(self):
+        while not self._stopped.wait(SETTLE_CHECK_INTERVAL_SEC):
+            for path in self._settled():
+                try:
+                    self._settled_callback(path)
+                except Exception as e:
+                    logger.exception(e)
+
+    def stop(self):
+        self._stopped.set()
+
+    def _settled(self):
+        """Remove the complete (or removed) files from the pending ones"""
+        now = time.monotonic()
+        settled = []
+        with self._lock:
+            pending = list(self._pending.items())
+
+        for path, (size, mtime_ns, changed_at, closed) in pending:
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError as e:
+                self._remove(path)
+                continue
+
+            if not closed and (stat.st_size, stat.st_mtime_ns) != (size, mtime_ns):
+                # Still written (or first check), the quiet period starts again
+                with self._lock:
+                    entry = self._pending.get(path)
+                    if entry is not None:
+                        self._pending[path] = (
+                            stat.st_size,
+                            stat.st_mtime_ns,
+                            now,
+                            entry[3],
+                        )
+                continue
+
+            if closed or now - changed_at >= self._quiet_period_sec:
+                self._remove(path)
+                settled.append(path)
+
+        return settled
+
+    def _remove(self, path: str):
+        with self._lock:
+            self._pending.pop(path, None)
+            PENDING_FILES.set(len(self._pending))
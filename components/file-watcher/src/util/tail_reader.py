@@ -0,0 +1,278 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import logging
+import os
+from threading import Event, Lock, Thread
+from typing import Callable, List, Set
+
+from util.file_index import STATE_FAILED, STATE_PENDING, FileIndex
+from util.metrics import REGISTRY
+from util.tree_scanner import compile_patterns
+
+logger = logging.getLogger()
+
+# Size of the blocks read to find the last newline and to copy the parts (bytes)
+COPY_BUFFER_SIZE = 1024 * 1024
+# Suffix of the keys of the parts, followed by the part number
+PART_KEY_FORMAT = "{key}.part{part:04d}"
+
+PARTS_APPENDED = REGISTRY.counter(
+    "file_watcher_parts_appended_total",
+    "Parts of the files uploaded incrementally handed off for upload",
+)
+PART_BYTES = REGISTRY.counter(
+    "file_watcher_part_bytes_total",
+    "Bytes of the parts of the files uploaded incrementally",
+)
+TAIL_RESETS = REGISTRY.counter(
+    "file_watcher_tail_resets_total",
+    "Files uploaded incrementally read again from the start (rotated or truncated)",
+)
+PARTS_RETRIED = REGISTRY.counter(
+    "file_watcher_parts_retried_total",
+    "Parts handed off again (given up by the export, or left in the spool)",
+)
+
+
+class TailReader:
+    """
+    Cuts the data appended to growing files (CSV, logs) into parts to upload
+
+    Instead of uploading the whole file on every change, only the complete lines
+    appended since the last hand-off are copied to a part file in a spool directory,
+    and uploaded with the key of the file followed by a sequence number
+    (`key.part0000`, `key.part0001`, ...). A line without its trailing newline yet
+    is left for the next part, until the file is flushed (settled or closed).
+
+    A file replaced (other inode) or truncated (smaller than the data handed off) is
+    read again from the start; its part numbers go on, so no part is overwritten.
+    The position of each file and its parts are recorded in the index once the part
+    is handed off. A part stays in the spool until its upload is confirmed: the parts
+    given up by the export, and those left in the spool by a crash before they were
+    recorded, are handed off again with `hand_off_parts`.
+    """
+
+    def __init__(self, index: FileIndex, root: str, patterns: List[str]):
+        """
+        @param index: FileIndex Index recording the position of each file
+        @param root: str Target directory (relative paths are from it)
+        @param patterns: List[str] Globs of the files uploaded incrementally
+        """
+        self._index = index
+        self._root = os.path.abspath(root)
+        self._patterns = compile_patterns(patterns)
+        # In the directory of the index, skipped by the scans as the index itself
+        self._spool_dir = index.path + ".parts"
+        # Files polled for appended lines (found by the scans and the events)
+        self._active: Set[str] = set()
+        self._active_lock = Lock()
+
+    def is_tailed(self, path: str) -> bool:
+        """Whether a file is uploaded incrementally
+
+        @param path: str Absolute path of the file
+        """
+        name_pattern, path_pattern = self._patterns
+        relative_path = os.path.relpath(path, self._root).replace(os.sep, "/")
+        return (
+            name_pattern is not None
+            and name_pattern.match(os.path.basename(path)) is not None
+        ) or (
+            path_pattern is not None and path_pattern.match(relative_path) is not None
+        )
+
+    def is_part(self, path: str) -> bool:
+        """Whether a file is a part in the spool directory
+
+        @param path: str Absolute path of the file
+        """
+        return path.startswith(self._spool_dir + os.sep)
+
+    def watch(self, path: str):
+        """Poll a file for appended lines (until it is not found anymore)
+
+        @param path: str Absolute path of the file
+        """
+        with self._active_lock:
+            self._active.add(path)
+
+    def forget(self, path: str):
+        """Stop polling a file (removed)
+
+        @param path: str Absolute path of the file
+        """
+        with self._active_lock:
+            self._active.discard(path)
+
+    def active_paths(self) -> List[str]:
+        """Files polled for appended lines"""
+        with self._active_lock:
+            return sorted(self._active)
+
+    def hand_off(
+        self,
+        path: str,
+        stat: os.stat_result,
+        key: str,
+        append_message: Callable[[str, str], None],
+        flush: bool = False,
+    ) -> int:
+        """Hand off the complete lines appended to a file as a part
+
+        @param path: str Absolute path of the file
+        @param stat: os.stat_result Current stat of the file
+        @param key: str Key of the file (the parts are uploaded to `key.partNNNN`)
+        @param append_message: Callable[[str, str], None] Called with the path and key
+            of the part to upload (e.g. `S3ExportStream.append_message`)
+        @param flush: bool Hand off the last line as well, even without its newline
+            (the file is complete: settled or closed)
+        @return: Number of bytes handed off
+        """
+        position = self._index.tail_position(path)
+        inode, offset, part = position if position is not None else (0, 0, 0)
+        if position is not None and (inode != stat.st_ino or stat.st_size < offset):
+            logger.info(f"{path} was rotated or truncated, read again from the start")
+            TAIL_RESETS.inc()
+            offset = 0
+        elif stat.st_size == offset:
+            return 0
+
+        try:
+            with open(path, "rb") as f:
+                end = (
+                    stat.st_size
+                    if flush
+                    else self._last_line_end(f, offset, stat.st_size)
+                )
+                if end <= offset:
+                    return 0
+
+                part_key = PART_KEY_FORMAT.format(key=key, part=part)
+                part_path = os.path.join(self._spool_dir, *part_key.split("/"))
+                self._copy(f, offset, end, part_path)
+        except FileNotFoundError as e:
+            return 0
+
+        append_message(part_path, part_key)
+        self._index.record_tail_part(
+            path, stat.st_ino, end, part + 1, part_path, part_key
+        )
+        PARTS_APPENDED.inc()
+        PART_BYTES.inc(end - offset)
+        return end - offset
+
+    def record_uploaded(self, path: str):
+        """Remove a part uploaded successfully from the spool directory
+
+        @param path: str Absolute path of the part
+        """
+        try:
+            os.remove(path)
+        except FileNotFoundError as e:
+            # Already removed with `DeleteMovedFiles`
+            pass
+        self._index.remove_part(path)
+
+    def record_failed(self, path: str):
+        """Keep a part given up by the export, to hand it off again with `hand_off_parts`
+
+        @param path: str Absolute path of the part
+        """
+        self._index.record_part_failed(path)
+
+    def hand_off_parts(
+        self, append_message: Callable[[str, str], None], leftover: bool = False
+    ) -> int:
+        """Hand off again the parts given up by the export
+
+        @param append_message: Callable[[str, str], None] Called with the path and key
+            of each part to upload
+        @param leftover: bool Hand off the parts in the spool that are not recorded as
+            well (handed off just before a crash, e.g. at startup)
+        @return: Number of parts handed off
+        """
+        parts = self._index.parts()
+        retried = []
+        for path, (key, state) in sorted(parts.items()):
+            if not os.path.exists(path):
+                self._index.remove_part(path)
+            elif state == STATE_FAILED:
+                retried.append((path, key))
+
+        if leftover:
+            for root, _, files in os.walk(self._spool_dir):
+                for name in files:
+                    path = os.path.join(root, name)
+                    if path not in parts:
+                        key = os.path.relpath(path, self._spool_dir)
+                        retried.append((path, key.replace(os.sep, "/")))
+
+        for path, key in retried:
+            logger.info(f"hand off the part {path} again")
+            append_message(path, key)
+            self._index.record_part_state(path, key, STATE_PENDING)
+            PARTS_RETRIED.inc()
+        return len(retried)
+
+    @staticmethod
+    def _last_line_end(f, start: int, end: int) -> int:
+        """Offset just after the last newline between two offsets (`start` if there is none)"""
+        block_end = end
+        while block_end > start:
+            block_start = max(start, block_end - COPY_BUFFER_SIZE)
+            f.seek(block_start)
+            index = f.read(block_end - block_start).rfind(b"\n")
+            if index >= 0:
+                return block_start + index + 1
+            block_end = block_start
+        return start
+
+    @staticmethod
+    def _copy(f, start: int, end: int, part_path: str):
+        try:
+            os.makedirs(os.path.dirname(part_path))
+        except FileExistsError as e:
+            pass
+
+        f.seek(start)
+        remaining = end - start
+        with open(part_path, "wb") as part:
+            while remaining > 0:
+                data = f.read(min(COPY_BUFFER_SIZE, remaining))
+                if len(data) == 0:
+                    break
+                part.write(data)
+                remaining -= len(data)
+
+
+class TailPollThread(Thread):
+    """
+    Calls the poll of the files uploaded incrementally at a fixed interval
+
+    Growing files are not reported by the observers while they are written (inotify
+    reports them once closed), and a part per write would multiply the uploads: their
+    appended lines are handed off at most once per interval instead.
+    """
+
+    def __init__(self, interval_sec: float, poll_callback: Callable[[], None]):
+        """
+        @param interval_sec: float Interval of the polls
+        @param poll_callback: Callable[[], None] Hands off the appended lines and the
+            parts to upload again (e.g. `FileStreamAppender.poll_tails`)
+        """
+        Thread.__init__(self)
+        self._interval_sec = interval_sec
+        self._poll_callback = poll_callback
+        self._stopped = Event()
+        self.setDaemon(True)
+
+    def run(self):
+        while not self._stopped.wait(self._interval_sec):
+            try:
+                self._poll_callback()
+            except Exception as e:
+                logger.exception(e)
+
+    def stop(self):
+        self._stopped.set()
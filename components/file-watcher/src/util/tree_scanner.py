@@ -0,0 +1,221 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import fnmatch
+import logging
+import os
+import re
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import List, Pattern, Tuple
+
+logger = logging.getLogger()
+
+
+def compile_patterns(patterns: List[str]) -> Tuple[Pattern, Pattern]:
+    """Compile globs into one regex for the names and one for the relative paths
+
+    A glob with a `/` is matched against the path relative to the target directory
+    (`*` also matches `/`), the others against the name only.
+
+    @param patterns: List[str] Globs (e.g. `*.csv`, `raw/*/*.bin`)
+    @return: (regex of the names, regex of the relative paths), None if there is no such
+        glob
+    """
+    name_patterns = [fnmatch.translate(p) for p in patterns if "/" not in p]
+    path_patterns = [fnmatch.translate(p) for p in patterns if "/" in p]
+
+    return (
+        re.compile("|".join(name_patterns)) if name_patterns else None,
+        re.compile("|".join(path_patterns)) if path_patterns else None,
+    )
+
+
+class TreeScanner:
+    """
+    Lists the files of a directory tree matching include and exclude globs
+
+    The tree is listed with `os.scandir` and the stat of each file is taken from its
+    `DirEntry`. Excluded directories and the directories deeper than the maximum depth
+    are not listed at all. With workers, the directories are listed concurrently,
+    which hides the latency of network filesystems (NFS/SMB).
+    The directories that cannot be listed (e.g. ESTALE, EIO or ETIMEDOUT on a network
+    filesystem) are returned apart, their files are neither found nor gone.
+    """
+
+    def __init__(
+        self,
+        root: str,
+        includes: List[str],
+        excludes: List[str] = None,
+        exclude_dirs: List[str] = None,
+        max_depth: int = 0,
+        workers: int = 0,
+    ):
+        """
+        @param root: str Target directory (relative paths and depths are from it)
+        @param includes: List[str] Globs of the files to list
+        @param excludes: List[str] Globs of the files not to list, even if included
+        @param exclude_dirs: List[str] Globs of the directories not to list (with all
+            their files)
+        @param max_depth: int Depth of the deepest files to list, 1 for the files of the
+            target directory only (0: unlimited)
+        @param workers: int Threads listing directories concurrently (0: in the calling
+            thread)
+        """
+        self._root = os.path.abspath(root)
+        self._includes = compile_patterns(includes)
+        self._excludes = compile_patterns(excludes or [])
+        self._exclude_dirs = compile_patterns(exclude_dirs or [])
+        self._max_depth = max_depth
+        self._pool = None
+        if workers > 0:
+            self._pool = ThreadPoolExecutor(
+                max_workers=workers, thread_name_prefix="file-scan"
+            )
+
+    def scan(
+        self, top: str = None
+    ) -> Tuple[List[Tuple[str, os.stat_result]], List[str]]:
+        """List the matching files of a directory and its subdirectories
+
+        @param top: str Directory to list (the target directory if not specified)
+        @return: (absolute path, stat) of each file, and the absolute paths of the
+            directories that could not be listed completely
+        """
+        top = os.path.abspath(top) if top is not None else self._root
+        if not self.is_directory_included(top):
+            return [], []
+
+        depth = self._depth(top)
+        relative_directory = self._relative_directory(top)
+        files = []
+        failed = []
+        if self._pool is None:
+            directories = [(top, relative_directory, depth)]
+            while len(directories) > 0:
+                directory_files, subdirectories, error = self._scan_directory(
+                    *directories.pop()
+                )
+                files.extend(directory_files)
+                directories.extend(subdirectories)
+                failed.extend(error)
+            return files, failed
+
+        pending = {
+            self._pool.submit(self._scan_directory, top, relative_directory, depth)
+        }
+        while len(pending) > 0:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                directory_files, subdirectories, error = future.result()
+                files.extend(directory_files)
+                failed.extend(error)
+                for subdirectory in subdirectories:
+                    pending.add(self._pool.submit(self._scan_directory, *subdirectory))
+        return files, failed
+
+    def is_included(self, path: str) -> bool:
+        """Whether a file would be listed by a scan (e.g. to filter the file events)
+
+        @param path: str Absolute path of the file
+        """
+        relative_path = self._relative_path(path)
+        if relative_path.startswith("../"):
+            return False
+
+        return self._matches_file(
+            os.path.basename(path), relative_path
+        ) and self.is_directory_included(os.path.dirname(path))
+
+    def is_directory_included(self, path: str) -> bool:
+        """Whether the files of a directory would be listed (not excluded nor too deep)
+
+        @param path: str Absolute path of the directory
+        """
+        if self._max_depth > 0 and self._depth(path) >= self._max_depth:
+            return False
+
+        relative_path = self._relative_path(path)
+        if relative_path == ".":
+            return True
+
+        parts = relative_path.split("/")
+        return not any(
+            self._matches(
+                self._exclude_dirs, parts[index], "/".join(parts[: index + 1])
+            )
+            for index in range(len(parts))
+        )
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+
+    def _scan_directory(
+        self, directory: str, relative_directory: str, depth: int
+    ) -> Tuple[List[Tuple[str, os.stat_result]], List[Tuple[str, str, int]], List[str]]:
+        """Matching files and subdirectories to list of a directory, and the directory
+        itself if it could not be listed completely
+
+        `relative_directory` is the path of the directory relative to the target
+        directory, with a trailing `/` (empty for the target directory).
+        """
+        files = []
+        subdirectories = []
+        failed = []
+        list_subdirectories = self._max_depth == 0 or depth + 1 < self._max_depth
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    relative_path = relative_directory + entry.name
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            if list_subdirectories and not self._matches(
+                                self._exclude_dirs, entry.name, relative_path
+                            ):
+                                subdirectories.append(
+                                    (entry.path, relative_path + "/", depth + 1)
+                                )
+                        elif entry.is_file() and self._matches_file(
+                            entry.name, relative_path
+                        ):
+                            files.append((entry.path, entry.stat()))
+                    except FileNotFoundError as e:
+                        # Removed while listing
+                        continue
+                    except OSError as e:
+                        logger.warning(f"failed to stat {entry.path}: {e}")
+                        failed = [directory]
+        except (FileNotFoundError, NotADirectoryError) as e:
+            pass
+        except OSError as e:
+            # Permission denied, or stale handle / I/O error / timeout on NFS and SMB
+            logger.warning(f"failed to list {directory}: {e}")
+            failed = [directory]
+
+        return files, subdirectories, failed
+
+    def _matches_file(self, name: str, relative_path: str) -> bool:
+        return self._matches(self._includes, name, relative_path) and not self._matches(
+            self._excludes, name, relative_path
+        )
+
+    @staticmethod
+    def _matches(patterns: Tuple[Pattern, Pattern], name: str, relative_path) -> bool:
+        name_pattern, path_pattern = patterns
+        return (name_pattern is not None and name_pattern.match(name) is not None) or (
+            path_pattern is not None and path_pattern.match(relative_path) is not None
+        )
+
+    def _relative_path(self, path: str) -> str:
+        relative_path = os.path.relpath(path, self._root)
+        return relative_path.replace(os.sep, "/") if os.sep != "/" else relative_path
+
+    def _relative_directory(self, directory: str) -> str:
+        relative_path = self._relative_path(directory)
+        return "" if relative_path == "." else relative_path + "/"
+
+    def _depth(self, directory: str) -> int:
+        """Number of directories between the target directory and a directory"""
+        relative_path = self._relative_path(directory)
+        return 0 if relative_path == "." else relative_path.count("/") + 1
@@ -0,0 +1,97 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import os
+import sys
+import time
+from typing import Any, Callable, Dict
+
+import pytest
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+)
+
+import util.checkpoint  # noqa: E402
+from util.file_index import FileIndex  # noqa: E402
+from util.local_client import LocalStreamManagerClient  # noqa: E402
+
+# Time to wait for the export or the settle of a file (sec)
+WAIT_TIMEOUT_SEC = 30
+WAIT_INTERVAL_SEC = 0.05
+
+
+class LocalShadows:
+    """Reported state of the shadows, kept across the restarts of a test"""
+
+    def __init__(self):
+        self.reported: Dict[str, dict] = {}
+
+    def controller(self, shadow_name: str) -> "LocalShadowController":
+        return LocalShadowController(self, shadow_name)
+
+
+class LocalShadowController:
+    """In-memory stand-in for `ShadowController` (tests run without Greengrass IPC)"""
+
+    def __init__(self, shadows: LocalShadows, shadow_name: str):
+        self._shadows = shadows
+        self._shadow_name = shadow_name
+
+    def get_thing_shadow_request(self) -> dict:
+        return dict(self._shadows.reported.get(self._shadow_name, {}))
+
+    def update_thing_shadow_request(self, payload: dict) -> Any:
+        # Merged into the reported state, a null value deletes its key
+        reported = self._shadows.reported.setdefault(self._shadow_name, {})
+        reported.update(payload)
+        for key, value in payload.items():
+            if value is None:
+                del reported[key]
+        return {"state": {"reported": payload}}
+
+
+def wait_for(condition: Callable[[], bool], timeout_sec: float = WAIT_TIMEOUT_SEC):
+    """Wait until a condition is true (fails the test on timeout)"""
+    deadline = time.time() + timeout_sec
+    while not condition():
+        if time.time() > deadline:
+            raise TimeoutError("condition not met in time")
+        time.sleep(WAIT_INTERVAL_SEC)
+
+
+def write(path: str, data: bytes, mode: str = "ab") -> os.stat_result:
+    """Write to a file and return its stat"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, mode) as f:
+        f.write(data)
+    return os.stat(path)
+
+
+@pytest.fixture
+def shadows(monkeypatch) -> LocalShadows:
+    """Device shadows of the test, the checkpoints are synced to them"""
+    local_shadows = LocalShadows()
+    monkeypatch.setattr(util.checkpoint, "ShadowController", local_shadows.controller)
+    return local_shadows
+
+
+@pytest.fixture
+def client(tmp_path):
+    """In-process Stream Manager, exporting to `{tmp_path}/s3/{bucket}`"""
+    local_client = LocalStreamManagerClient(os.path.join(str(tmp_path), "s3"))
+    yield local_client
+    local_client.close()
+
+
+@pytest.fixture
+def index_path(tmp_path) -> str:
+    """Path of the index, in a directory next to the target directory"""
+    return os.path.join(str(tmp_path), "state", "index.db")
+
+
+@pytest.fixture
+def index(index_path):
+    file_index = FileIndex(index_path)
+    yield file_index
+    file_index.close()
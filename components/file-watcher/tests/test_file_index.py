@@ -0,0 +1,107 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import os
+
+from conftest import write
+from util.file_index import STATE_FAILED, STATE_PENDING, FileIndex
+
+
+def test_only_new_changed_or_failed_files_are_handed_off(tmp_path, index):
+    path = os.path.join(str(tmp_path), "data", "a.csv")
+    stat = write(path, b"1\n")
+    assert index.is_changed(path, stat)
+
+    index.record_appended([(path, stat)])
+    assert not index.is_changed(path, stat)
+    assert index.is_changed(path, write(path, b"2\n"))
+
+    index.record_failed(path)
+    assert index.is_changed(path, stat)
+
+
+def test_index_survives_a_restart(tmp_path, index_path, index):
+    path = os.path.join(str(tmp_path), "data", "a.csv")
+    stat = write(path, b"1\n")
+    index.record_appended([(path, stat)])
+    index.record_uploaded(path)
+    index.close()
+
+    restarted = FileIndex(index_path)
+
+    assert len(restarted) == 1
+    assert not restarted.is_changed(path, stat)
+    restarted.close()
+
+
+def test_prune_keeps_the_directories_not_listed(tmp_path, index):
+    data_dir = os.path.join(str(tmp_path), "data")
+    paths = [
+        os.path.join(data_dir, name) for name in ["a.csv", "locked/b.csv", "c.csv"]
+    ]
+    index.record_appended([(path, write(path, b"1\n")) for path in paths])
+
+    # `c.csv` was deleted once uploaded, `locked` could not be listed
+    index.prune(
+        [paths[0]], data_dir, kept_directories=[os.path.join(data_dir, "locked")]
+    )
+
+    assert len(index) == 2
+    assert not index.is_changed(paths[1], os.stat(paths[1]))
+    assert index.is_changed(paths[2], os.stat(paths[2]))
+
+
+def test_prune_is_limited_to_the_directory_scanned(tmp_path, index):
+    paths = [os.path.join(str(tmp_path), name, "a.csv") for name in ["x", "y"]]
+    index.record_appended([(path, write(path, b"1\n")) for path in paths])
+
+    index.prune([], os.path.join(str(tmp_path), "x"))
+
+    assert len(index) == 1
+    assert not index.is_changed(paths[1], os.stat(paths[1]))
+
+
+def test_journal_and_spool_are_index_files(tmp_path, index_path, index):
+    assert index.is_index_file(index_path)
+    assert index.is_index_file(index_path + "-journal")
+    assert index.is_index_file(os.path.join(index_path + ".parts", "a.csv.part0000"))
+    assert not index.is_index_file(os.path.join(str(tmp_path), "data", "index.csv"))
+    assert not index.is_index_file(index_path + "-backup")
+    assert not index.is_index_file(index_path + ".bak")
+
+
+def test_pending_files_are_handed_off_again_after_a_restart(index_path, index):
+    paths = [
+        os.path.join(os.path.dirname(index_path), "data", f"{name}.csv")
+        for name in "ab"
+    ]
+    stats = [write(path, b"1\n") for path in paths]
+    index.record_appended(list(zip(paths, stats)))
+    index.close()
+
+    restarted = FileIndex(index_path)
+    # Confirmed by the export status stream before the first scan
+    restarted.record_uploaded(paths[0])
+
+    assert not restarted.is_changed(paths[0], stats[0])
+    assert restarted.is_changed(paths[1], stats[1])
+    restarted.close()
+
+
+def test_parts_are_kept_until_their_upload_is_confirmed(tmp_path, index_path, index):
+    path = os.path.join(str(tmp_path), "data", "a.csv")
+    part_path = os.path.join(index_path + ".parts", "a.csv.part0000")
+    index.record_tail_part(path, 42, 100, 1, part_path, "a.csv.part0000")
+    index.record_part_failed(part_path)
+    index.close()
+
+    restarted = FileIndex(index_path)
+
+    assert restarted.tail_position(path) == (42, 100, 1)
+    assert restarted.parts() == {part_path: ("a.csv.part0000", STATE_FAILED)}
+    restarted.record_part_state(part_path, "a.csv.part0000", STATE_PENDING)
+    restarted.remove_part(part_path)
+    assert restarted.parts() == {}
+    # The position is kept, so that the next parts do not overwrite this one
+    assert restarted.tail_position(path) == (42, 100, 1)
+    restarted.close()
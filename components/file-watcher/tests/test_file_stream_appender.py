@@ -0,0 +1,55 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import os
+
+import pytest
+from conftest import write
+from gg_config import GGConfig
+from main import FileStreamAppender
+from util.file_index import FileIndex
+
+
+class RecordingStream:
+    """Export stream stand-in, recording the files handed off"""
+
+    def __init__(self):
+        self.keys = []
+
+    def append_message(self, path: str, key: str):
+        self.keys.append(key)
+
+
+@pytest.fixture
+def config(tmp_path, monkeypatch) -> GGConfig:
+    values = {
+        "TargetDir": os.path.join(str(tmp_path), "data"),
+        "Bucket": "bucket",
+        "BucketPrefix": "",
+        "SettleSec": 0,
+    }
+    monkeypatch.setattr(GGConfig, "component_configration", lambda self: values)
+    return GGConfig()
+
+
+def test_first_scan_skips_the_files_checked_by_the_legacy_version(config, index_path):
+    old = write(os.path.join(config.target_dir, "old.csv"), b"1\n")
+    new_path = os.path.join(config.target_dir, "new.csv")
+    write(new_path, b"2\n")
+    os.utime(new_path, (old.st_mtime + 10, old.st_mtime + 10))
+
+    index = FileIndex(index_path)
+    assert index.created
+    stream = RecordingStream()
+    appender = FileStreamAppender(
+        config, stream, index, uploaded_before=old.st_mtime + 5
+    )
+    appender.check_files()
+
+    assert stream.keys == ["new.csv"]
+    assert len(index) == 2
+    index.close()
+
+    restarted = FileIndex(index_path)
+    assert not restarted.created
+    restarted.close()
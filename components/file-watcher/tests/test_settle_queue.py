@@ -0,0 +1,81 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import os
+import time
+
+import pytest
+from conftest import wait_for, write
+from util.settle_queue import EVENTS_COALESCED, SettleQueue
+
+QUIET_PERIOD_SEC = 1
+
+
+@pytest.fixture
+def settled():
+    return []
+
+
+@pytest.fixture
+def queue(settled):
+    settle_queue = SettleQueue(QUIET_PERIOD_SEC, settled.append)
+    settle_queue.start()
+    yield settle_queue
+    settle_queue.stop()
+
+
+def test_file_is_handed_off_once_its_writes_settle(tmp_path, queue, settled):
+    path = os.path.join(str(tmp_path), "a.csv")
+    write(path, b"1\n")
+    submitted_at = time.monotonic()
+    queue.submit(path)
+
+    # Still written: the quiet period starts again on each change
+    for i in range(4):
+        time.sleep(0.5)
+        write(path, b"%d\n" % i)
+        queue.submit(path)
+    assert settled == []
+
+    wait_for(lambda: len(settled) > 0)
+    assert settled == [path]
+    assert time.monotonic() - submitted_at >= 2 + QUIET_PERIOD_SEC
+
+
+def test_events_of_a_pending_file_are_coalesced(tmp_path, queue, settled):
+    path = os.path.join(str(tmp_path), "a.csv")
+    write(path, b"1\n")
+    coalesced = EVENTS_COALESCED.value
+
+    for i in range(3):
+        queue.submit(path)
+
+    wait_for(lambda: len(settled) > 0)
+    time.sleep(QUIET_PERIOD_SEC)
+    assert settled == [path]
+    assert EVENTS_COALESCED.value == coalesced + 2
+
+
+def test_closed_file_is_handed_off_without_the_quiet_period(tmp_path, settled):
+    queue = SettleQueue(60, settled.append)
+    queue.start()
+    path = os.path.join(str(tmp_path), "a.csv")
+    write(path, b"1\n")
+
+    queue.submit(path)
+    queue.submit(path, closed=True)
+
+    wait_for(lambda: len(settled) > 0, timeout_sec=5)
+    assert settled == [path]
+    queue.stop()
+
+
+def test_removed_file_is_not_handed_off(tmp_path, queue, settled):
+    path = os.path.join(str(tmp_path), "a.csv")
+    write(path, b"1\n")
+    queue.submit(path)
+
+    os.remove(path)
+    time.sleep(QUIET_PERIOD_SEC * 2)
+
+    assert settled == []
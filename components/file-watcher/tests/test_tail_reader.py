@@ -0,0 +1,159 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import os
+
+import pytest
+from conftest import wait_for, write
+from stream.s3_stream import S3ExportStream
+from util.file_index import STATE_PENDING, FileIndex
+from util.tail_reader import TailReader
+
+BUCKET = "test-bucket"
+KEY = "logs/a.csv"
+
+
+@pytest.fixture
+def data_dir(tmp_path) -> str:
+    return os.path.join(str(tmp_path), "data")
+
+
+@pytest.fixture
+def reader(data_dir, index) -> TailReader:
+    return TailReader(index, data_dir, ["*.csv"])
+
+
+class HandedOff(list):
+    """Parts handed off, as they would be appended to the export stream"""
+
+    def append_message(self, part_path: str, key: str):
+        self.append((part_path, key))
+
+
+@pytest.fixture
+def appended() -> HandedOff:
+    return HandedOff()
+
+
+def read(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def test_partial_line_is_left_for_the_next_part(data_dir, reader, appended):
+    path = os.path.join(data_dir, "a.csv")
+    append = appended.append_message
+
+    assert reader.hand_off(path, write(path, b"1,a\n2,"), KEY, append) == 4
+    assert reader.hand_off(path, write(path, b"b\n3,c"), KEY, append) == 4
+    # Flushed once settled, the last line without its newline as well
+    assert reader.hand_off(path, os.stat(path), KEY, append, flush=True) == 3
+    assert reader.hand_off(path, os.stat(path), KEY, append, flush=True) == 0
+
+    assert [key for _, key in appended] == [
+        "logs/a.csv.part0000",
+        "logs/a.csv.part0001",
+        "logs/a.csv.part0002",
+    ]
+    assert b"".join(read(part_path) for part_path, _ in appended) == read(path)
+
+
+def test_rotated_or_truncated_file_is_read_again_with_new_parts(
+    data_dir, reader, appended
+):
+    append = appended.append_message
+    path = os.path.join(data_dir, "a.csv")
+    reader.hand_off(path, write(path, b"1\n2\n"), KEY, append)
+
+    # Truncated
+    reader.hand_off(path, write(path, b"3\n", "wb"), KEY, append)
+    # Rotated: another file at the same path
+    os.rename(path, path + ".1")
+    reader.hand_off(path, write(path, b"4\n5\n"), KEY, append)
+
+    assert [key for _, key in appended] == [
+        "logs/a.csv.part0000",
+        "logs/a.csv.part0001",
+        "logs/a.csv.part0002",
+    ]
+    assert [read(part_path) for part_path, _ in appended] == [
+        b"1\n2\n",
+        b"3\n",
+        b"4\n5\n",
+    ]
+
+
+def test_position_survives_a_restart(data_dir, index_path, index, reader, appended):
+    append = appended.append_message
+    path = os.path.join(data_dir, "a.csv")
+    reader.hand_off(path, write(path, b"1\n"), KEY, append)
+    index.close()
+
+    restarted_index = FileIndex(index_path)
+    restarted = TailReader(restarted_index, data_dir, ["*.csv"])
+    restarted.hand_off(path, write(path, b"2\n"), KEY, append)
+
+    assert [read(part_path) for part_path, _ in appended] == [b"1\n", b"2\n"]
+    assert appended[1][1] == "logs/a.csv.part0001"
+    restarted_index.close()
+
+
+def test_failed_and_leftover_parts_are_handed_off_again(
+    data_dir, index_path, index, reader, appended
+):
+    append = appended.append_message
+    path = os.path.join(data_dir, "a.csv")
+    reader.hand_off(path, write(path, b"1\n"), KEY, append)
+    reader.hand_off(path, write(path, b"2\n"), KEY, append)
+    failed_path, uploaded_path = appended[0][0], appended[1][0]
+    reader.record_failed(failed_path)
+    reader.record_uploaded(uploaded_path)
+    # Copied to the spool, then killed before it was recorded
+    leftover_path = os.path.join(index_path + ".parts", "logs", "b.csv.part0000")
+    write(leftover_path, b"3\n")
+    appended.clear()
+
+    assert reader.hand_off_parts(append) == 1
+    assert appended == [(failed_path, "logs/a.csv.part0000")]
+    assert reader.hand_off_parts(append) == 0
+
+    appended.clear()
+    assert reader.hand_off_parts(append, leftover=True) == 1
+    assert appended == [(leftover_path, "logs/b.csv.part0000")]
+    assert not os.path.exists(uploaded_path)
+    assert index.parts() == {
+        failed_path: ("logs/a.csv.part0000", STATE_PENDING),
+        leftover_path: ("logs/b.csv.part0000", STATE_PENDING),
+    }
+
+
+def test_parts_are_exported_and_removed_from_the_spool(
+    tmp_path, data_dir, index, reader, client, shadows
+):
+    stream = S3ExportStream(
+        "tail_test",
+        BUCKET,
+        client=client,
+        uploaded_callback=reader.record_uploaded,
+        failed_callback=reader.record_failed,
+        checkpoint_dir=os.path.join(str(tmp_path), "checkpoint"),
+        checkpoint_sync_interval_sec=0,
+    )
+    path = os.path.join(data_dir, "a.csv")
+
+    reader.hand_off(path, write(path, b"1\n2\n"), KEY, stream.append_message)
+    reader.hand_off(path, write(path, b"3\n"), KEY, stream.append_message)
+
+    wait_for(lambda: index.parts() == {})
+    exported = os.path.join(str(tmp_path), "s3", BUCKET)
+    assert read(os.path.join(exported, KEY + ".part0000")) == b"1\n2\n"
+    assert read(os.path.join(exported, KEY + ".part0001")) == b"3\n"
+    assert os.listdir(index.path + ".parts") == ["logs"]
+    assert os.listdir(os.path.join(index.path + ".parts", "logs")) == []
+    stream.close()
+
+
+def test_only_the_tailed_patterns_are_uploaded_incrementally(data_dir, index, reader):
+    assert reader.is_tailed(os.path.join(data_dir, "x", "a.csv"))
+    assert not reader.is_tailed(os.path.join(data_dir, "a.bin"))
+    assert reader.is_part(os.path.join(index.path + ".parts", "a.csv.part0000"))
@@ -0,0 +1,580 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+"""End-to-end throughput benchmark of the opc-archiver pipeline
+
+Drives `OpcStreamHandler` and `SegmentUploadThread` with synthetic SiteWise collector
+payloads (same tags and value types as `opc_dummy/main.py`) through
+`LocalStreamManagerClient`, so that it runs on a dev box without Greengrass.
+The results are written as JSON to compare builds, e.g.
+
+    python benchmark.py --tags 500 --rate 10 --duration 60 \\
+        -c OpcLogCompression='"zstd"' -c OpcLogCompressionWorkers=4 \\
+        --output results.json
+
+The payloads are generated in the process of the pipeline (the collector is a separate
+process on a device), so use `--preload` to measure the maximum sustained throughput
+without the generator competing for the interpreter.
+"""
+
+import argparse
+import gzip
+import json
+import logging
+import os
+import platform
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from threading import Thread
+from typing import Any, Iterator, List
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+)
+
+import util.checkpoint  # noqa: E402
+import zstandard  # noqa: E402
+from opc_stream_archiver import (  # noqa: E402
+    BYTES_READ,
+    MESSAGES_READ,
+    MESSAGES_WRITTEN,
+    READ_SECONDS,
+    ROLLUP_LOG_SUFFIX,
+    OpcStreamHandler,
+)
+from segment.compression import COMPRESSION_EXTENSIONS, COMPRESSION_ZSTD  # noqa: E402
+from segment.dictionary import DICTIONARY_EXTENSION, read_dictionary_id  # noqa: E402
+from segment.parquet_segment_writer import PARQUET_EXTENSION  # noqa: E402
+from segment.processed_layout import NANOS_PER_MILLI  # noqa: E402
+from stream.backlog_manager import BacklogManager  # noqa: E402
+from stream.opc_stream import OPCStream  # noqa: E402
+from stream.s3_stream import S3ExportStream  # noqa: E402
+from util.gg_config import OUTPUT_FORMAT_PROCESSED, GGConfig  # noqa: E402
+from util.local_client import LocalStreamManagerClient  # noqa: E402
+from util.metrics import REGISTRY, Histogram  # noqa: E402
+from util.sitewise_payload import (  # noqa: E402
+    BOOLEAN_VALUE,
+    DOUBLE_VALUE,
+    INTEGER_VALUE,
+    STRING_VALUE,
+    iter_property_values,
+    parse_payload,
+)
+
+try:
+    import pyarrow.parquet as pq
+except ImportError:
+    # pyarrow is only required for the parquet output format
+    pq = None
+
+logger = logging.getLogger("opc-archiver-component-logger")
+
+DEFAULT_TAGS = 500
+DEFAULT_RATE = 1.0  # Samples per second and tag
+DEFAULT_DURATION_SEC = 60
+DEFAULT_ROOT_NODE = "root"
+DEFAULT_STREAM_MAX_SIZE = 256 * 1024 * 1024
+DEFAULT_DRAIN_TIMEOUT_SEC = 300
+
+# Value types of the tags, assigned in turn as in `opc_dummy/main.py`
+VALUE_TYPE_INT = "int"
+VALUE_TYPE_FLOAT = "float"
+VALUE_TYPE_STRING = "string"
+VALUE_TYPE_BOOL = "bool"
+VALUE_TYPES = [VALUE_TYPE_BOOL, VALUE_TYPE_INT, VALUE_TYPE_FLOAT, VALUE_TYPE_STRING]
+STRING_VALUES = ["good", "bad", "nice"]
+
+# Component configuration of the benchmark, overridden with `-c Key=Value`
+BENCHMARK_BUCKET = "benchmark"
+BENCHMARK_PROCESSED_BUCKET = "benchmark-processed"
+BENCHMARK_STREAM_NAME = "opc_benchmark"
+BENCHMARK_CONFIG = {
+    "Bucket": BENCHMARK_BUCKET,
+    "ProcessedBucket": BENCHMARK_PROCESSED_BUCKET,
+    "OpcStreamName": BENCHMARK_STREAM_NAME,
+    # Rotated by size rather than every minute, so that short runs archive segments
+    "OpcLogMaxMessages": 50000,
+    "CheckpointSyncIntervalSec": 0,
+}
+
+# Interval to poll the progress of the pipeline (sec)
+PROGRESS_INTERVAL = 0.1
+
+LATENCY_PERCENTILES = [50, 90, 95, 99]
+
+
+class LocalShadowController:
+    """In-memory stand-in for `ShadowController` (the benchmark runs without Greengrass IPC)"""
+
+    def __init__(self, shadow_name: str):
+        self._shadow_name = shadow_name
+        self._reported = {}
+
+    def get_thing_shadow_request(self) -> dict:
+        return dict(self._reported)
+
+    def update_thing_shadow_request(self, payload: dict) -> Any:
+        self._reported = dict(payload)
+        return {"state": {"reported": self._reported}}
+
+
+class BenchmarkConfig(GGConfig):
+    """Component configuration given on the command line instead of the recipe"""
+
+    def __init__(self, configuration: dict):
+        self._configuration = configuration
+        super(BenchmarkConfig, self).__init__()
+
+    def component_configuration(self):
+        return self._configuration
+
+
+class PayloadGenerator:
+    """Generates SiteWise collector payloads of the `opc_dummy` tags"""
+
+    def __init__(self, tags: int, value_types: List[str], root_node: str):
+        """
+        Parameters
+        ----------
+        tags: int
+            Number of tags
+        value_types: List[str]
+            Value types assigned in turn to the tags (`int`, `float`, `string`, `bool`)
+        root_node: str
+            Root node of the tag aliases (`/{root_node}/tag{i}`)
+        """
+        self._aliases = [f"/{root_node}/tag{i}" for i in range(tags)]
+        self._value_types = [value_types[i % len(value_types)] for i in range(tags)]
+        self._floats = [10.0] * tags
+
+    @property
+    def tags(self) -> int:
+        return len(self._aliases)
+
+    def generate(self) -> Iterator[bytes]:
+        """Generate one payload per tag, timestamped now"""
+        now = time.time_ns()
+        timestamp = {
+            "timeInSeconds": now // 1000000000,
+            "offsetInNanos": now % 1000000000,
+        }
+        for i, alias in enumerate(self._aliases):
+            yield json.dumps(
+                {
+                    "propertyAlias": alias,
+                    "propertyValues": [
+                        {
+                            "value": self._value(i),
+                            "timestamp": timestamp,
+                            "quality": "GOOD",
+                        }
+                    ],
+                },
+                separators=(",", ":"),
+            ).encode()
+
+    def _value(self, i: int) -> dict:
+        value_type = self._value_types[i]
+        if value_type == VALUE_TYPE_INT:
+            return {INTEGER_VALUE: random.randint(1, 100)}
+        if value_type == VALUE_TYPE_FLOAT:
+            # Random walk
+            self._floats[i] += random.uniform(-2, 2)
+            return {DOUBLE_VALUE: self._floats[i]}
+        if value_type == VALUE_TYPE_STRING:
+            return {STRING_VALUE: random.choice(STRING_VALUES)}
+
+        return {BOOLEAN_VALUE: bool(random.getrandbits(1))}
+
+
+def parse_config_overrides(overrides: List[str]) -> dict:
+    """Parse `Key=Value` overrides of the component configuration (values are JSON if valid)"""
+    config = {}
+    for override in overrides:
+        key, separator, value = override.partition("=")
+        if not separator:
+            raise ValueError(f"invalid configuration {override} (expected Key=Value)")
+        try:
+            config[key] = json.loads(value)
+        except ValueError as e:
+            config[key] = value
+
+    return config
+
+
+def histogram_summary(histogram: Histogram) -> dict:
+    """Count, mean and percentiles (upper bound of the bucket) of a histogram"""
+    buckets, total, count = histogram.snapshot()
+    summary = {"count": count, "mean": total / count if count > 0 else None}
+    for percentile in LATENCY_PERCENTILES:
+        value = None
+        for upper_bound, cumulative in buckets:
+            if count > 0 and cumulative >= count * percentile / 100:
+                value = None if upper_bound == "+Inf" else float(upper_bound)
+                break
+        summary[f"p{percentile}"] = value
+
+    return summary
+
+
+def latency_summary(latencies: List[float]) -> dict:
+    """Count, mean, max and percentiles of latencies"""
+    if len(latencies) == 0:
+        return {"count": 0}
+
+    latencies = sorted(latencies)
+    summary = {
+        "count": len(latencies),
+        "mean": sum(latencies) / len(latencies),
+        "max": latencies[-1],
+    }
+    for percentile in LATENCY_PERCENTILES:
+        index = min(len(latencies) - 1, int(len(latencies) * percentile / 100))
+        summary[f"p{percentile}"] = latencies[index]
+
+    return summary
+
+
+def peak_rss_bytes() -> int:
+    """Peak resident set size of the process"""
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return max_rss if sys.platform == "darwin" else max_rss * 1024
+
+
+def read_timestamps(path: str, dictionary_dir: str) -> Iterator[int]:
+    """Timestamps (ns) of the property values of an archived raw segment"""
+    if path.endswith(f".{PARQUET_EXTENSION}"):
+        if "timestamp_ns" in pq.read_schema(path).names:
+            yield from pq.read_table(path, columns=["timestamp_ns"])[
+                "timestamp_ns"
+            ].to_pylist()
+        else:
+            # Partition of the `opc_processed` layout (timestamps in ms)
+            yield from (
+                timestamp.value * NANOS_PER_MILLI
+                for timestamp in pq.read_table(path, columns=["timestamp"])["timestamp"]
+            )
+        return
+
+    if path.endswith(f".{COMPRESSION_EXTENSIONS[COMPRESSION_ZSTD]}"):
+        dictionary = None
+        dict_id = read_dictionary_id(path)
+        if dict_id != 0:
+            with open(
+                os.path.join(dictionary_dir, f"{dict_id}.{DICTIONARY_EXTENSION}"), "rb"
+            ) as f:
+                dictionary = zstandard.ZstdCompressionDict(f.read())
+        with open(path, "rb") as f:
+            data = (
+                zstandard.ZstdDecompressor(dict_data=dictionary)
+                .stream_reader(f, read_across_frames=True)
+                .read()
+            )
+    else:
+        with gzip.open(path, "rb") as f:
+            data = f.read()
+
+    for line in data.splitlines():
+        if line:
+            for alias, timestamp, value_type, value, quality in iter_property_values(
+                parse_payload(line)
+            ):
+                yield timestamp
+
+
+def archived_segments(export_dir: str, config: GGConfig) -> List[str]:
+    """Raw segments exported to the local bucket
+
+    In the processed layout, each segment is exported as one object per tag and hour,
+    all named after the segment.
+    """
+    rollup_prefix = f"{config.opc_log_name}{ROLLUP_LOG_SUFFIX}."
+    bucket = (
+        config.processed_bucket
+        if config.opc_output_format == OUTPUT_FORMAT_PROCESSED
+        else config.bucket
+    )
+    segments = []
+    for root, dirs, files in os.walk(os.path.join(export_dir, bucket)):
+        for filename in files:
+            if filename.startswith(
+                f"{config.opc_log_name}."
+            ) and not filename.startswith(rollup_prefix):
+                segments.append(os.path.join(root, filename))
+
+    return segments
+
+
+def segment_names(paths: List[str]) -> set:
+    return {os.path.basename(path) for path in paths}
+
+
+def run(args: argparse.Namespace) -> dict:
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix="opc-archiver-benchmark-")
+    export_dir = os.path.join(work_dir, "s3")
+    configuration = {
+        **BENCHMARK_CONFIG,
+        "OpcLogDir": os.path.join(work_dir, "opclogs", ""),
+        "OpcLogArchiveDir": os.path.join(work_dir, "opclogs", "archive", ""),
+        "CheckpointDir": os.path.join(work_dir, "opclogs", "checkpoint", ""),
+        "DictionaryDir": os.path.join(work_dir, "opclogs", "dictionary", ""),
+        **parse_config_overrides(args.config),
+    }
+
+    # Checkpoints are synced to an in-memory shadow instead of the device shadow
+    util.checkpoint.ShadowController = LocalShadowController
+
+    config = BenchmarkConfig(configuration)
+    client = LocalStreamManagerClient(export_dir)
+    s3_stream = S3ExportStream(
+        f"{config.opc_stream_name}_s3_export",
+        config.bucket,
+        clear_stream=True,
+        delete_moved_file=config.delete_moved_file,
+        checkpoint_dir=config.checkpoint_dir,
+        checkpoint_sync_interval_sec=config.checkpoint_sync_interval_sec,
+        client=client,
+    )
+    opc_stream = OPCStream(
+        config.opc_stream_name,
+        clear_stream=True,
+        stream_max_size=args.stream_max_size,
+        client=client,
+    )
+    generator = PayloadGenerator(args.tags, args.value_types, args.root_node)
+    ticks = max(1, int(args.rate * args.duration))
+
+    appended = 0
+    appended_bytes = 0
+    if args.preload:
+        for tick in range(ticks):
+            for payload in generator.generate():
+                opc_stream.append_message(payload)
+                appended_bytes += len(payload)
+                appended += 1
+        logger.info(f"preloaded {appended} messages")
+
+    backlog = BacklogManager(
+        s3_stream,
+        config.opc_archive_dir,
+        config.opc_archive_max_bytes,
+        config.opc_archive_eviction_policy,
+        config.upload_max_in_flight,
+        config.upload_fresh_age_sec,
+        config.delete_moved_file,
+    )
+    backlog.start()
+    handler = OpcStreamHandler(config, opc_stream, backlog)
+    handler_thread = Thread(target=handler.start, daemon=True)
+    started_at = time.time()
+    handler_thread.start()
+
+    if not args.preload:
+        interval = 1 / args.rate
+        for tick in range(ticks):
+            for payload in generator.generate():
+                opc_stream.append_message(payload)
+                appended_bytes += len(payload)
+                appended += 1
+            delay = started_at + (tick + 1) * interval - time.time()
+            if delay > 0:
+                time.sleep(delay)
+    generated_at = time.time()
+
+    # Wait until the pipeline has read every message and archived the rotated segments
+    deadline = time.time() + args.drain_timeout
+    while handler.get_next_sequence_number() < appended and time.time() < deadline:
+        time.sleep(PROGRESS_INTERVAL)
+    consumed_at = time.time()
+    consumed = min(appended, handler.get_next_sequence_number())
+
+    rotated_counter = REGISTRY.counter(
+        "opc_segments_rotated_total",
+        "Segments rotated for archiving",
+        {"segment": config.opc_log_name},
+    )
+    while (
+        len(segment_names(archived_segments(export_dir, config)))
+        < rotated_counter.value
+        and time.time() < deadline
+    ):
+        time.sleep(PROGRESS_INTERVAL)
+
+    handler.stop()
+    handler_thread.join()
+    backlog.stop()
+    s3_stream.close()
+    client.close()
+
+    # Measured before the segments are read back
+    peak_rss = peak_rss_bytes()
+
+    latencies = []
+    archived_bytes = 0
+    for path in archived_segments(export_dir, config):
+        archived_at = os.stat(path).st_mtime_ns
+        archived_bytes += os.path.getsize(path)
+        latencies.extend(
+            (archived_at - timestamp) / 1e9
+            for timestamp in read_timestamps(path, config.dictionary_dir)
+        )
+
+    elapsed = consumed_at - started_at
+    segment_labels = {"segment": config.opc_log_name}
+    results = {
+        "label": args.label,
+        "parameters": {
+            "tags": args.tags,
+            "rate": args.rate,
+            "duration_sec": args.duration,
+            "value_types": args.value_types,
+            "preload": args.preload,
+            "stream_max_size": args.stream_max_size,
+            "config": configuration,
+        },
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+        },
+        "results": {
+            "messages_appended": appended,
+            "messages_consumed": consumed,
+            "messages_read": MESSAGES_READ.value,
+            "messages_written": MESSAGES_WRITTEN.value,
+            "append_messages_per_sec": (
+                appended / max(generated_at - started_at, 1e-9)
+                if not args.preload
+                else None
+            ),
+            "elapsed_sec": elapsed,
+            "messages_per_sec": consumed / elapsed if elapsed > 0 else None,
+            "bytes_per_sec": BYTES_READ.value / elapsed if elapsed > 0 else None,
+            "appended_bytes": appended_bytes,
+            "segments_rotated": rotated_counter.value,
+            "segments_archived": len(
+                segment_names(archived_segments(export_dir, config))
+            ),
+            "archived_bytes": archived_bytes,
+            "compression_ratio": REGISTRY.gauge(
+                "opc_segment_compression_ratio",
+                "Payload bytes / file size of the last rotated segment",
+                segment_labels,
+            ).value,
+            "read_latency_sec": histogram_summary(READ_SECONDS),
+            "batch_write_latency_sec": histogram_summary(
+                REGISTRY.histogram(
+                    "opc_batch_write_seconds",
+                    "Time to compress and write a batch to a segment",
+                    segment_labels,
+                )
+            ),
+            "segment_close_latency_sec": histogram_summary(
+                REGISTRY.histogram(
+                    "opc_segment_close_seconds",
+                    "Time to complete a segment before its rotation",
+                    segment_labels,
+                )
+            ),
+            "end_to_end_latency_sec": latency_summary(latencies),
+            "peak_rss_bytes": peak_rss,
+        },
+    }
+
+    if not args.keep and not args.work_dir:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="End-to-end throughput benchmark of the opc-archiver pipeline"
+    )
+    parser.add_argument("--tags", type=int, default=DEFAULT_TAGS, help="Number of tags")
+    parser.add_argument(
+        "--rate",
+        type=float,
+        default=DEFAULT_RATE,
+        help="Samples per second and tag",
+    )
+    parser.add_argument(
+        "--duration",
+        type=int,
+        default=DEFAULT_DURATION_SEC,
+        help="Seconds of data to generate",
+    )
+    parser.add_argument(
+        "--value-types",
+        type=lambda value: value.split(","),
+        default=VALUE_TYPES,
+        help="Comma separated value types assigned in turn to the tags "
+        "(int, float, string, bool)",
+    )
+    parser.add_argument(
+        "--root-node", default=DEFAULT_ROOT_NODE, help="Root node of the tag aliases"
+    )
+    parser.add_argument(
+        "--preload",
+        action="store_true",
+        help="Append all the messages before the pipeline starts (maximum throughput)",
+    )
+    parser.add_argument(
+        "--stream-max-size",
+        type=int,
+        default=DEFAULT_STREAM_MAX_SIZE,
+        help="Maximum size of the OPC stream (in bytes)",
+    )
+    parser.add_argument(
+        "-c",
+        "--config",
+        action="append",
+        default=[],
+        help="Component configuration as Key=Value (JSON value), e.g. "
+        "OpcLogCompression='\"zstd\"'",
+    )
+    parser.add_argument(
+        "--drain-timeout",
+        type=int,
+        default=DEFAULT_DRAIN_TIMEOUT_SEC,
+        help="Time to wait for the pipeline to archive the data (sec)",
+    )
+    parser.add_argument("--work-dir", help="Working directory (temporary if not set)")
+    parser.add_argument(
+        "--keep", action="store_true", help="Keep the temporary working directory"
+    )
+    parser.add_argument("--label", help="Label of the build in the results")
+    parser.add_argument("--output", help="JSON file of the results (stdout if not set)")
+    parser.add_argument(
+        "-l",
+        "--log-level",
+        choices=["debug", "info", "warn", "error"],
+        default="warn",
+        help="LogLevel (info / warn / error / debug)",
+    )
+    args = parser.parse_args()
+
+    for value_type in args.value_types:
+        if value_type not in VALUE_TYPES:
+            parser.error(f"invalid value type {value_type}")
+
+    logging.basicConfig(format="[%(levelname)8s] %(filename)s(%(lineno)s) %(message)s")
+    logger.setLevel(logging._nameToLevel[args.log_level.upper()])
+
+    results = run(args)
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
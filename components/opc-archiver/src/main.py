@@ -2,11 +2,15 @@
 # SPDX-License-Identifier: MIT-0
 
 import logging
+from threading import Event, Thread
+from typing import List
 
-from opc_stream_archiver import OpcStreamHandler
+from opc_stream_archiver import OpcStreamHandler, create_compression_pool
+from stream.backlog_manager import BacklogManager
 from stream.opc_stream import OPCStream
 from stream.s3_stream import S3ExportStream
 from util.gg_config import GGConfig
+from util.metrics import EmfLogThread, start_http_server
 
 logger = logging.getLogger("opc-archiver-component-logger")
 logger.setLevel(logging.INFO)
@@ -15,20 +19,99 @@ handler.setFormatter(
     logging.Formatter("[%(levelname)8s] %(filename)s(%(lineno)s) %(message)s")
 )
 logger.addHandler(handler)
+# Modules shared with the other components (`components/common`) log as `util.*`
+shared_logger = logging.getLogger("util")
+shared_logger.setLevel(logging.INFO)
+shared_logger.addHandler(handler)
+
+METRICS_NAMESPACE = "IndustrialDataPlatform/opc-archiver"
+
+
+def run_handlers(handlers: List[OpcStreamHandler]) -> None:
+    """Run each handler in its own reader thread until one of them stops
+
+    The others are stopped as well, and the error of the first failing handler is raised
+    so that the component is restarted.
+    """
+    stopped = Event()
+    errors = []
+
+    def run(handler: OpcStreamHandler) -> None:
+        try:
+            handler.start()
+        except Exception as e:
+            errors.append(e)
+        finally:
+            stopped.set()
+
+    threads = [
+        Thread(target=run, args=(handler,), name=f"opc-reader-{index}", daemon=True)
+        for index, handler in enumerate(handlers)
+    ]
+    for thread in threads:
+        thread.start()
+
+    stopped.wait()
+    for handler in handlers:
+        handler.stop()
+    for thread in threads:
+        thread.join()
+
+    if len(errors) > 0:
+        raise errors[0]
 
 
 def main():
     try:
         config = GGConfig()
         logger.setLevel(logging._nameToLevel[config.log_level.upper()])
+        shared_logger.setLevel(logging._nameToLevel[config.log_level.upper()])
+
+        # Local metrics (Prometheus text endpoint and/or periodic EMF log lines)
+        if config.metrics_port > 0:
+            start_http_server(config.metrics_port)
+        if config.metrics_emf_interval_sec > 0:
+            EmfLogThread(METRICS_NAMESPACE, config.metrics_emf_interval_sec).start()
+
+        # One export stream, compression pool and upload check for all the OPC streams
+        s3_stream = S3ExportStream(
+            f"{config.opc_stream_names[0]}_s3_export",
+            config.bucket,
+            delete_moved_file=config.delete_moved_file,
+            checkpoint_dir=config.checkpoint_dir,
+            checkpoint_sync_interval_sec=config.checkpoint_sync_interval_sec,
+        )
 
-        s3_stream = S3ExportStream(f"{config.opc_stream_name}_s3_export", config.bucket)
+        # Store-and-forward queue of the archive in front of the export stream
+        backlog = BacklogManager(
+            s3_stream,
+            config.opc_archive_dir,
+            config.opc_archive_max_bytes,
+            config.opc_archive_eviction_policy,
+            config.upload_max_in_flight,
+            config.upload_fresh_age_sec,
+            config.delete_moved_file,
+        )
+        backlog.start()
 
-        opc_stream = OPCStream(config.opc_stream_name)
+        compression_pool = create_compression_pool(config)
 
-        opc_archiver = OpcStreamHandler(config, opc_stream, s3_stream)
+        # One reader/writer pipeline per OPC stream
+        handlers = [
+            OpcStreamHandler(config, OPCStream(stream_name), backlog, compression_pool)
+            for stream_name in config.opc_stream_names
+        ]
 
-        opc_archiver.start()
+        try:
+            if len(handlers) == 1:
+                handlers[0].start()
+            else:
+                run_handlers(handlers)
+        finally:
+            if compression_pool is not None:
+                compression_pool.shutdown()
+            backlog.stop()
+            s3_stream.close()
 
     except Exception as e:
         logger.exception(e)
@@ -0,0 +1,27 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+from abc import abstractmethod
+from typing import List
+
+from stream_manager.data import Message
+
+
+class AbstractMessageFilter:
+    """Base class for filters applied to the messages read from the OPC stream before they are written"""
+
+    @abstractmethod
+    def filter(self, messages: List[Message]) -> List[Message]:
+        """Return the messages to be archived
+
+        Parameters
+        ----------
+        messages: List[Message]
+            Messages read from the stream
+
+        Returns
+        -------
+        List[Message]
+            Messages to be written, in the same order (possibly with a rewritten payload)
+        """
+        pass
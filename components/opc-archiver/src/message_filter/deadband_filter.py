@@ -0,0 +1,208 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import json
+import logging
+import math
+from array import array
+from fnmatch import fnmatchcase
+from typing import Any, List
+
+from message_filter.abstract_message_filter import AbstractMessageFilter
+from stream_manager.data import Message
+from util.sitewise_payload import (
+    DOUBLE_VALUE,
+    INTEGER_VALUE,
+    NANOS_PER_SECOND,
+    parse_payload,
+    timestamp_ns,
+)
+
+logger = logging.getLogger("opc-archiver-component-logger")
+
+NO_RULE = -1
+
+# Compact codes of the property value qualities
+QUALITY_CODES = {None: 0, "GOOD": 1, "BAD": 2, "UNCERTAIN": 3}
+QUALITY_UNKNOWN = 255
+
+NUMERIC_VALUE_TYPES = (INTEGER_VALUE, DOUBLE_VALUE)
+
+
+class DeadbandRule:
+    """Deadband of the property aliases matching a pattern"""
+
+    def __init__(
+        self,
+        pattern: str,
+        absolute: float = 0.0,
+        percent: float = 0.0,
+        heartbeat_sec: int = 0,
+    ):
+        """
+        Parameters
+        ----------
+        pattern: str
+            Glob pattern of the property aliases (e.g. `/Plant1/*/Temperature`)
+        absolute: float
+            Numeric values are suppressed while they differ from the last archived value
+            by no more than this amount (0: disabled)
+        percent: float
+            Numeric values are suppressed while they differ from the last archived value
+            by no more than this percentage of it (0: disabled)
+        heartbeat_sec: int
+            A value is archived at least once per interval even if it did not change (0: never)
+        """
+        self.pattern = pattern
+        self.absolute = absolute
+        self.percent = percent
+        self.heartbeat_ns = heartbeat_sec * NANOS_PER_SECOND
+
+    def matches(self, alias: str) -> bool:
+        return fnmatchcase(alias, self.pattern)
+
+    def exceeds(self, value: float, last_value: float) -> bool:
+        """Whether a numeric value is outside the deadband of the last archived value
+
+        Without any deadband, only repeated values are suppressed (change of value).
+        """
+        delta = abs(value - last_value)
+        if self.absolute <= 0 and self.percent <= 0:
+            return delta > 0
+
+        return (self.absolute > 0 and delta > self.absolute) or (
+            self.percent > 0 and delta > abs(last_value) * self.percent / 100
+        )
+
+
+class DeadbandFilter(AbstractMessageFilter):
+    """Suppresses property values that did not change significantly since the last archived one
+
+    Rules are matched against the property alias in order (first match wins), aliases
+    without a matching rule are always archived. A value is archived when its quality
+    changed, when the heartbeat interval elapsed or when it is outside the deadband
+    (numeric values) or different (string and boolean values).
+
+    The state of a tag is kept in columns indexed by an alias-to-index dict instead of
+    a dict per tag, so that it stays small with a large number of tags.
+    """
+
+    def __init__(self, rules: List[DeadbandRule]):
+        """
+        Parameters
+        ----------
+        rules: List[DeadbandRule]
+            Deadband rules, in order of priority
+        """
+        self._rules = rules
+        self._indexes = {}
+        self._rule_indexes = array("i")
+        self._qualities = bytearray()
+        self._timestamps = array("q")  # Timestamp of the last archived value (ns)
+        self._values = array("d")  # Last archived numeric value (NaN if none)
+        self._hashes = array("q")  # Hash of the last archived value
+
+    def filter(self, messages: List[Message]) -> List[Message]:
+        filtered = []
+        for message in messages:
+            try:
+                entry = parse_payload(message.payload)
+                alias = entry.get("propertyAlias")
+            except (ValueError, AttributeError) as e:
+                logger.warning(f"archive a payload that cannot be parsed: {e}")
+                filtered.append(message)
+                continue
+
+            index = self._index(alias) if isinstance(alias, str) else NO_RULE
+            if index == NO_RULE or self._rule_indexes[index] == NO_RULE:
+                filtered.append(message)
+                continue
+
+            property_values = entry.get("propertyValues", [])
+            try:
+                kept = [
+                    property_value
+                    for property_value in property_values
+                    if self._keep(index, property_value)
+                ]
+            except (ValueError, AttributeError, TypeError) as e:
+                logger.warning(f"archive a payload with malformed values: {e}")
+                filtered.append(message)
+                continue
+            if len(kept) == len(property_values):
+                filtered.append(message)
+            elif len(kept) > 0:
+                entry["propertyValues"] = kept
+                filtered.append(
+                    Message(
+                        stream_name=message.stream_name,
+                        sequence_number=message.sequence_number,
+                        ingest_time=message.ingest_time,
+                        payload=json.dumps(entry, separators=(",", ":")).encode(),
+                    )
+                )
+
+        return filtered
+
+    def _index(self, alias: str) -> int:
+        """Index of the state of a tag (allocated on the first value)"""
+        index = self._indexes.get(alias)
+        if index is None:
+            index = len(self._rule_indexes)
+            self._indexes[alias] = index
+            self._rule_indexes.append(
+                next(
+                    (i for i, rule in enumerate(self._rules) if rule.matches(alias)),
+                    NO_RULE,
+                )
+            )
+            self._qualities.append(QUALITY_UNKNOWN)
+            self._timestamps.append(-1)
+            self._values.append(math.nan)
+            self._hashes.append(0)
+
+        return index
+
+    def _keep(self, index: int, property_value: dict) -> bool:
+        rule = self._rules[self._rule_indexes[index]]
+        value = property_value.get("value", {})
+        value_type = next(iter(value), None)
+        current = value.get(value_type)
+        quality = QUALITY_CODES.get(property_value.get("quality"), QUALITY_UNKNOWN)
+        timestamp = timestamp_ns(property_value)
+
+        last_timestamp = self._timestamps[index]
+        if (
+            last_timestamp < 0
+            or quality != self._qualities[index]
+            or (
+                rule.heartbeat_ns > 0
+                and timestamp - last_timestamp >= rule.heartbeat_ns
+            )
+            or self._changed(rule, index, value_type, current)
+        ):
+            self._update(index, value_type, current, quality, timestamp)
+            return True
+
+        return False
+
+    def _changed(
+        self, rule: DeadbandRule, index: int, value_type: str, current: Any
+    ) -> bool:
+        if value_type in NUMERIC_VALUE_TYPES and isinstance(current, (int, float)):
+            last_value = self._values[index]
+            return math.isnan(last_value) or rule.exceeds(current, last_value)
+
+        return hash((value_type, current)) != self._hashes[index]
+
+    def _update(
+        self, index: int, value_type: str, current: Any, quality: int, timestamp: int
+    ) -> None:
+        self._qualities[index] = quality
+        self._timestamps[index] = timestamp
+        if value_type in NUMERIC_VALUE_TYPES and isinstance(current, (int, float)):
+            self._values[index] = current
+            self._hashes[index] = 0
+        else:
+            self._values[index] = math.nan
+            self._hashes[index] = hash((value_type, current))
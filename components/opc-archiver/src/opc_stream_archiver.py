@@ -1,27 +1,91 @@
 # Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
 # SPDX-License-Identifier: MIT-0
 
-import gzip
 import logging
-import logging.handlers
 import os
+import queue
 import re
 import shutil
 import time
-from typing import Any
-
+from concurrent.futures import ThreadPoolExecutor
+from fnmatch import fnmatch
+from threading import Event, Thread
+from typing import Any, List
+
+from message_filter.abstract_message_filter import AbstractMessageFilter
+from message_filter.deadband_filter import DeadbandFilter, DeadbandRule
+from rollup.rollup_aggregator import RollupAggregator
+from segment.abstract_segment_writer import AbstractSegmentWriter, RotationPolicy
+from segment.compression import (
+    COMPRESSION_EXTENSIONS,
+    COMPRESSION_ZSTD,
+    FAST_COMPRESSION_LEVELS,
+)
+from segment.dictionary import (
+    DICTIONARY_METADATA_KEY,
+    DictionaryStore,
+    read_dictionary_id,
+)
+from segment.hourly_segment_writer import HourlySegmentWriter
+from segment.manifest import SegmentManifestJournal
+from segment.parquet_segment_writer import PARQUET_EXTENSION, ParquetSegmentWriter
+from segment.processed_layout import (
+    processed_key,
+    split_processed_segment,
+    write_processed_table,
+)
+from segment.segment_writer import SegmentWriter
+from stream.backlog_manager import (
+    KIND_DICTIONARY,
+    KIND_ROLLUP,
+    KIND_SEGMENT,
+    BacklogManager,
+)
 from stream.opc_stream import OPCStream
-from stream.s3_stream import S3ExportStream
-from util.gg_config import GGConfig
-from util.shadow import ShadowController
-from watchdog.events import FileMovedEvent, PatternMatchingEventHandler
-from watchdog.observers.polling import PollingObserver
+from stream.stream_monitor import StreamMonitorThread
+from util.checkpoint import CheckpointStore
+from util.gg_config import (
+    OUTPUT_FORMAT_PARQUET,
+    OUTPUT_FORMAT_PROCESSED,
+    GGConfig,
+)
+from util.metrics import REGISTRY
 
 OPC_SEQUENCE_SHADOW_NAME = "opc_latest_sequence_number"
-OPC_LOGGER_NAME = "opc-logger"
 OPC_NEXT_SEQUENCE_PROP_NAME = "next_sequence_number"
-
-STREAM_READ_MAX_SIZE = 5000  # Maximum size to be read from the stream at one time (as long as the size is large enough to avoid data retention)
+OPC_PENDING_SEGMENTS_PROP_NAME = "pending_segments"
+OPC_COMMITTED_HOURS_PROP_NAME = "committed_hours"
+
+# Time for the server to wait for a message when the stream is empty
+STREAM_READ_TIMEOUT_MILLIS = 1000
+# Time to let messages accumulate after a partial read (sec)
+STREAM_READ_INTERVAL = 0.1
+# Wait after a failed read, doubled on each consecutive failure up to the maximum (sec)
+STREAM_READ_ERROR_WAIT_SEC = 0.5
+STREAM_READ_ERROR_MAX_WAIT_SEC = 30
+# Interval to check the backlog while it is over budget with the `refuse` policy (sec)
+BACKLOG_FULL_WAIT_SEC = 5
+
+# Rollup segments are written as `{opc_log_name}-rollup`
+ROLLUP_LOG_SUFFIX = "-rollup"
+# Characters of a stream name replaced in the segment and shadow names of its pipeline
+STREAM_NAME_UNSAFE_CHARS = "[^a-zA-Z0-9_-]"
+
+MESSAGES_READ = REGISTRY.counter(
+    "opc_messages_read_total", "Messages read from the OPC stream"
+)
+BYTES_READ = REGISTRY.counter(
+    "opc_read_bytes_total", "Payload bytes read from the OPC stream"
+)
+MESSAGES_WRITTEN = REGISTRY.counter(
+    "opc_messages_written_total", "Messages written to segments after filtering"
+)
+READ_SECONDS = REGISTRY.histogram(
+    "opc_stream_read_seconds", "Time to read a batch from the OPC stream"
+)
+READ_ERRORS = REGISTRY.counter(
+    "opc_stream_read_errors_total", "Failed reads of the OPC stream"
+)
 
 logger = logging.getLogger("opc-archiver-component-logger")
 
@@ -33,129 +97,565 @@ class OpcStreamHandler:
     """
 
     def __init__(
-        self, config: GGConfig, opc_stream: OPCStream, s3_stream: S3ExportStream
+        self,
+        config: GGConfig,
+        opc_stream: OPCStream,
+        backlog: BacklogManager,
+        compression_pool: ThreadPoolExecutor = None,
     ):
         """
+        The stream of `OpcStreamName` is archived as `{opc_log_name}` with the
+        `opc_latest_sequence_number` shadow. Each other stream has its own segment prefix,
+        shadow and dictionaries, suffixed with its name (e.g. `{opc_log_name}-{stream_name}`),
+        so that several handlers can run side by side.
+
         Parameters
         ----------
         config: GGConfig
         opc_stream: OPCStream
-        s3_stream: S3ExportStream
+        backlog: BacklogManager
+            Queue of the archived segments in front of the S3 export (shared by the handlers)
+        compression_pool: ThreadPoolExecutor
+            Pool to compress batches, shared by the handlers
+            (a pool of `opc_log_compression_workers` owned by the handler if not specified)
         """
         self._config = config
         self._stream = opc_stream
+        self._backlog = backlog
+
+        checkpoint_name = OPC_SEQUENCE_SHADOW_NAME
+        self._log_name = self._config.opc_log_name
+        dictionary_dir = self._config.dictionary_dir
+        if opc_stream.stream_name != self._config.opc_stream_name:
+            suffix = re.sub(STREAM_NAME_UNSAFE_CHARS, "_", opc_stream.stream_name)
+            checkpoint_name = f"{checkpoint_name}_{suffix}"
+            self._log_name = f"{self._log_name}-{suffix}"
+            dictionary_dir = os.path.join(dictionary_dir, suffix)
 
         try:
             os.makedirs(self._config.opc_log_dir)
         except FileExistsError as e:
             pass
 
-        # Create monitoring handler for OPC log files (OPC messages every minute that are compressed and sent)
-        file_event_handler = FileWatchHandler(
-            config, s3_stream, self.save_next_sequence_number
+        # Segments are committed with the read position of the stream before they are handed off.
+        # Only the read position is synced to the shadow, the manifests stay in the journal
+        self._checkpoint = CheckpointStore(
+            checkpoint_name,
+            self._config.checkpoint_dir,
+            self._config.checkpoint_sync_interval_sec,
+            [OPC_PENDING_SEGMENTS_PROP_NAME, OPC_COMMITTED_HOURS_PROP_NAME],
+        )
+        self._manifest_journal = SegmentManifestJournal(
+            self._checkpoint,
+            OPC_NEXT_SEQUENCE_PROP_NAME,
+            OPC_PENDING_SEGMENTS_PROP_NAME,
+            OPC_COMMITTED_HOURS_PROP_NAME,
         )
-        self._observer = PollingObserver()
-        self._observer.schedule(file_event_handler, config.opc_log_dir, recursive=False)
-        self._observer.start()
-
-        opc_log_path = f"{self._config.opc_log_dir}{self._config.opc_log_name}"
-
-        self._opc_logger = logging.getLogger(OPC_LOGGER_NAME)
-        self._opc_logger.setLevel(logging.INFO)
-        opc_handler = logging.handlers.TimedRotatingFileHandler(
-            opc_log_path,
-            encoding="utf-8",
-            when="M",
-            interval=self._config.opc_log_interval_min,
-            backupCount=0,
+
+        # Uploader of the rotated OPC log files, handed over by the writers as soon as they rotate
+        self._uploader = SegmentUploadThread(
+            config, backlog, self._manifest_journal, self._log_name
         )
-        opc_handler.setLevel(logging.INFO)
-        self._opc_logger.addHandler(opc_handler)
 
-        self._shadow = ShadowController(OPC_SEQUENCE_SHADOW_NAME)
-        shadow_payload = self._shadow.get_thing_shadow_request()
-        self._next_sequence_number = shadow_payload.get(OPC_NEXT_SEQUENCE_PROP_NAME, 0)
+        # Writer of OPC segment files (rotated every `opc_log_interval_min` minutes,
+        # or earlier when a segment reaches `opc_log_max_bytes` or `opc_log_max_messages`)
+        rotation_policy = RotationPolicy(
+            self._config.opc_log_interval_min * 60,
+            max_bytes=self._config.opc_log_max_bytes,
+            max_messages=self._config.opc_log_max_messages,
+        )
+        # Pool to compress batches on several cores (0 compresses in the reader thread)
+        self._compression_pool = compression_pool
+        self._owns_compression_pool = (
+            compression_pool is None and self._config.opc_log_compression_workers > 0
+        )
+        if self._owns_compression_pool:
+            self._compression_pool = create_compression_pool(self._config)
+        # zstd dictionaries trained from recent payloads, archived with the segments
+        self._dictionary_store = None
+        if (
+            self._config.opc_output_format
+            not in [OUTPUT_FORMAT_PARQUET, OUTPUT_FORMAT_PROCESSED]
+            and self._config.opc_log_compression_dictionary
+        ):
+            self._dictionary_store = DictionaryStore(
+                dictionary_dir,
+                self._config.dictionary_size,
+                self._config.dictionary_retrain_interval_min * 60,
+                self._uploader.submit_dictionary,
+            )
+        if self._config.opc_log_align_data_hour:
+            # One segment per hour of the sample timestamps, keyed with that hour
+            self._segment_writer = HourlySegmentWriter(
+                self._config.opc_log_dir,
+                self._log_name,
+                rotation_policy,
+                lambda data_hour, manifest_journal: self._create_segment_writer(
+                    rotation_policy, manifest_journal, data_hour
+                ),
+                manifest_journal=self._manifest_journal,
+            )
+        else:
+            self._segment_writer = self._create_segment_writer(
+                rotation_policy, self._manifest_journal
+            )
+
+        # Rollups of the raw values, written to their own segments
+        self._rollup_aggregator = None
+        self._rollup_writer = None
+        if len(self._config.rollup_windows_sec) > 0:
+            self._rollup_aggregator = RollupAggregator(self._config.rollup_windows_sec)
+            self._rollup_writer = SegmentWriter(
+                self._config.opc_log_dir,
+                f"{self._log_name}{ROLLUP_LOG_SUFFIX}",
+                RotationPolicy(self._config.opc_log_interval_min * 60),
+                compression=self._config.opc_log_compression,
+                compression_level=self._config.opc_log_compression_level,
+                flush_policy=self._config.opc_log_flush_policy,
+                fsync_policy=self._config.opc_log_fsync_policy,
+                rotated_callback=self._uploader.submit,
+            )
+
+        # Filters applied to the payloads before they are written
+        self._filters: List[AbstractMessageFilter] = []
+        if len(self._config.deadband_rules) > 0:
+            self._filters.append(
+                DeadbandFilter(
+                    [
+                        DeadbandRule(
+                            rule["Pattern"],
+                            rule["Absolute"],
+                            rule["Percent"],
+                            rule["HeartbeatSec"],
+                        )
+                        for rule in self._config.deadband_rules
+                    ]
+                )
+            )
+
+        # Resume right after the last committed segment, the pending ones are handed off again
+        self._next_sequence_number = self._manifest_journal.next_sequence_number
+        self._uploader.recover()
+        self._uploader.start()
 
         logger.info(
-            f"sequence number of the opc stream to start checking {self._next_sequence_number}"
+            f"sequence number of {opc_stream.stream_name} to start checking {self._next_sequence_number}"
         )
 
+        # Monitor of the lag behind the stream (sizes the reads and switches to catch-up mode)
+        self._monitor = StreamMonitorThread(self._stream, self.get_next_sequence_number)
+        self._catch_up = False
+        self._refused = False
+        self._stopped = Event()
+
     def start(self) -> None:
-        """Reads OPC data from a stream and writes it to a file"""
+        """Reads OPC data from a stream and writes it to a file
+
+        When a full batch is read, the next batch is read immediately to catch up with the backlog.
+        When the stream is empty, the read waits on the server until a message is appended
+        instead of polling at a fixed interval.
+        In catch-up mode (see `StreamMonitorThread`), batches are larger and segments are
+        compressed with the fastest level (see `update_catch_up`).
+        When a read fails (e.g. StreamManager is not reachable), the next one is retried
+        after a wait that grows with each consecutive failure.
+        """
+        read_timeout_millis = 0
+        error_wait_sec = STREAM_READ_ERROR_WAIT_SEC
+        self._monitor.start()
         try:
-            while True:
-                messages = self._stream.read_messages(
-                    self._next_sequence_number, STREAM_READ_MAX_SIZE
-                )
+            while not self._stopped.is_set():
+                if not self._backlog.accepting:
+                    # The messages wait in the OPC stream until the backlog is back in budget
+                    if not self._refused:
+                        logger.warning(
+                            f"backlog over its budget, stop reading {self._stream.stream_name}"
+                        )
+                    self._refused = True
+                    self._segment_writer.rotate_if_due()
+                    self._stopped.wait(BACKLOG_FULL_WAIT_SEC)
+                    continue
+                if self._refused:
+                    logger.info(f"resume reading {self._stream.stream_name}")
+                    self._refused = False
+
+                self.update_catch_up()
+
+                read_size = self._monitor.read_size
+                started_at = time.perf_counter()
+                try:
+                    messages = self._stream.read_messages(
+                        self._next_sequence_number,
+                        read_size,
+                        read_timeout_millis=read_timeout_millis,
+                    )
+                except Exception as e:
+                    READ_ERRORS.inc()
+                    logger.error(
+                        f"failed to read {self._stream.stream_name}, retry in {error_wait_sec} sec: {e}"
+                    )
+                    self._segment_writer.rotate_if_due()
+                    self._stopped.wait(error_wait_sec)
+                    error_wait_sec = min(
+                        error_wait_sec * 2, STREAM_READ_ERROR_MAX_WAIT_SEC
+                    )
+                    continue
+                error_wait_sec = STREAM_READ_ERROR_WAIT_SEC
 
                 if len(messages) > 0:
-                    for message in messages:
-                        self._opc_logger.info(message.payload.decode("utf-8"))
+                    # Long-polls on an empty stream are not a read latency
+                    READ_SECONDS.observe(time.perf_counter() - started_at)
+                    if messages[0].sequence_number > self._next_sequence_number:
+                        # The oldest messages were overwritten before being read
+                        self._monitor.record_gap(
+                            self._next_sequence_number, messages[0].sequence_number
+                        )
+
+                    payloads = [message.payload for message in messages]
+                    MESSAGES_READ.inc(len(payloads))
+                    BYTES_READ.inc(sum(len(payload) for payload in payloads))
+                    if self._rollup_aggregator is not None:
+                        self._rollup_aggregator.add_batch(payloads)
+                    written = messages
+                    for message_filter in self._filters:
+                        written = message_filter.filter(written)
+                    self._segment_writer.write_batch(
+                        [message.payload for message in written],
+                        [message.sequence_number for message in written],
+                        messages[-1].sequence_number,
+                    )
+                    MESSAGES_WRITTEN.inc(len(written))
 
                     self._next_sequence_number = messages[-1].sequence_number + 1
 
                     logger.debug(
                         f"sizeof stream messages: {len(messages)}, last sequence number: {self._next_sequence_number}"
                     )
+                else:
+                    self._segment_writer.rotate_if_due()
+
+                if self._rollup_writer is not None:
+                    self._rollup_writer.write_batch(
+                        self._rollup_aggregator.collect_closed()
+                    )
 
-                time.sleep(0.1)
+                is_full = len(messages) >= read_size
+                if len(messages) == 0:
+                    read_timeout_millis = STREAM_READ_TIMEOUT_MILLIS
+                else:
+                    read_timeout_millis = 0
+                    if not is_full:
+                        time.sleep(STREAM_READ_INTERVAL)
         finally:
-            self.save_next_sequence_number()
+            self._monitor.stop()
+            self._segment_writer.close()
+            if self._rollup_writer is not None:
+                self._rollup_writer.write_batch(self._rollup_aggregator.collect_all())
+                self._rollup_writer.close()
+            if self._owns_compression_pool:
+                self._compression_pool.shutdown()
+            # The segments rotated on close are handed off before the checkpoint is closed
+            self._uploader.stop()
+            self._checkpoint.close()
+
+    def _create_segment_writer(
+        self,
+        rotation_policy: RotationPolicy,
+        manifest_journal: Any,
+        data_hour: float = None,
+    ) -> AbstractSegmentWriter:
+        """Writer of the OPC segments in the output format"""
+        if self._config.opc_output_format in [
+            OUTPUT_FORMAT_PARQUET,
+            OUTPUT_FORMAT_PROCESSED,
+        ]:
+            # Processed segments are split by tag and hour when they are handed off
+            return ParquetSegmentWriter(
+                self._config.opc_log_dir,
+                self._log_name,
+                rotation_policy,
+                compression=self._config.opc_log_compression,
+                compression_level=self._config.opc_log_compression_level,
+                manifest_journal=manifest_journal,
+                rotated_callback=self._uploader.submit,
+                data_hour=data_hour,
+            )
+
+        return SegmentWriter(
+            self._config.opc_log_dir,
+            self._log_name,
+            rotation_policy,
+            compression=self._config.opc_log_compression,
+            compression_level=self._config.opc_log_compression_level,
+            flush_policy=self._config.opc_log_flush_policy,
+            fsync_policy=self._config.opc_log_fsync_policy,
+            compression_pool=self._compression_pool,
+            compression_pool_size=self._config.opc_log_compression_workers,
+            dictionary_store=self._dictionary_store,
+            manifest_journal=manifest_journal,
+            rotated_callback=self._uploader.submit,
+            data_hour=data_hour,
+        )
+
+    def stop(self) -> None:
+        """Stop reading the stream after the current batch (`start` then returns)"""
+        self._stopped.set()
+
+    def update_catch_up(self) -> None:
+        """Switch the compression level when the monitor enters or leaves the catch-up mode
 
-    def save_next_sequence_number(self) -> None:
-        """Store the next sequence number in the shadow"""
-        self._shadow.update_thing_shadow_request(
-            {OPC_NEXT_SEQUENCE_PROP_NAME: self._next_sequence_number}
+        Compression is not deferred: writing the segments uncompressed and compressing
+        them later would need room on disk for the raw backlog and a second pass over
+        it. The fastest level keeps most of the speed of an uncompressed write (gzip
+        level 1 is several times faster than level 9) and the segments are uploaded as
+        they are, at the cost of larger objects for the backlog.
+        """
+        if self._monitor.catch_up == self._catch_up:
+            return
+
+        self._catch_up = self._monitor.catch_up
+        self._segment_writer.set_compression_level(
+            FAST_COMPRESSION_LEVELS[self._config.opc_log_compression]
+            if self._catch_up
+            else self._config.opc_log_compression_level
         )
 
+    def get_next_sequence_number(self) -> int:
+        return self._next_sequence_number
+
+
+def create_compression_pool(config: GGConfig) -> ThreadPoolExecutor:
+    """Pool of `opc_log_compression_workers` threads to compress batches (None if 0)"""
+    if config.opc_log_compression_workers == 0:
+        return None
+
+    return ThreadPoolExecutor(
+        max_workers=config.opc_log_compression_workers,
+        thread_name_prefix="opc-compression",
+    )
+
 
 LOG_ARCHIVE_PATTERN = ".*-*-*_*-*"
+# Directory of the log directory the segments that could not be recovered are moved to
+FAILED_DIR_NAME = "failed"
+
+SEGMENTS_QUARANTINED = REGISTRY.counter(
+    "opc_segments_quarantined_total",
+    "Segments left by a previous run that could not be handed off on start",
+)
 
 
-class FileWatchHandler(PatternMatchingEventHandler):
+class SegmentUploadThread(Thread):
     """
-    Handler class to receive new or modified files
+    Hands off the rotated segments to the export stream in the order they are submitted
+
+    The writers submit each segment as soon as it is rotated, so the log directory is
+    not polled. It is only scanned once on start (see `recover`) for the segments left
+    by a previous run.
     """
 
     def __init__(
-        self, config: GGConfig, stream: S3ExportStream, sequence_save_callback: Any
+        self,
+        config: GGConfig,
+        backlog: BacklogManager,
+        manifest_journal: SegmentManifestJournal,
+        log_name: str,
     ):
-        super(FileWatchHandler, self).__init__(
-            patterns=[config.opc_log_name + LOG_ARCHIVE_PATTERN]
-        )
-        self._sequence_save_callback = sequence_save_callback
+        """
+        Parameters
+        ----------
+        config: GGConfig
+        backlog: BacklogManager
+            Queue of the archived segments in front of the S3 export
+        manifest_journal: SegmentManifestJournal
+            Journal of the segments committed but not handed off yet
+        log_name: str
+            Prefix of the segments of the handler
+        """
+        Thread.__init__(self)
+
+        self._log_name = log_name
+        self._patterns = [
+            log_name + LOG_ARCHIVE_PATTERN,
+            log_name + ROLLUP_LOG_SUFFIX + LOG_ARCHIVE_PATTERN,
+        ]
+        self._manifest_journal = manifest_journal
         self._config = config
-        self._stream = stream
+        self._backlog = backlog
+        self._queue = queue.Queue()
+        self.setDaemon(True)
         try:
             os.makedirs(self._config.opc_archive_dir)
         except FileExistsError as e:
             pass
 
-    def on_moved(self, event: FileMovedEvent) -> None:
+    def run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+
+            handler, path = item
+            try:
+                handler(path)
+            except Exception as e:
+                # Left in place, the file is handed off again by `recover` on the next start
+                logger.error(f"failed to hand off {path}: {e}")
+
+    def stop(self) -> None:
+        """Hand off the segments already submitted, then stop the thread"""
+        self._queue.put(None)
+        self.join()
+
+    def submit(self, path: str) -> None:
+        """
+        Queue a rotated segment to be archived (rotation callback of the writers)
+
+        Parameters
+        ----------
+        path: str
+            Path of the rotated segment
+        """
+        self._queue.put((self.archive_segment, path))
+
+    def submit_dictionary(self, path: str) -> None:
         """
-        Logger renamed and rotated file (callback)
+        Queue a zstd dictionary, which is handed off before the segments compressed with it
 
         Parameters
         ----------
-        event: FileMovedEvent
+        path: str
+            Path of the dictionary
         """
-        self._sequence_save_callback()
+        self._queue.put((self.append_dictionary, path))
 
-        basename = os.path.basename(event.dest_path)
-        if not basename.startswith(".") and not event.is_directory:
-            logger.debug(f"file moved: {event}")
-            archive_file = f"{self._config.opc_archive_dir}{basename}.gz"
-            archive_file_created = False
-            with open(event.dest_path, "rb") as f_in:
-                with gzip.open(archive_file, "wb") as f_out:
-                    shutil.copyfileobj(f_in, f_out)
-                    archive_file_created = True
+    def archive_segment(self, path: str) -> None:
+        """
+        Move a rotated segment to the archive directory and add it to the stream
 
-        if archive_file_created:
+        Parameters
+        ----------
+        path: str
+            Path of the rotated segment
+        """
+        basename = os.path.basename(path)
+        if basename.startswith("."):
+            return
+
+        if (
+            self._config.opc_output_format == OUTPUT_FORMAT_PROCESSED
+            and basename.endswith(f".{PARQUET_EXTENSION}")
+        ):
+            self.archive_processed(path)
+        else:
+            archive_file = f"{self._config.opc_archive_dir}{basename}"
+            shutil.move(path, archive_file)
             self.append_file(archive_file)
-            os.remove(event.dest_path)
+        self._manifest_journal.handed_off(basename)
+
+    def archive_processed(self, path: str) -> None:
+        """
+        Split a rotated segment into the partitions of the `opc_processed` table
+
+        Each partition (tag and hour) is archived as one object of the segment under
+        `${url_encoded_tag}/${datehour}/{segment name}` in the processed bucket, so
+        that it can be queried without the cloud INSERT. The segment is removed once
+        all its partitions are queued (it is split again after a crash), so the raw
+        segments are not uploaded (no `opc_raw` data).
+
+        The tag is part of the key, so the partitions of several tags cannot share an
+        object: every rotation makes one object per tag (and hour) read. The segments
+        are rotated every `DEFAULT_PROCESSED_LOG_INTERVAL_MIN` minutes by default with
+        this format, instead of every minute, or earlier once they reach
+        `DEFAULT_PROCESSED_LOG_MAX_BYTES` or `DEFAULT_PROCESSED_LOG_MAX_MESSAGES` (their
+        rows are held in memory until rotated).
+
+        Parameters
+        ----------
+        path: str
+            Path of the rotated parquet segment
+        """
+        basename = os.path.basename(path)
+        stem = basename[: -len(f".{PARQUET_EXTENSION}")]
+        for index, (alias, datehour, table) in enumerate(split_processed_segment(path)):
+            archive_file = (
+                f"{self._config.opc_archive_dir}{stem}-{index}.{PARQUET_EXTENSION}"
+            )
+            write_processed_table(
+                table,
+                archive_file,
+                self._config.opc_log_compression,
+                self._config.opc_log_compression_level,
+            )
+            self._backlog.submit(
+                archive_file,
+                processed_key(alias, datehour, basename),
+                kind=KIND_SEGMENT,
+                bucket=self._config.processed_bucket,
+            )
+
+        os.remove(path)
+
+    def recover(self) -> None:
+        """
+        Hand off the segments rotated but not added to the stream before a restart
+
+        The pending manifests tell where each committed segment was left, so the archive
+        directory does not have to be scanned. Rotated segments left in the log directory
+        without a manifest (rollups) are handed off as well, since the writers only
+        submit the segments they rotate while running.
 
-        super().on_moved(event)
+        A segment that cannot be handed off (e.g. unreadable or corrupted) is moved to
+        the `failed` directory of the log directory, and the others are recovered.
+        """
+        for manifest in self._manifest_journal.pending():
+            rotated_file = os.path.join(self._config.opc_log_dir, manifest.name)
+            archive_file = f"{self._config.opc_archive_dir}{manifest.name}"
+            try:
+                if os.path.exists(rotated_file):
+                    logger.info(f"hand off a committed segment: {rotated_file}")
+                    self.archive_segment(rotated_file)
+                elif os.path.exists(archive_file):
+                    # Moved but maybe not added to the stream (the same key is uploaded again)
+                    logger.info(f"hand off a committed segment again: {archive_file}")
+                    self.append_file(archive_file)
+                    self._manifest_journal.handed_off(manifest.name)
+                else:
+                    logger.warning(
+                        f"committed segment {manifest.name} "
+                        f"({manifest.first_sequence_number}-{manifest.last_sequence_number}) "
+                        "not found, it was probably uploaded and deleted"
+                    )
+                    self._manifest_journal.handed_off(manifest.name)
+            except Exception as e:
+                logger.error(f"failed to recover the segment {manifest.name}: {e}")
+                for path in [rotated_file, archive_file]:
+                    if os.path.exists(path):
+                        self._quarantine(path)
+                self._manifest_journal.handed_off(manifest.name)
+
+        for filename in sorted(os.listdir(self._config.opc_log_dir)):
+            path = os.path.join(self._config.opc_log_dir, filename)
+            if os.path.isfile(path) and any(
+                fnmatch(filename, pattern) for pattern in self._patterns
+            ):
+                logger.info(f"hand off a rotated segment: {path}")
+                try:
+                    self.archive_segment(path)
+                except Exception as e:
+                    logger.error(f"failed to recover the segment {path}: {e}")
+                    if os.path.exists(path):
+                        self._quarantine(path)
+
+    def _quarantine(self, path: str) -> None:
+        """Move a segment that could not be handed off to the `failed` directory"""
+        failed_dir = os.path.join(self._config.opc_log_dir, FAILED_DIR_NAME)
+        try:
+            os.makedirs(failed_dir, exist_ok=True)
+            shutil.move(path, os.path.join(failed_dir, os.path.basename(path)))
+            SEGMENTS_QUARANTINED.inc()
+            logger.warning(f"{path} moved to {failed_dir}")
+        except OSError as e:
+            logger.error(f"failed to move {path} to {failed_dir}: {e}")
 
     def append_file(self, path: str) -> None:
         """
@@ -168,7 +668,45 @@ class FileWatchHandler(PatternMatchingEventHandler):
         """
         key = self.create_key(path)
 
-        self._stream.append_message(path, key)
+        # The manifest (sequence range and checksum) is carried with the segment
+        user_metadata = {}
+        manifest = self._manifest_journal.get(os.path.basename(path))
+        if manifest is not None:
+            user_metadata.update(manifest.user_metadata())
+
+        # Readers need the dictionary ID to decompress the segment
+        if path.endswith(f".{COMPRESSION_EXTENSIONS[COMPRESSION_ZSTD]}"):
+            dict_id = read_dictionary_id(path)
+            if dict_id != 0:
+                user_metadata[DICTIONARY_METADATA_KEY] = str(dict_id)
+
+        kind = KIND_ROLLUP if self.is_rollup(path) else KIND_SEGMENT
+        self._backlog.submit(path, key, user_metadata or None, kind)
+
+    def append_dictionary(self, path: str) -> None:
+        """
+        Add a copy of a zstd dictionary to Stream Manager for S3 export
+
+        The dictionary is uploaded as `{dictionary_bucket_prefix}/{dict_id}.zdict`
+        before the segments compressed with it. The original is kept to recover segments.
+
+        Parameters
+        ----------
+        path: str
+            Path of the dictionary
+        """
+        basename = os.path.basename(path)
+        archive_file = f"{self._config.opc_archive_dir}{basename}"
+        shutil.copyfile(path, archive_file)
+
+        key_prefix = self._config.dictionary_bucket_prefix
+        key = f"{key_prefix}/{basename}" if key_prefix else basename
+        self._backlog.submit(archive_file, key, kind=KIND_DICTIONARY)
+
+    def is_rollup(self, path: str) -> bool:
+        return os.path.basename(path).startswith(
+            f"{self._log_name}{ROLLUP_LOG_SUFFIX}."
+        )
 
     def create_key(self, path) -> str:
         """Create key when put to S3
@@ -177,6 +715,8 @@ class FileWatchHandler(PatternMatchingEventHandler):
         Stream Manager will automatically replace it with the date and time it was sent,
         but this case we want to use the date and time the log was generated,
         not the date and time it was sent. So use the date and time in the file name.
+        With `opc_log_align_data_hour`, it is the hour of the samples the segment holds,
+        which the file name ends with.
 
         Parameters
         ----------
@@ -190,11 +730,16 @@ class FileWatchHandler(PatternMatchingEventHandler):
         """
         filename = os.path.basename(path)
 
-        key_prefix = self._config.bucket_prefix
+        if self.is_rollup(path):
+            key_prefix = self._config.rollup_bucket_prefix
+        elif filename.endswith(f".{PARQUET_EXTENSION}"):
+            key_prefix = self._config.parquet_bucket_prefix
+        else:
+            key_prefix = self._config.bucket_prefix
 
         if key_prefix:
             matched_strings = re.findall(
-                ".+\.([0-9]{4})-([0-9]{2})-([0-9]{2})_([0-9]{2})-([0-9]{2})\.gz",
+                ".+\.([0-9]{4})-([0-9]{2})-([0-9]{2})_([0-9]{2})-([0-9]{2})(?:-[0-9]{2})?(?:_[0-9]+)?\.(?:gz|zst|parquet)",
                 filename,
             )
             if len(matched_strings) == 1 and len(matched_strings[0]) == 5:
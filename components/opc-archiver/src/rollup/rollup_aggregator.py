@@ -0,0 +1,268 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import heapq
+import json
+import logging
+import time
+from itertools import groupby
+from typing import List
+
+from util.metrics import REGISTRY
+from util.sitewise_payload import (
+    DOUBLE_VALUE,
+    INTEGER_VALUE,
+    NANOS_PER_SECOND,
+    iter_property_values,
+    parse_payload,
+)
+
+logger = logging.getLogger("opc-archiver-component-logger")
+
+# A window is closed once the data time has passed its end by this margin
+ROLLUP_ALLOWED_LATENESS_SEC = 60
+# Interval to check again a window that some of its tags keep open (sec)
+ROLLUP_RECHECK_INTERVAL_SEC = 1
+
+LATE_VALUES = REGISTRY.counter(
+    "opc_rollup_late_values_total",
+    "Values dropped from the rollups because their window was closed",
+)
+
+NUMERIC_VALUE_TYPES = (INTEGER_VALUE, DOUBLE_VALUE)
+
+# Index of the fields of an accumulator
+COUNT, SUM, MIN, MAX, LAST_TIMESTAMP, LAST_VALUE = range(6)
+
+
+class RollupAggregator:
+    """Accumulates min/max/avg/count/last of the numeric property values per tag and window
+
+    Values of a read batch are grouped by alias and window first, and each group is
+    folded into its accumulator at once.
+    Windows are aligned on the epoch and closed by a watermark on the data time kept
+    per tag (the latest timestamp read of the tag), so that a tag or gateway ahead of
+    the others, or data buffered and sent late, does not close the windows of the
+    other tags. The watermark is bounded by the wall clock plus the allowed lateness,
+    so that a sample with a timestamp in the future does not close the windows of
+    its own tag either. The windows of a tag that stopped reporting are closed on the
+    wall clock. Values arriving after their window was closed are dropped (counted in
+    `opc_rollup_late_values_total`).
+
+    A window is only checked once the wall clock has passed its end plus the allowed
+    lateness (the windows are kept in a heap by that time), so that collecting the
+    closed windows after each read does not scan all the tags.
+
+    The open windows are kept in memory only: they are not in the manifest journal, so
+    the values of the open windows are lost on a crash (the raw segments keep them).
+    They are collected when the aggregator is stopped (see `collect_all`).
+    """
+
+    def __init__(
+        self,
+        windows_sec: List[int],
+        allowed_lateness_sec: int = ROLLUP_ALLOWED_LATENESS_SEC,
+    ):
+        """
+        Parameters
+        ----------
+        windows_sec: List[int]
+            Length of the windows to aggregate (in seconds)
+        allowed_lateness_sec: int
+            Time a window is kept open after its end (in seconds)
+        """
+        self._windows_ns = [window * NANOS_PER_SECOND for window in windows_sec]
+        self._allowed_lateness_ns = allowed_lateness_sec * NANOS_PER_SECOND
+        # (window length, window start) -> alias -> [count, sum, min, max, last timestamp, last value]
+        self._windows = {}
+        # (time to check the window, window length, window start), earliest first
+        self._checks = []
+        # alias -> latest timestamp read (bounded by the wall clock)
+        self._watermarks = {}
+        self._last_read_ns = {}  # alias -> wall clock when its values were last read
+
+    def add_batch(self, payloads: List[bytes]) -> None:
+        """Accumulate the numeric property values of a batch
+
+        Parameters
+        ----------
+        payloads: List[bytes]
+            Raw message payloads read from the stream
+        """
+        columns = {}  # alias -> ([timestamps], [values])
+        for payload in payloads:
+            try:
+                property_values = list(iter_property_values(parse_payload(payload)))
+            except (ValueError, AttributeError, TypeError) as e:
+                continue
+
+            for alias, timestamp, value_type, value, quality in property_values:
+                if (
+                    not isinstance(alias, str)
+                    or value_type not in NUMERIC_VALUE_TYPES
+                    or not isinstance(value, (int, float))
+                ):
+                    continue
+
+                timestamps, values = columns.setdefault(alias, ([], []))
+                timestamps.append(timestamp)
+                values.append(value)
+
+        # Late values are checked against the watermark before the batch
+        now_ns = time.time_ns()
+        for alias, (timestamps, values) in columns.items():
+            watermark = self._watermarks.get(alias, 0)
+            for window_ns in self._windows_ns:
+                self._accumulate(alias, window_ns, timestamps, values, watermark)
+            self._watermarks[alias] = max(
+                watermark, min(max(timestamps), now_ns + self._allowed_lateness_ns)
+            )
+            self._last_read_ns[alias] = now_ns
+
+    def _accumulate(
+        self,
+        alias: str,
+        window_ns: int,
+        timestamps: List[int],
+        values: List[float],
+        watermark: int,
+    ) -> None:
+        start = 0
+        # Values of a batch are mostly in time order, so consecutive runs share a window
+        for window_start, run in groupby(
+            (timestamp - timestamp % window_ns for timestamp in timestamps)
+        ):
+            end = start + sum(1 for _ in run)
+            if window_start + window_ns + self._allowed_lateness_ns <= watermark:
+                logger.debug(
+                    f"drop {end - start} late values of {alias} for a closed window"
+                )
+                LATE_VALUES.inc(end - start)
+                start = end
+                continue
+
+            run_values = values[start:end]
+            last = max(range(start, end), key=timestamps.__getitem__)
+
+            accumulators = self._windows.get((window_ns, window_start))
+            if accumulators is None:
+                accumulators = self._windows[(window_ns, window_start)] = {}
+                heapq.heappush(
+                    self._checks,
+                    (
+                        window_start + window_ns + self._allowed_lateness_ns,
+                        window_ns,
+                        window_start,
+                    ),
+                )
+            accumulator = accumulators.get(alias)
+            if accumulator is None:
+                accumulators[alias] = [
+                    len(run_values),
+                    sum(run_values),
+                    min(run_values),
+                    max(run_values),
+                    timestamps[last],
+                    values[last],
+                ]
+            else:
+                accumulator[COUNT] += len(run_values)
+                accumulator[SUM] += sum(run_values)
+                accumulator[MIN] = min(accumulator[MIN], min(run_values))
+                accumulator[MAX] = max(accumulator[MAX], max(run_values))
+                if timestamps[last] >= accumulator[LAST_TIMESTAMP]:
+                    accumulator[LAST_TIMESTAMP] = timestamps[last]
+                    accumulator[LAST_VALUE] = values[last]
+
+            start = end
+
+    def collect_closed(self) -> List[bytes]:
+        """Remove the windows closed by the watermarks of their tags and return their rollups
+
+        The windows of a tag not read for the allowed lateness are closed once the wall
+        clock has passed them (a value arriving later starts another rollup of the
+        window instead of being dropped). Only the windows whose end plus the allowed
+        lateness has passed on the wall clock are checked, the other calls return at once.
+
+        Returns
+        -------
+        List[bytes]
+            One JSON rollup per tag and window
+        """
+        now_ns = time.time_ns()
+        due = set()
+        while len(self._checks) > 0 and self._checks[0][0] <= now_ns:
+            _, window_ns, window_start = heapq.heappop(self._checks)
+            if (window_ns, window_start) in self._windows:
+                due.add((window_ns, window_start))
+        if len(due) == 0:
+            return []
+
+        closed = []
+        for window_ns, window_start in due:
+            closed_at = window_start + window_ns + self._allowed_lateness_ns
+            for alias in self._windows[(window_ns, window_start)]:
+                if closed_at <= self._watermarks.get(alias, 0) or (
+                    now_ns - self._last_read_ns.get(alias, 0)
+                    >= self._allowed_lateness_ns
+                ):
+                    closed.append((window_ns, window_start, alias))
+        rollups = self._collect(closed)
+
+        # Still open for the tags whose data time is behind it (e.g. backfilled)
+        recheck_at = now_ns + ROLLUP_RECHECK_INTERVAL_SEC * NANOS_PER_SECOND
+        for window_ns, window_start in due:
+            if (window_ns, window_start) in self._windows:
+                heapq.heappush(self._checks, (recheck_at, window_ns, window_start))
+        return rollups
+
+    def collect_all(self) -> List[bytes]:
+        """Remove all the windows, including the open ones, and return their rollups
+
+        A window collected while still open is continued by another rollup of the same
+        window after a restart.
+        """
+        self._checks = []
+        return self._collect(
+            [
+                (window_ns, window_start, alias)
+                for (window_ns, window_start), accumulators in self._windows.items()
+                for alias in accumulators
+            ]
+        )
+
+    def _collect(self, closed: list) -> List[bytes]:
+        """Remove the accumulators of (window length, window start, alias) and
+        return their rollups"""
+        rollups = []
+        for window_ns, window_start, alias in sorted(closed):
+            accumulators = self._windows[(window_ns, window_start)]
+            rollups.append(
+                self._serialize(alias, window_ns, window_start, accumulators.pop(alias))
+            )
+            if len(accumulators) == 0:
+                del self._windows[(window_ns, window_start)]
+
+        return rollups
+
+    def _serialize(
+        self, alias: str, window_ns: int, window_start: int, accumulator: list
+    ) -> bytes:
+        return json.dumps(
+            {
+                "propertyAlias": alias,
+                "windowSeconds": window_ns // NANOS_PER_SECOND,
+                "windowStart": window_start // NANOS_PER_SECOND,
+                "count": accumulator[COUNT],
+                "sum": accumulator[SUM],
+                "min": accumulator[MIN],
+                "max": accumulator[MAX],
+                "avg": accumulator[SUM] / accumulator[COUNT],
+                "last": accumulator[LAST_VALUE],
+                "lastTimestamp": {
+                    "timeInSeconds": accumulator[LAST_TIMESTAMP] // NANOS_PER_SECOND,
+                    "offsetInNanos": accumulator[LAST_TIMESTAMP] % NANOS_PER_SECOND,
+                },
+            },
+            separators=(",", ":"),
+        ).encode()
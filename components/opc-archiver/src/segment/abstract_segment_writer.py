@@ -0,0 +1,396 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import logging
+import os
+import time
+from abc import abstractmethod
+from typing import Any, List
+
+from segment.manifest import SegmentManifest, SegmentManifestJournal, file_sha256
+from util.metrics import REGISTRY
+
+logger = logging.getLogger("opc-archiver-component-logger")
+
+# Start time of the segment. Starts with the `%Y-%m-%d_%H-%M` used by TimedRotatingFileHandler(when="M")
+SEGMENT_SUFFIX_FORMAT = "%Y-%m-%d_%H-%M-%S"
+# Active segment of the samples of an hour (UTC), see `data_hour`
+DATA_HOUR_ACTIVE_FORMAT = "%Y%m%d%H"
+# Hour (UTC) of the samples appended to the rotated segments, where `create_key` expects a time
+DATA_HOUR_SUFFIX_FORMAT = "%Y-%m-%d_%H-%M"
+
+
+class RotationPolicy:
+    """Rotates a segment when its age, size or number of messages reaches a limit (whichever first)"""
+
+    def __init__(self, max_age_sec: int, max_bytes: int = 0, max_messages: int = 0):
+        """
+        Parameters
+        ----------
+        max_age_sec: int
+            Maximum age of a segment (in seconds)
+        max_bytes: int
+            Maximum size of the payloads written to a segment, before compression (0: unlimited)
+        max_messages: int
+            Maximum number of messages written to a segment (0: unlimited)
+        """
+        self.max_age_sec = max_age_sec
+        self.max_bytes = max_bytes
+        self.max_messages = max_messages
+
+    def is_due(self, age_sec: float, size_bytes: int, messages: int) -> bool:
+        """Whether a segment with the given age, size and number of messages must be rotated"""
+        return (
+            age_sec >= self.max_age_sec
+            or (self.max_bytes > 0 and size_bytes >= self.max_bytes)
+            or (self.max_messages > 0 and messages >= self.max_messages)
+        )
+
+    def remaining_messages(self, messages: int) -> int:
+        """Number of messages that can still be written to a segment (None if unlimited)"""
+        if self.max_messages <= 0:
+            return None
+
+        return max(0, self.max_messages - messages)
+
+
+class AbstractSegmentWriter:
+    """Base class for writers of rotated OPC segment files
+
+    The active segment is written to `{log_dir}{log_name}` and renamed to
+    `{log_name}.{%Y-%m-%d_%H-%M-%S}[_{n}].{extension}` with its start time when it is rotated.
+    `n` distinguishes segments started within the same second.
+
+    With a data hour, the writer only receives the samples of that hour (see
+    `HourlySegmentWriter`). The active segment is `{log_name}.{%Y%m%d%H}` and the rotated
+    segments are suffixed with the data hour: `{log_name}.{start time}.{%Y-%m-%d_%H-%M}.{extension}`.
+
+    With a manifest journal, the sequence range of the messages written to the active
+    segment is tracked, and a segment is committed to the journal (with its checksum)
+    before it is renamed. An active segment left by a crash was not committed, so it is
+    discarded on restart and its messages are read again from the stream.
+    """
+
+    def __init__(
+        self,
+        log_dir: str,
+        log_name: str,
+        rotation_policy: RotationPolicy,
+        extension: str,
+        manifest_journal: SegmentManifestJournal = None,
+        rotated_callback: Any = None,
+        data_hour: float = None,
+    ):
+        """
+        Parameters
+        ----------
+        log_dir: str
+            Directory to write segments to
+        log_name: str
+            File name of the active segment
+        rotation_policy: RotationPolicy
+            Limits of a segment
+        extension: str
+            File extension of the rotated segments
+        manifest_journal: SegmentManifestJournal
+            Journal to commit the rotated segments to (not committed if not specified)
+        rotated_callback: Any
+            Called with the path of each segment rotated while running, to hand it off
+            (segments of a previous run rotated on start are not reported)
+        data_hour: float
+            Start of the hour (UTC) of the samples written to the segments
+            (the segments are named after their start time only if not specified)
+        """
+        self._rotated_prefix = f"{log_dir}{log_name}"
+        self._path = self._rotated_prefix
+        self._data_hour_suffix = None
+        if data_hour is not None:
+            hour = time.gmtime(data_hour)
+            self._path = f"{self._path}.{time.strftime(DATA_HOUR_ACTIVE_FORMAT, hour)}"
+            self._data_hour_suffix = time.strftime(DATA_HOUR_SUFFIX_FORMAT, hour)
+        self._rotation_policy = rotation_policy
+        self._extension = extension
+        self._segment_start = 0.0
+        self._segment_bytes = 0
+        self._segment_messages = 0
+        self._last_suffix = None
+        self._suffix_count = 0
+        self._closed = False
+        self._manifest_journal = manifest_journal
+        self._rotated_callback = rotated_callback
+        self._first_sequence_number = None
+        self._last_sequence_number = None
+
+        # Metrics of the segments, labeled with the name of the active segment
+        labels = {"segment": log_name}
+        self._rotated_counter = REGISTRY.counter(
+            "opc_segments_rotated_total", "Segments rotated for archiving", labels
+        )
+        self._input_bytes_counter = REGISTRY.counter(
+            "opc_segment_input_bytes_total",
+            "Payload bytes written to rotated segments",
+            labels,
+        )
+        self._output_bytes_counter = REGISTRY.counter(
+            "opc_segment_output_bytes_total",
+            "Size of the rotated segment files",
+            labels,
+        )
+        self._compression_ratio_gauge = REGISTRY.gauge(
+            "opc_segment_compression_ratio",
+            "Payload bytes / file size of the last rotated segment",
+            labels,
+        )
+        self._close_histogram = REGISTRY.histogram(
+            "opc_segment_close_seconds",
+            "Time to complete a segment before its rotation",
+            labels,
+        )
+
+        if self._manifest_journal is not None:
+            self._recover_uncommitted()
+        else:
+            self._recover()
+        self._begin_segment()
+
+    @abstractmethod
+    def _recover(self) -> None:
+        """Hand off or discard the active segment left by a previous run"""
+        pass
+
+    @abstractmethod
+    def _open(self) -> None:
+        """Start a new active segment"""
+        pass
+
+    @abstractmethod
+    def _write(self, payloads: List[bytes]) -> int:
+        """Write payloads to the active segment and return the number of bytes written"""
+        pass
+
+    @abstractmethod
+    def _close_file(self) -> None:
+        """Complete the active segment so that it can be rotated"""
+        pass
+
+    def write_batch(
+        self,
+        payloads: List[bytes],
+        sequence_numbers: List[int] = None,
+        last_sequence_number: int = None,
+    ) -> None:
+        """Append payloads of a batch to the active segment
+
+        The batch is split over several segments when it exceeds the maximum number of messages.
+
+        Parameters
+        ----------
+        payloads: List[bytes]
+            Raw message payloads read from the stream
+        sequence_numbers: List[int]
+            Sequence number of each payload (to commit the segments to the manifest journal)
+        last_sequence_number: int
+            Sequence number of the last message read, covered by the active segment
+            even if it was filtered out
+        """
+        sequence_numbers = sequence_numbers or []
+        while len(payloads) > 0:
+            self.rotate_if_due()
+
+            remaining = self._rotation_policy.remaining_messages(self._segment_messages)
+            if remaining is None:
+                remaining = len(payloads)
+            chunk, payloads = payloads[:remaining], payloads[remaining:]
+            chunk_sequence_numbers, sequence_numbers = (
+                sequence_numbers[:remaining],
+                sequence_numbers[remaining:],
+            )
+
+            self._segment_bytes += self._write(chunk)
+            self._segment_messages += len(chunk)
+            if len(chunk_sequence_numbers) > 0:
+                self._cover(chunk_sequence_numbers[0], chunk_sequence_numbers[-1])
+
+        if last_sequence_number is not None:
+            self._cover(last_sequence_number, last_sequence_number)
+
+        self.rotate_if_due()
+
+    def _cover(self, first_sequence_number: int, last_sequence_number: int) -> None:
+        """Extend the sequence range of the active segment"""
+        if self._first_sequence_number is None:
+            self._first_sequence_number = first_sequence_number
+        self._last_sequence_number = last_sequence_number
+
+    @property
+    def messages(self) -> int:
+        """Number of messages written to the active segment"""
+        return self._segment_messages
+
+    @property
+    def first_sequence_number(self) -> int:
+        """Sequence number of the first message of the active segment (None if not tracked yet)"""
+        return self._first_sequence_number
+
+    def set_compression_level(self, level: int) -> None:
+        """Change the compression level, applied from the next segment
+
+        Parameters
+        ----------
+        level: int
+            Compression level (default level of the compression if None)
+        """
+        self._compression_level = level
+
+    def rotate_if_due(self) -> None:
+        """Rotate the active segment if it reached a limit of the rotation policy"""
+        age_sec = time.time() - self._segment_start
+        if not self._rotation_policy.is_due(
+            age_sec, self._segment_bytes, self._segment_messages
+        ):
+            return
+
+        if self._segment_messages == 0:
+            # Nothing to hand off, just start a new interval
+            # (and move the read position past the messages filtered out)
+            self._commit_range()
+            self._segment_start = time.time()
+            return
+
+        self.rotate()
+
+    def rotate(self) -> None:
+        """Close the active segment, rename it with its start time and open a new one"""
+        self._complete_segment()
+        self._begin_segment()
+
+    def close(self) -> None:
+        """Complete and close the active segment
+
+        Without a manifest journal, the closed segment is rotated on the next start.
+        With a manifest journal, it is committed and rotated now, so that the next start
+        resumes right after its last message.
+        """
+        if self._closed:
+            return
+
+        if self._manifest_journal is None:
+            self._close_file()
+        elif self._segment_messages > 0:
+            self._complete_segment()
+        else:
+            self._close_file()
+            try:
+                os.remove(self._path)
+            except FileNotFoundError as e:
+                pass
+            self._commit_range()
+        self._closed = True
+
+    def _complete_segment(self) -> None:
+        """Close the active segment, commit it to the manifest journal and rename it"""
+        with self._close_histogram.time():
+            self._close_file()
+
+        size = os.path.getsize(self._path)
+        self._rotated_counter.inc()
+        self._input_bytes_counter.inc(self._segment_bytes)
+        self._output_bytes_counter.inc(size)
+        if size > 0:
+            self._compression_ratio_gauge.set(self._segment_bytes / size)
+
+        rotated_path = self._next_rotated_path(self._segment_start)
+        if (
+            self._manifest_journal is not None
+            and self._last_sequence_number is not None
+        ):
+            # Committed before the rename: a segment is only handed off once committed
+            self._manifest_journal.commit(
+                SegmentManifest(
+                    os.path.basename(rotated_path),
+                    self._first_sequence_number,
+                    self._last_sequence_number,
+                    self._segment_messages,
+                    size,
+                    file_sha256(self._path),
+                )
+            )
+            self._first_sequence_number = None
+            self._last_sequence_number = None
+
+        os.replace(self._path, rotated_path)
+        logger.debug(f"segment rotated: {rotated_path}")
+
+        if self._rotated_callback is not None:
+            self._rotated_callback(rotated_path)
+
+    def _commit_range(self) -> None:
+        """Commit the sequence range of an active segment without any message written"""
+        if self._manifest_journal is None or self._last_sequence_number is None:
+            return
+
+        self._manifest_journal.commit(
+            SegmentManifest(
+                None, self._first_sequence_number, self._last_sequence_number
+            )
+        )
+        self._first_sequence_number = None
+        self._last_sequence_number = None
+
+    def _recover_uncommitted(self) -> None:
+        """Rename the active segment if it was committed before a crash, discard it otherwise
+
+        An uncommitted segment holds messages after the committed read position,
+        which are read again from the stream.
+        """
+        if not os.path.exists(self._path):
+            return
+
+        log_dir = os.path.dirname(self._path)
+        sha256 = file_sha256(self._path)
+        for manifest in self._manifest_journal.pending():
+            rotated_path = os.path.join(log_dir, manifest.name)
+            if manifest.sha256 == sha256 and not os.path.exists(rotated_path):
+                logger.info(
+                    f"rotate segment committed before a restart: {rotated_path}"
+                )
+                os.replace(self._path, rotated_path)
+                return
+
+        logger.info(f"discard uncommitted segment: {self._path}")
+        os.remove(self._path)
+
+    def _begin_segment(self) -> None:
+        self._segment_start = time.time()
+        self._segment_bytes = 0
+        self._segment_messages = 0
+        self._open()
+
+    def _rotate_file(self, segment_start: float) -> None:
+        rotated_path = self._next_rotated_path(segment_start)
+        os.replace(self._path, rotated_path)
+        logger.debug(f"segment rotated: {rotated_path}")
+
+    def _next_rotated_path(self, segment_start: float) -> str:
+        suffix = time.strftime(SEGMENT_SUFFIX_FORMAT, time.localtime(segment_start))
+        if suffix == self._last_suffix:
+            self._suffix_count += 1
+        else:
+            self._last_suffix = suffix
+            self._suffix_count = 0
+
+        rotated_path = self._rotated_path(suffix, self._suffix_count)
+        while os.path.exists(rotated_path):
+            # Segment of a previous run started within the same second
+            self._suffix_count += 1
+            rotated_path = self._rotated_path(suffix, self._suffix_count)
+
+        return rotated_path
+
+    def _rotated_path(self, suffix: str, count: int) -> str:
+        if count > 0:
+            suffix = f"{suffix}_{count}"
+        if self._data_hour_suffix is not None:
+            suffix = f"{suffix}.{self._data_hour_suffix}"
+
+        return f"{self._rotated_prefix}.{suffix}.{self._extension}"
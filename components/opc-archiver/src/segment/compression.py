@@ -0,0 +1,254 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import gzip
+import logging
+import threading
+import zlib
+from collections import deque
+from concurrent.futures import Executor
+from typing import Any, BinaryIO
+
+import zstandard
+
+logger = logging.getLogger("opc-archiver-component-logger")
+
+COMPRESSION_GZIP = "gzip"
+COMPRESSION_ZSTD = "zstd"
+COMPRESSIONS = [COMPRESSION_GZIP, COMPRESSION_ZSTD]
+
+# File extension of the archived segments for each compression
+COMPRESSION_EXTENSIONS = {COMPRESSION_GZIP: "gz", COMPRESSION_ZSTD: "zst"}
+
+# Compression level used when not configured (gzip: same as `gzip.open`)
+DEFAULT_COMPRESSION_LEVELS = {COMPRESSION_GZIP: 9, COMPRESSION_ZSTD: 3}
+# Fastest compression level, used to catch up with a backlog (instead of deferring
+# the compression)
+FAST_COMPRESSION_LEVELS = {COMPRESSION_GZIP: 1, COMPRESSION_ZSTD: 1}
+
+VERIFY_CHUNK_SIZE = 1024 * 1024
+
+# zstd compressor of each worker thread, with the level and dictionary it was built for
+_worker_compressors = threading.local()
+
+
+class CompressedWriter:
+    """Streams data into a compressed file object (gzip or zstd)
+
+    The underlying file object is not closed, so that the caller can fsync it
+    after the compressed stream has been terminated.
+    """
+
+    def __init__(
+        self,
+        fileobj: BinaryIO,
+        compression: str,
+        level: int = None,
+        dictionary: zstandard.ZstdCompressionDict = None,
+    ):
+        """
+        Parameters
+        ----------
+        fileobj: BinaryIO
+            File object to write the compressed stream to
+        compression: str
+            Compression (`gzip` or `zstd`)
+        level: int
+            Compression level (default level of the compression if not specified)
+        dictionary: zstandard.ZstdCompressionDict
+            Dictionary to compress with (zstd only)
+        """
+        if compression not in COMPRESSIONS:
+            raise ValueError(f"Invalid compression: {compression}")
+
+        if level is None:
+            level = DEFAULT_COMPRESSION_LEVELS[compression]
+
+        self._compression = compression
+        if compression == COMPRESSION_GZIP:
+            self._stream = gzip.GzipFile(
+                fileobj=fileobj, mode="wb", compresslevel=level
+            )
+        else:
+            self._stream = zstandard.ZstdCompressor(
+                level=level, dict_data=dictionary
+            ).stream_writer(fileobj, closefd=False)
+
+    def write(self, data: bytes) -> None:
+        self._stream.write(data)
+
+    def flush(self) -> None:
+        """Flush compressed data written so far to the file object"""
+        if self._compression == COMPRESSION_GZIP:
+            self._stream.flush(zlib.Z_SYNC_FLUSH)
+        else:
+            self._stream.flush(zstandard.FLUSH_BLOCK)
+
+    def close(self) -> None:
+        """Terminate the compressed stream"""
+        self._stream.close()
+
+
+class ParallelCompressedWriter:
+    """Compresses chunks in a worker pool and writes them in order to a file object
+
+    Each chunk is compressed as an independent gzip member (or zstd frame). Concatenated
+    members (frames) are a valid gzip (zstd) file, so the chunks of a segment can be
+    compressed on several cores. zlib and zstd release the GIL while compressing,
+    so a thread pool is enough to use several cores.
+    """
+
+    def __init__(
+        self,
+        fileobj: BinaryIO,
+        compression: str,
+        level: int,
+        executor: Executor,
+        max_pending: int,
+        dictionary: zstandard.ZstdCompressionDict = None,
+        flush_waits: bool = False,
+    ):
+        """
+        Parameters
+        ----------
+        fileobj: BinaryIO
+            File object to write the compressed chunks to
+        compression: str
+            Compression (`gzip` or `zstd`)
+        level: int
+            Compression level (default level of the compression if not specified)
+        executor: Executor
+            Worker pool to compress the chunks
+        max_pending: int
+            Maximum number of chunks being compressed before `write` waits for the oldest one
+        dictionary: zstandard.ZstdCompressionDict
+            Dictionary to compress with (zstd only)
+        flush_waits: bool
+            Whether `flush` waits for the chunks being compressed, so that all the data
+            written so far can be fsync'd after it
+        """
+        if compression not in COMPRESSIONS:
+            raise ValueError(f"Invalid compression: {compression}")
+
+        self._fileobj = fileobj
+        self._compression = compression
+        self._level = (
+            level if level is not None else DEFAULT_COMPRESSION_LEVELS[compression]
+        )
+        self._executor = executor
+        self._max_pending = max_pending
+        self._dictionary = dictionary
+        self._flush_waits = flush_waits
+        self._pending = deque()
+
+    def write(self, data: bytes) -> None:
+        self._pending.append(
+            self._executor.submit(
+                compress_chunk, data, self._compression, self._level, self._dictionary
+            )
+        )
+        self._write_completed()
+
+    def flush(self) -> None:
+        """Write the chunks compressed so far (in order)
+
+        The chunks still being compressed are not waited for, unless `flush_waits` is set.
+        """
+        if self._flush_waits:
+            self._write_all()
+        else:
+            self._write_completed()
+
+    def close(self) -> None:
+        """Wait for all the chunks and write them"""
+        self._write_all()
+
+    def _write_all(self) -> None:
+        while self._pending:
+            self._fileobj.write(self._pending.popleft().result())
+
+    def _write_completed(self) -> None:
+        while self._pending and (
+            self._pending[0].done() or len(self._pending) > self._max_pending
+        ):
+            self._fileobj.write(self._pending.popleft().result())
+
+
+def compress_chunk(
+    data: bytes,
+    compression: str,
+    level: int,
+    dictionary: zstandard.ZstdCompressionDict = None,
+) -> bytes:
+    """Compress data into a standalone gzip member or zstd frame
+
+    The zstd compressor of the calling thread is reused while the level and dictionary
+    are the same, so that the dictionary is not digested again for every chunk
+    (a compressor cannot be used by several threads at a time).
+    """
+    if compression == COMPRESSION_GZIP:
+        return gzip.compress(data, compresslevel=level)
+
+    cached = getattr(_worker_compressors, "compressor", None)
+    if cached is None or cached[0] != level or cached[1] is not dictionary:
+        cached = (
+            level,
+            dictionary,
+            zstandard.ZstdCompressor(level=level, dict_data=dictionary),
+        )
+        _worker_compressors.compressor = cached
+    return cached[2].compress(data)
+
+
+def is_complete(
+    path: str, compression: str, dictionary: zstandard.ZstdCompressionDict = None
+) -> bool:
+    """Check that a compressed file has been terminated properly
+
+    A segment left by a crashed process is truncated and cannot be decompressed.
+
+    Parameters
+    ----------
+    path: str
+        Compressed file
+    compression: str
+        Compression of the file (`gzip` or `zstd`)
+    dictionary: zstandard.ZstdCompressionDict
+        Dictionary the file was compressed with (zstd only)
+
+    Returns
+    -------
+    bool
+        True if the whole file can be decompressed
+    """
+    try:
+        with open(path, "rb") as f:
+            if compression == COMPRESSION_GZIP:
+                with gzip.GzipFile(fileobj=f, mode="rb") as gz:
+                    while gz.read(VERIFY_CHUNK_SIZE):
+                        pass
+                return True
+
+            return _is_complete_zstd(f, dictionary)
+    except (EOFError, OSError, zlib.error, zstandard.ZstdError) as e:
+        logger.warning(f"{path} is not a complete {compression} file: {e}")
+        return False
+
+
+def _is_complete_zstd(f: Any, dictionary: zstandard.ZstdCompressionDict) -> bool:
+    """Decompress every frame of a zstd file and check the last one is complete"""
+    decompressor = zstandard.ZstdDecompressor(dict_data=dictionary)
+    dobj = decompressor.decompressobj()
+    complete = True
+    while True:
+        chunk = f.read(VERIFY_CHUNK_SIZE)
+        if not chunk:
+            break
+        while chunk:
+            dobj.decompress(chunk)
+            complete = dobj.eof
+            chunk = dobj.unused_data if dobj.eof else b""
+            if dobj.eof:
+                dobj = decompressor.decompressobj()
+
+    return complete
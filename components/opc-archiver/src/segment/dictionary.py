@@ -0,0 +1,181 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import glob
+import logging
+import os
+import time
+from collections import deque
+from typing import Any, List
+
+import zstandard
+
+logger = logging.getLogger("opc-archiver-component-logger")
+
+DICTIONARY_EXTENSION = "zdict"
+# S3 object metadata of the segments compressed with a dictionary
+DICTIONARY_METADATA_KEY = "zstd-dictionary-id"
+
+DEFAULT_DICTIONARY_DIR = "./opclogs/dictionary/"
+DEFAULT_DICTIONARY_SIZE = 112640  # Same as the zstd CLI (`zstd --train`)
+DEFAULT_DICTIONARY_RETRAIN_INTERVAL_MIN = 1440
+DEFAULT_DICTIONARY_BUCKET_KEY_PREFIX = "dictionary"
+
+# Recent payloads kept to train a dictionary
+DICTIONARY_MAX_SAMPLES = 10000
+# Payloads required before a dictionary is trained
+DICTIONARY_MIN_SAMPLES = 1000
+
+# Largest zstd frame header (magic number included)
+FRAME_HEADER_MAX_SIZE = 18
+
+
+class DictionaryStore:
+    """Trains zstd dictionaries from recent payloads and keeps them on disk
+
+    SiteWise payloads repeat the same property aliases and JSON keys, so a dictionary
+    trained from them improves the ratio of zstd on small frames.
+    Dictionaries are saved as `{dictionary_dir}{dict_id}.zdict` to decompress segments
+    left by a previous run, and handed to `trained_callback` to be archived with the segments.
+    """
+
+    def __init__(
+        self,
+        dictionary_dir: str = DEFAULT_DICTIONARY_DIR,
+        dictionary_size: int = DEFAULT_DICTIONARY_SIZE,
+        retrain_interval_sec: int = DEFAULT_DICTIONARY_RETRAIN_INTERVAL_MIN * 60,
+        trained_callback: Any = None,
+    ):
+        """
+        Parameters
+        ----------
+        dictionary_dir: str
+            Directory to save dictionaries to
+        dictionary_size: int
+            Maximum size of a dictionary (in bytes)
+        retrain_interval_sec: int
+            Interval to train a new dictionary from recent payloads (in seconds)
+        trained_callback: Any
+            Called with the path of a newly trained dictionary
+        """
+        self._dictionary_dir = dictionary_dir
+        self._dictionary_size = dictionary_size
+        self._retrain_interval_sec = retrain_interval_sec
+        self._trained_callback = trained_callback
+        self._samples = deque(maxlen=DICTIONARY_MAX_SAMPLES)
+        self._dictionaries = {}
+        self._current = None
+        self._trained_at = 0.0
+
+        try:
+            os.makedirs(self._dictionary_dir)
+        except FileExistsError as e:
+            pass
+
+        self._load_latest()
+
+    @property
+    def current(self) -> zstandard.ZstdCompressionDict:
+        """Dictionary to compress new segments with (None until one is trained)"""
+        return self._current
+
+    def get(self, dict_id: int) -> zstandard.ZstdCompressionDict:
+        """Get a dictionary by its ID (None if not found)"""
+        if dict_id not in self._dictionaries:
+            try:
+                with open(self._path(dict_id), "rb") as f:
+                    self._dictionaries[dict_id] = zstandard.ZstdCompressionDict(
+                        f.read()
+                    )
+            except FileNotFoundError as e:
+                return None
+
+        return self._dictionaries[dict_id]
+
+    def add_samples(self, payloads: List[bytes]) -> None:
+        """Keep recent payloads to train the next dictionary"""
+        self._samples.extend(payloads)
+
+    def train_if_due(self) -> bool:
+        """Train a new dictionary if there is none yet or the current one is too old
+
+        Returns
+        -------
+        bool
+            True if a new dictionary was trained
+        """
+        if (
+            self._current is not None
+            and time.time() - self._trained_at < self._retrain_interval_sec
+        ):
+            return False
+        if len(self._samples) < DICTIONARY_MIN_SAMPLES:
+            return False
+
+        try:
+            dictionary = zstandard.train_dictionary(
+                self._dictionary_size, list(self._samples)
+            )
+        except zstandard.ZstdError as e:
+            logger.warning(f"failed to train a zstd dictionary: {e}")
+            self._trained_at = time.time()
+            return False
+
+        path = self._save(dictionary)
+        self._dictionaries[dictionary.dict_id()] = dictionary
+        self._current = dictionary
+        self._trained_at = time.time()
+        logger.info(
+            f"zstd dictionary trained from {len(self._samples)} payloads: {path}"
+        )
+
+        if self._trained_callback is not None:
+            self._trained_callback(path)
+
+        return True
+
+    def _load_latest(self) -> None:
+        paths = glob.glob(
+            os.path.join(self._dictionary_dir, f"*.{DICTIONARY_EXTENSION}")
+        )
+        if len(paths) == 0:
+            return
+
+        path = max(paths, key=os.path.getmtime)
+        with open(path, "rb") as f:
+            dictionary = zstandard.ZstdCompressionDict(f.read())
+        self._dictionaries[dictionary.dict_id()] = dictionary
+        self._current = dictionary
+        self._trained_at = os.path.getmtime(path)
+        logger.info(f"zstd dictionary loaded: {path}")
+
+    def _save(self, dictionary: zstandard.ZstdCompressionDict) -> str:
+        path = self._path(dictionary.dict_id())
+        temp_path = f"{path}.tmp"
+        with open(temp_path, "wb") as f:
+            f.write(dictionary.as_bytes())
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+
+        return path
+
+    def _path(self, dict_id: int) -> str:
+        return os.path.join(self._dictionary_dir, f"{dict_id}.{DICTIONARY_EXTENSION}")
+
+
+def read_dictionary_id(path: str) -> int:
+    """Read the dictionary ID from the first frame header of a zstd file
+
+    Returns
+    -------
+    int
+        ID of the dictionary (0 if the file was compressed without a dictionary)
+    """
+    with open(path, "rb") as f:
+        header = f.read(FRAME_HEADER_MAX_SIZE)
+
+    try:
+        return zstandard.get_frame_parameters(header).dict_id
+    except zstandard.ZstdError as e:
+        return 0
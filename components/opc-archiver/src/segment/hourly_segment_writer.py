@@ -0,0 +1,316 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import calendar
+import json
+import logging
+import os
+import re
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Tuple
+
+from segment.abstract_segment_writer import (
+    DATA_HOUR_ACTIVE_FORMAT,
+    AbstractSegmentWriter,
+    RotationPolicy,
+)
+from segment.manifest import SegmentManifest, SegmentManifestJournal
+from util.sitewise_payload import NANOS_PER_SECOND, parse_payload, timestamp_ns
+
+logger = logging.getLogger("opc-archiver-component-logger")
+
+SECONDS_PER_HOUR = 3600
+NANOS_PER_HOUR = NANOS_PER_SECOND * SECONDS_PER_HOUR
+
+# Hours written to at once (the least recently written one is closed beyond, e.g. on a backfill)
+MAX_OPEN_HOURS = 24
+
+
+class _HourJournal:
+    """Manifest journal given to the writer of an hour, committing through the hourly writer"""
+
+    def __init__(self, hourly_writer: "HourlySegmentWriter", hour: int):
+        self._hourly_writer = hourly_writer
+        self._hour = hour
+
+    def pending(self) -> List[SegmentManifest]:
+        return self._hourly_writer._manifest_journal.pending()
+
+    def commit(self, manifest: SegmentManifest) -> None:
+        self._hourly_writer._commit_hour(self._hour, manifest)
+
+
+class HourlySegmentWriter:
+    """Routes the property values to one segment writer per hour of their timestamp (UTC)
+
+    Each rotated segment only holds the samples of one hour, named after it (see `data_hour`
+    of `AbstractSegmentWriter`), so it lands in the `datehour` partition of its data even
+    when the data arrives late (e.g. buffered by the gateway during a disconnection).
+    A message with values over several hours is split into one message per hour.
+
+    The writer of each hour rotates on its own (rotation policy), and is closed once its
+    hour is over and it has nothing left to rotate.
+
+    With a manifest journal, the read position is only moved up to the first message of
+    the segments still open, since they hold messages older than the committed segments.
+    The last sequence number committed for each hour is journaled with it, and the messages
+    of an hour up to it are skipped when they are read again after a restart.
+    """
+
+    def __init__(
+        self,
+        log_dir: str,
+        log_name: str,
+        rotation_policy: RotationPolicy,
+        writer_factory: Callable[[float, Any], AbstractSegmentWriter],
+        manifest_journal: SegmentManifestJournal = None,
+    ):
+        """
+        Parameters
+        ----------
+        log_dir: str
+            Directory to write segments to
+        log_name: str
+            File name prefix of the segments
+        rotation_policy: RotationPolicy
+            Limits of a segment (also the interval to commit the read position without any segment)
+        writer_factory: Callable[[float, Any], AbstractSegmentWriter]
+            Creates the writer of an hour from the start of the hour and its manifest journal
+        manifest_journal: SegmentManifestJournal
+            Journal to commit the rotated segments to (not committed if not specified)
+        """
+        self._log_dir = log_dir
+        self._log_name = log_name
+        self._rotation_policy = rotation_policy
+        self._writer_factory = writer_factory
+        self._manifest_journal = manifest_journal
+        self._writers: "OrderedDict[int, AbstractSegmentWriter]" = OrderedDict()
+        self._compression_level = None
+        self._compression_level_changed = False
+        self._committed_hours: Dict[int, int] = {}
+        self._next_sequence_number = None
+        self._committed_sequence_number = None
+        self._committed_at = time.time()
+        self._closed = False
+
+        if self._manifest_journal is not None:
+            committed_hours = self._manifest_journal.committed_hours()
+            self._committed_hours = {
+                self._parse_hour(name): sequence_number
+                for name, sequence_number in committed_hours.items()
+            }
+            self._next_sequence_number = self._manifest_journal.next_sequence_number
+            self._committed_sequence_number = self._next_sequence_number
+
+        self._recover()
+
+    def _recover(self) -> None:
+        """Open the hours with an active segment left by a previous run, to recover it"""
+        pattern = re.compile(rf"{re.escape(self._log_name)}\.([0-9]{{10}})")
+        for filename in sorted(os.listdir(self._log_dir)):
+            matched = pattern.fullmatch(filename)
+            if matched is not None:
+                self._writer(self._parse_hour(matched.group(1)))
+
+    def write_batch(
+        self,
+        payloads: List[bytes],
+        sequence_numbers: List[int] = None,
+        last_sequence_number: int = None,
+    ) -> None:
+        """Route the property values of a batch to the segments of their hours
+
+        Parameters
+        ----------
+        payloads: List[bytes]
+            Raw message payloads read from the stream
+        sequence_numbers: List[int]
+            Sequence number of each payload (to commit the segments to the manifest journal)
+        last_sequence_number: int
+            Sequence number of the last message read, even if it was filtered out
+        """
+        if not sequence_numbers:
+            sequence_numbers = [None] * len(payloads)
+
+        batches: Dict[int, Tuple[List[bytes], List[int]]] = {}
+        for payload, sequence_number in zip(payloads, sequence_numbers):
+            for hour, part in self._split(payload):
+                if (
+                    sequence_number is not None
+                    and sequence_number <= self._committed_hours.get(hour, -1)
+                ):
+                    # Already in a segment committed before a restart
+                    continue
+                hour_payloads, hour_sequence_numbers = batches.setdefault(
+                    hour, ([], [])
+                )
+                hour_payloads.append(part)
+                if sequence_number is not None:
+                    hour_sequence_numbers.append(sequence_number)
+
+        for hour, (hour_payloads, hour_sequence_numbers) in batches.items():
+            self._writer(hour).write_batch(hour_payloads, hour_sequence_numbers)
+
+        # Only moved once the whole batch is in the segments of its hours
+        if last_sequence_number is None and len(sequence_numbers) > 0:
+            last_sequence_number = sequence_numbers[-1]
+        if last_sequence_number is not None:
+            self._next_sequence_number = last_sequence_number + 1
+
+        self.rotate_if_due()
+
+    def set_compression_level(self, level: int) -> None:
+        """Change the compression level, applied from the next segment of each hour
+
+        Parameters
+        ----------
+        level: int
+            Compression level (default level of the compression if None)
+        """
+        self._compression_level = level
+        self._compression_level_changed = True
+        for writer in self._writers.values():
+            writer.set_compression_level(level)
+
+    def rotate_if_due(self) -> None:
+        """Rotate the segments that reached a limit and close the hours that are over"""
+        now = time.time()
+        for hour, writer in list(self._writers.items()):
+            writer.rotate_if_due()
+            if writer.messages == 0 and hour + SECONDS_PER_HOUR <= now:
+                del self._writers[hour]
+                writer.close()
+
+        if (
+            self._manifest_journal is not None
+            and now - self._committed_at >= self._rotation_policy.max_age_sec
+            and self._position() != self._committed_sequence_number
+        ):
+            # Move the read position past the messages filtered out or skipped
+            self._commit()
+
+    def rotate(self) -> None:
+        """Rotate the segments of every hour"""
+        for writer in self._writers.values():
+            if writer.messages > 0:
+                writer.rotate()
+
+    def close(self) -> None:
+        """Complete and close the segments of every hour"""
+        if self._closed:
+            return
+
+        while len(self._writers) > 0:
+            _, writer = self._writers.popitem(last=False)
+            writer.close()
+        if self._manifest_journal is not None:
+            self._commit()
+        self._closed = True
+
+    def _writer(self, hour: int) -> AbstractSegmentWriter:
+        """Writer of an hour, opened on its first sample"""
+        writer = self._writers.get(hour)
+        if writer is not None:
+            self._writers.move_to_end(hour)
+            return writer
+
+        if len(self._writers) >= MAX_OPEN_HOURS:
+            oldest_hour, oldest_writer = self._writers.popitem(last=False)
+            logger.info(
+                f"close the segment of {self._format_hour(oldest_hour)} "
+                f"to open {self._format_hour(hour)}"
+            )
+            oldest_writer.close()
+
+        writer = self._writer_factory(
+            hour,
+            (_HourJournal(self, hour) if self._manifest_journal is not None else None),
+        )
+        if self._compression_level_changed:
+            writer.set_compression_level(self._compression_level)
+        self._writers[hour] = writer
+
+        return writer
+
+    def _split(self, payload: bytes) -> List[Tuple[int, bytes]]:
+        """Split a message into the messages of the hours of its values
+
+        A message without timestamped values is written to the current hour.
+        """
+        try:
+            entry = parse_payload(payload)
+            property_values = entry.get("propertyValues", [])
+        except (ValueError, AttributeError):
+            return [(self._hour_of(time.time_ns()), payload)]
+
+        values_per_hour: Dict[int, List[dict]] = {}
+        for property_value in property_values:
+            values_per_hour.setdefault(
+                self._hour_of(timestamp_ns(property_value)), []
+            ).append(property_value)
+
+        if len(values_per_hour) == 0:
+            return [(self._hour_of(time.time_ns()), payload)]
+        if len(values_per_hour) == 1:
+            return [(next(iter(values_per_hour)), payload)]
+
+        return [
+            (
+                hour,
+                json.dumps(
+                    {**entry, "propertyValues": values}, separators=(",", ":")
+                ).encode(),
+            )
+            for hour, values in values_per_hour.items()
+        ]
+
+    def _commit_hour(self, hour: int, manifest: SegmentManifest) -> None:
+        """Commit a segment of an hour (manifest journal of the writers)"""
+        self._committed_hours[hour] = manifest.last_sequence_number
+        self._commit(manifest, hour)
+
+    def _commit(self, manifest: SegmentManifest = None, hour: int = None) -> None:
+        """Commit the read position, up to the first message of the other open segments"""
+        position = self._position(hour)
+        # Hours committed behind the read position are not read again
+        self._committed_hours = {
+            committed_hour: sequence_number
+            for committed_hour, sequence_number in self._committed_hours.items()
+            if sequence_number >= position
+        }
+        committed_hours = {
+            self._format_hour(committed_hour): sequence_number
+            for committed_hour, sequence_number in self._committed_hours.items()
+        }
+
+        if manifest is None:
+            self._manifest_journal.commit_position(position, committed_hours)
+        else:
+            self._manifest_journal.commit(manifest, position, committed_hours)
+        self._committed_sequence_number = position
+        self._committed_at = time.time()
+
+    def _position(self, excluded_hour: int = None) -> int:
+        """First sequence number not committed yet"""
+        return min(
+            [
+                writer.first_sequence_number
+                for hour, writer in self._writers.items()
+                if hour != excluded_hour and writer.first_sequence_number is not None
+            ]
+            + [self._next_sequence_number]
+        )
+
+    @staticmethod
+    def _hour_of(timestamp: int) -> int:
+        """Start of the hour of a timestamp in nanoseconds (seconds since the epoch)"""
+        return timestamp // NANOS_PER_HOUR * SECONDS_PER_HOUR
+
+    @staticmethod
+    def _format_hour(hour: int) -> str:
+        return time.strftime(DATA_HOUR_ACTIVE_FORMAT, time.gmtime(hour))
+
+    @staticmethod
+    def _parse_hour(name: str) -> int:
+        return calendar.timegm(time.strptime(name, DATA_HOUR_ACTIVE_FORMAT))
@@ -0,0 +1,218 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import hashlib
+import logging
+import threading
+from typing import Dict, List
+
+from util.checkpoint import CheckpointStore
+
+logger = logging.getLogger("opc-archiver-component-logger")
+
+CHECKSUM_CHUNK_SIZE = 1024 * 1024
+
+# S3 user metadata of an archived segment
+FIRST_SEQUENCE_NUMBER_METADATA_KEY = "first-sequence-number"
+LAST_SEQUENCE_NUMBER_METADATA_KEY = "last-sequence-number"
+SHA256_METADATA_KEY = "sha256"
+
+
+class SegmentManifest:
+    """Stream sequence range and checksum of a rotated segment"""
+
+    def __init__(
+        self,
+        name: str,
+        first_sequence_number: int,
+        last_sequence_number: int,
+        messages: int = 0,
+        size: int = 0,
+        sha256: str = None,
+    ):
+        """
+        Parameters
+        ----------
+        name: str
+            File name of the rotated segment (None if every message of the range was filtered out)
+        first_sequence_number: int
+            Sequence number of the first message of the segment
+        last_sequence_number: int
+            Sequence number of the last message read into the segment (including filtered ones)
+        messages: int
+            Number of messages written to the segment
+        size: int
+            Size of the segment file (in bytes)
+        sha256: str
+            SHA-256 of the segment file (hex)
+        """
+        self.name = name
+        self.first_sequence_number = first_sequence_number
+        self.last_sequence_number = last_sequence_number
+        self.messages = messages
+        self.size = size
+        self.sha256 = sha256
+
+    def to_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "first_sequence_number": self.first_sequence_number,
+            "last_sequence_number": self.last_sequence_number,
+            "messages": self.messages,
+            "size": self.size,
+            "sha256": self.sha256,
+        }
+
+    @classmethod
+    def from_dict(cls, value: dict) -> "SegmentManifest":
+        return cls(
+            value["name"],
+            value["first_sequence_number"],
+            value["last_sequence_number"],
+            value.get("messages", 0),
+            value.get("size", 0),
+            value.get("sha256"),
+        )
+
+    def user_metadata(self) -> dict:
+        """S3 user metadata carrying the manifest with the archived segment"""
+        return {
+            FIRST_SEQUENCE_NUMBER_METADATA_KEY: str(self.first_sequence_number),
+            LAST_SEQUENCE_NUMBER_METADATA_KEY: str(self.last_sequence_number),
+            SHA256_METADATA_KEY: self.sha256,
+        }
+
+
+def file_sha256(path: str) -> str:
+    """SHA-256 of a file (hex)"""
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHECKSUM_CHUNK_SIZE), b""):
+            sha256.update(chunk)
+
+    return sha256.hexdigest()
+
+
+class SegmentManifestJournal:
+    """
+    Manifests of the rotated segments, committed atomically with the read position of the stream
+
+    A segment is committed (its manifest journaled together with the next sequence number
+    to read) before it is renamed for hand-off, and stays pending until it has been added
+    to the export stream. On restart, the pending segments are handed off again and the
+    stream is read from the committed position, so that no message is archived twice or lost.
+
+    When several segments are open at once (see `HourlySegmentWriter`), the committed
+    position stays at the first message of the open segments, and the last sequence number
+    committed for each hour ahead of it is journaled, so that these messages are skipped
+    when they are read again.
+    """
+
+    def __init__(
+        self,
+        checkpoint: CheckpointStore,
+        sequence_key: str,
+        manifests_key: str,
+        hours_key: str = None,
+    ):
+        """
+        Parameters
+        ----------
+        checkpoint: CheckpointStore
+            Store of the read position of the stream
+        sequence_key: str
+            Key of the next sequence number to read in the store
+        manifests_key: str
+            Key of the pending manifests in the store
+        hours_key: str
+            Key of the last sequence numbers committed per hour in the store
+        """
+        self._checkpoint = checkpoint
+        self._sequence_key = sequence_key
+        self._manifests_key = manifests_key
+        self._hours_key = hours_key
+        self._lock = threading.Lock()
+
+    @property
+    def next_sequence_number(self) -> int:
+        """Sequence number following the last committed segment"""
+        return self._checkpoint.get(self._sequence_key, 0)
+
+    def committed_hours(self) -> Dict[str, int]:
+        """Last sequence number committed for each hour ahead of the read position"""
+        return dict(self._checkpoint.get(self._hours_key, {}))
+
+    def pending(self) -> List[SegmentManifest]:
+        """Manifests of the committed segments not handed off yet, in commit order"""
+        return [
+            SegmentManifest.from_dict(value)
+            for value in self._checkpoint.get(self._manifests_key, [])
+        ]
+
+    def get(self, name: str) -> SegmentManifest:
+        """Pending manifest of a segment (None if the segment is not pending)"""
+        return next(
+            (manifest for manifest in self.pending() if manifest.name == name), None
+        )
+
+    def commit(
+        self,
+        manifest: SegmentManifest,
+        next_sequence_number: int = None,
+        committed_hours: Dict[str, int] = None,
+    ) -> None:
+        """Journal the manifest of a segment and move the read position past its last message
+
+        Parameters
+        ----------
+        manifest: SegmentManifest
+            Manifest of the segment (without name if there is no file to hand off)
+        next_sequence_number: int
+            Read position to commit (right after the last message of the segment if not specified)
+        committed_hours: Dict[str, int]
+            Last sequence number committed for each hour ahead of the read position
+        """
+        if next_sequence_number is None:
+            next_sequence_number = manifest.last_sequence_number + 1
+
+        with self._lock:
+            values = {self._sequence_key: next_sequence_number}
+            if committed_hours is not None:
+                values[self._hours_key] = committed_hours
+            if manifest.name is not None:
+                values[self._manifests_key] = [
+                    *self._checkpoint.get(self._manifests_key, []),
+                    manifest.to_dict(),
+                ]
+            self._checkpoint.update(values)
+
+        logger.debug(
+            f"segment {manifest.name} committed: "
+            f"{manifest.first_sequence_number}-{manifest.last_sequence_number}"
+        )
+
+    def commit_position(
+        self, next_sequence_number: int, committed_hours: Dict[str, int] = None
+    ) -> None:
+        """Move the read position without any segment (messages filtered out or skipped)
+
+        Parameters
+        ----------
+        next_sequence_number: int
+            Read position to commit
+        committed_hours: Dict[str, int]
+            Last sequence number committed for each hour ahead of the read position
+        """
+        with self._lock:
+            values = {self._sequence_key: next_sequence_number}
+            if committed_hours is not None:
+                values[self._hours_key] = committed_hours
+            self._checkpoint.update(values)
+
+    def handed_off(self, name: str) -> None:
+        """Remove a segment added to the export stream from the pending manifests"""
+        with self._lock:
+            manifests = self._checkpoint.get(self._manifests_key, [])
+            remaining = [value for value in manifests if value["name"] != name]
+            if len(remaining) != len(manifests):
+                self._checkpoint.update({self._manifests_key: remaining})
@@ -0,0 +1,185 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import logging
+import os
+from typing import Any, List
+
+from segment.abstract_segment_writer import AbstractSegmentWriter, RotationPolicy
+from segment.compression import COMPRESSION_GZIP, DEFAULT_COMPRESSION_LEVELS
+from segment.manifest import SegmentManifestJournal
+from util.metrics import REGISTRY
+from util.sitewise_payload import (
+    BOOLEAN_VALUE,
+    DOUBLE_VALUE,
+    INTEGER_VALUE,
+    STRING_VALUE,
+    iter_property_values,
+    parse_payload,
+)
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    # pyarrow is only required for the parquet output format
+    pa = None
+    pq = None
+
+logger = logging.getLogger("opc-archiver-component-logger")
+
+PARQUET_EXTENSION = "parquet"
+PARQUET_ROW_GROUP_SIZE = 128 * 1024  # Rows per row group
+
+MALFORMED_PAYLOADS = REGISTRY.counter(
+    "opc_parquet_malformed_payloads_total",
+    "Payloads skipped by the parquet segments (not a SiteWise collector message)",
+)
+
+# Column of the value for each value type of SiteWise
+VALUE_COLUMNS = {
+    INTEGER_VALUE: "integer_value",
+    DOUBLE_VALUE: "double_value",
+    STRING_VALUE: "string_value",
+    BOOLEAN_VALUE: "boolean_value",
+}
+
+
+def parquet_schema() -> "pa.Schema":
+    """Schema of the parquet segments (one row per property value)"""
+    return pa.schema(
+        [
+            ("alias", pa.string()),
+            ("timestamp_ns", pa.int64()),
+            (VALUE_COLUMNS[INTEGER_VALUE], pa.int64()),
+            (VALUE_COLUMNS[DOUBLE_VALUE], pa.float64()),
+            (VALUE_COLUMNS[STRING_VALUE], pa.string()),
+            (VALUE_COLUMNS[BOOLEAN_VALUE], pa.bool_()),
+            ("quality", pa.string()),
+        ]
+    )
+
+
+class ParquetSegmentWriter(AbstractSegmentWriter):
+    """Writes OPC stream payloads into rotated parquet segment files
+
+    The SiteWise collector payloads are flattened into one row per property value
+    and accumulated in memory as record batches. Malformed payloads are skipped. When the segment is rotated,
+    the rows are sorted by alias and timestamp and written with row group statistics.
+    """
+
+    def __init__(
+        self,
+        log_dir: str,
+        log_name: str,
+        rotation_policy: RotationPolicy,
+        compression: str = COMPRESSION_GZIP,
+        compression_level: int = None,
+        manifest_journal: SegmentManifestJournal = None,
+        rotated_callback: Any = None,
+        data_hour: float = None,
+    ):
+        """
+        Parameters
+        ----------
+        log_dir: str
+            Directory to write segments to
+        log_name: str
+            File name of the active segment
+        rotation_policy: RotationPolicy
+            Limits of a segment (age, size and number of messages)
+        compression: str
+            Compression codec of the parquet files (`gzip` or `zstd`)
+        compression_level: int
+            Compression level (default level of the compression if not specified)
+        manifest_journal: SegmentManifestJournal
+            Journal to commit the rotated segments to (not committed if not specified)
+        rotated_callback: Any
+            Called with the path of each rotated segment
+        data_hour: float
+            Start of the hour (UTC) of the samples written to the segments (see `HourlySegmentWriter`)
+        """
+        if pa is None:
+            raise Exception("pyarrow is required for the parquet output format")
+
+        self._compression = compression
+        self._compression_level = compression_level
+        self._schema = parquet_schema()
+        self._batches = []
+
+        super(ParquetSegmentWriter, self).__init__(
+            log_dir,
+            log_name,
+            rotation_policy,
+            PARQUET_EXTENSION,
+            manifest_journal,
+            rotated_callback,
+            data_hour,
+        )
+
+    def _recover(self) -> None:
+        """Rotate the parquet file written at the shutdown of a previous run
+
+        A file that cannot be read (crash while writing) is discarded, its messages are
+        read again from the stream since the sequence number is saved when a segment is rotated.
+        """
+        if not os.path.exists(self._path):
+            return
+
+        try:
+            pq.ParquetFile(self._path)
+            self._rotate_file(os.path.getmtime(self._path))
+        except Exception as e:
+            logger.warning(f"discard incomplete segment: {self._path}: {e}")
+            os.remove(self._path)
+
+    def _open(self) -> None:
+        self._batches = []
+
+    def _write(self, payloads: List[bytes]) -> int:
+        columns = {name: [] for name in self._schema.names}
+        value_columns = [columns[name] for name in VALUE_COLUMNS.values()]
+
+        for payload in payloads:
+            try:
+                property_values = list(iter_property_values(parse_payload(payload)))
+            except (ValueError, AttributeError, TypeError) as e:
+                # Not a SiteWise collector message, it has no row
+                MALFORMED_PAYLOADS.inc()
+                logger.warning(f"skip a malformed payload: {e}")
+                continue
+
+            for alias, ts, value_type, value, quality in property_values:
+                columns["alias"].append(alias)
+                columns["timestamp_ns"].append(ts)
+                columns["quality"].append(quality)
+                for value_column in value_columns:
+                    value_column.append(None)
+                if value_type is not None:
+                    columns[VALUE_COLUMNS[value_type]][-1] = value
+
+        self._batches.append(pa.RecordBatch.from_pydict(columns, schema=self._schema))
+
+        return sum(len(payload) for payload in payloads)
+
+    def _close_file(self) -> None:
+        """Sort the rows of the segment and write them to the active segment file"""
+        if self._segment_messages == 0:
+            return
+
+        table = pa.Table.from_batches(self._batches, schema=self._schema).sort_by(
+            [("alias", "ascending"), ("timestamp_ns", "ascending")]
+        )
+        pq.write_table(
+            table,
+            self._path,
+            row_group_size=PARQUET_ROW_GROUP_SIZE,
+            compression=self._compression,
+            compression_level=(
+                self._compression_level
+                if self._compression_level is not None
+                else DEFAULT_COMPRESSION_LEVELS[self._compression]
+            ),
+            write_statistics=True,
+        )
+        self._batches = []
@@ -0,0 +1,171 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import string
+from typing import Iterator, Tuple
+
+from segment.compression import DEFAULT_COMPRESSION_LEVELS
+from segment.parquet_segment_writer import VALUE_COLUMNS
+from util.sitewise_payload import (
+    BOOLEAN_VALUE,
+    DOUBLE_VALUE,
+    INTEGER_VALUE,
+    STRING_VALUE,
+)
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+except ImportError:
+    # pyarrow is only required for the processed output format
+    pa = None
+    pc = None
+    pq = None
+
+# Characters left as is by `url_encode` of Athena (like Java `URLEncoder`)
+URL_ENCODE_SAFE_CHARS = frozenset(string.ascii_letters + string.digits + ".-*_")
+
+# Partition of the `opc_processed` table (`projection.datehour.format`)
+DATEHOUR_FORMAT = "%Y/%m/%d/%H"
+NANOS_PER_MILLI = 1000000
+
+# Fields of the `value` struct of the `opc_processed` table
+PROCESSED_VALUE_FIELDS = {
+    INTEGER_VALUE: "integervalue",
+    DOUBLE_VALUE: "doublevalue",
+    STRING_VALUE: "stringvalue",
+    BOOLEAN_VALUE: "booleanvalue",
+}
+
+
+def url_encode(value: str) -> str:
+    """`url_encode` of Athena
+
+    Alphanumeric characters and `.-*_` are kept, the space is encoded as `+`
+    and the other characters as `%XX` for each byte of their UTF-8 encoding.
+    """
+    encoded = []
+    for byte in value.encode("utf-8"):
+        char = chr(byte)
+        if char in URL_ENCODE_SAFE_CHARS:
+            encoded.append(char)
+        elif char == " ":
+            encoded.append("+")
+        else:
+            encoded.append(f"%{byte:02X}")
+
+    return "".join(encoded)
+
+
+def url_encoded_tag(alias: str) -> str:
+    """`url_encoded_tag` partition of a property alias, as written by `build_insert_query`
+
+    `REPLACE(URL_ENCODE(REPLACE(propertyalias, '/', '_')), '_', '/')`, so that the
+    slashes of the alias are kept (and the underscores become slashes as well).
+    """
+    return url_encode(alias.replace("/", "_")).replace("_", "/")
+
+
+def processed_key(alias: str, datehour: str, name: str) -> str:
+    """S3 key of an object in the `${url_encoded_tag}/${datehour}/` layout of `opc_processed`"""
+    return f"{url_encoded_tag(alias)}/{datehour}/{name}"
+
+
+def processed_schema() -> "pa.Schema":
+    """Schema of the `opc_processed` table (partition columns are in the key)"""
+    return pa.schema(
+        [
+            (
+                "value",
+                pa.struct(
+                    [
+                        (PROCESSED_VALUE_FIELDS[INTEGER_VALUE], pa.int32()),
+                        (PROCESSED_VALUE_FIELDS[DOUBLE_VALUE], pa.float64()),
+                        (PROCESSED_VALUE_FIELDS[STRING_VALUE], pa.string()),
+                        (PROCESSED_VALUE_FIELDS[BOOLEAN_VALUE], pa.bool_()),
+                    ]
+                ),
+            ),
+            ("timestamp", pa.timestamp("ms")),
+        ]
+    )
+
+
+def split_processed_segment(path: str) -> Iterator[Tuple[str, str, "pa.Table"]]:
+    """Split a parquet segment into the partitions of the `opc_processed` table
+
+    The rows of a segment are sorted by alias and timestamp, so each partition is
+    a contiguous slice. Hours are the UTC hours of the sample timestamps.
+
+    They are not always the hours of the cloud INSERT (`build_insert_query`): it
+    keeps the `datehour` of the `opc_raw` partition, which is the time in the file
+    name of the raw segment (time of reading, device local time). Samples read
+    after the end of their hour, or a device clock not in UTC, land in another
+    hour there.
+
+    Parameters
+    ----------
+    path: str
+        Path of the parquet segment (see `parquet_schema`)
+
+    Returns
+    -------
+    Iterator[Tuple[str, str, pa.Table]]
+        (property alias, datehour, rows in the `opc_processed` schema)
+    """
+    table = pq.read_table(path)
+    timestamps_ms = pc.divide(table["timestamp_ns"], NANOS_PER_MILLI)
+    datehours = pc.strftime(
+        timestamps_ms.cast(pa.timestamp("ms", tz="UTC")), format=DATEHOUR_FORMAT
+    ).to_pylist()
+    aliases = table["alias"].to_pylist()
+
+    schema = processed_schema()
+    value_type = schema.field("value").type
+    processed = pa.Table.from_arrays(
+        [
+            pa.StructArray.from_arrays(
+                [
+                    table[VALUE_COLUMNS[INTEGER_VALUE]]
+                    .combine_chunks()
+                    .cast(value_type.field(PROCESSED_VALUE_FIELDS[INTEGER_VALUE]).type),
+                    table[VALUE_COLUMNS[DOUBLE_VALUE]].combine_chunks(),
+                    table[VALUE_COLUMNS[STRING_VALUE]].combine_chunks(),
+                    table[VALUE_COLUMNS[BOOLEAN_VALUE]].combine_chunks(),
+                ],
+                fields=list(value_type),
+            ),
+            timestamps_ms.combine_chunks().cast(pa.timestamp("ms")),
+        ],
+        schema=schema,
+    )
+
+    start = 0
+    for index in range(1, len(aliases) + 1):
+        if (
+            index == len(aliases)
+            or aliases[index] != aliases[start]
+            or datehours[index] != datehours[start]
+        ):
+            yield aliases[start], datehours[start], processed.slice(
+                start, index - start
+            )
+            start = index
+
+
+def write_processed_table(
+    table: "pa.Table", path: str, compression: str, compression_level: int = None
+) -> None:
+    """Write the rows of a partition of the `opc_processed` table"""
+    pq.write_table(
+        table,
+        path,
+        compression=compression,
+        compression_level=(
+            compression_level
+            if compression_level is not None
+            else DEFAULT_COMPRESSION_LEVELS[compression]
+        ),
+        write_statistics=True,
+    )
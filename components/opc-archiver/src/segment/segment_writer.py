@@ -0,0 +1,207 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import logging
+import os
+from concurrent.futures import Executor
+from typing import Any, List
+
+from segment.abstract_segment_writer import AbstractSegmentWriter, RotationPolicy
+from segment.compression import (
+    COMPRESSION_EXTENSIONS,
+    COMPRESSION_GZIP,
+    COMPRESSION_ZSTD,
+    CompressedWriter,
+    ParallelCompressedWriter,
+    is_complete,
+)
+from segment.dictionary import DictionaryStore, read_dictionary_id
+from segment.manifest import SegmentManifestJournal
+from util.metrics import REGISTRY
+
+logger = logging.getLogger("opc-archiver-component-logger")
+
+FLUSH_POLICY_BATCH = "batch"  # Flush the write buffer after every batch
+FLUSH_POLICY_ROTATE = "rotate"  # Flush only when the buffer is full or on rotation
+FLUSH_POLICIES = [FLUSH_POLICY_BATCH, FLUSH_POLICY_ROTATE]
+
+FSYNC_POLICY_NONE = "none"  # Never fsync, leave it to the OS
+FSYNC_POLICY_BATCH = "batch"  # fsync after every batch
+FSYNC_POLICY_ROTATE = "rotate"  # fsync once before the segment is rotated
+FSYNC_POLICIES = [FSYNC_POLICY_NONE, FSYNC_POLICY_BATCH, FSYNC_POLICY_ROTATE]
+
+DEFAULT_BUFFER_SIZE = 1024 * 1024
+RECORD_SEPARATOR = b"\n"
+
+
+class SegmentWriter(AbstractSegmentWriter):
+    """Writes raw OPC stream payloads into rotated, compressed segment files
+
+    Each batch read from the stream is compressed and written with a single buffered write
+    (one payload per line), instead of one logging call per message.
+    Rotated segments are renamed to `{name}.{%Y-%m-%d_%H-%M-%S}.{gz|zst}`, so they can be
+    archived as they are without any plaintext intermediate file.
+
+    With a compression pool, the batches are compressed concurrently and written in order.
+    A segment is only rotated once all its batches are written, so segments are still
+    handed off in time order.
+
+    With a dictionary store (zstd only), each segment is compressed with the latest
+    dictionary, which is retrained from the written payloads when a segment is opened.
+    """
+
+    def __init__(
+        self,
+        log_dir: str,
+        log_name: str,
+        rotation_policy: RotationPolicy,
+        compression: str = COMPRESSION_GZIP,
+        compression_level: int = None,
+        flush_policy: str = FLUSH_POLICY_BATCH,
+        fsync_policy: str = FSYNC_POLICY_ROTATE,
+        buffer_size: int = DEFAULT_BUFFER_SIZE,
+        compression_pool: Executor = None,
+        compression_pool_size: int = 0,
+        dictionary_store: DictionaryStore = None,
+        manifest_journal: SegmentManifestJournal = None,
+        rotated_callback: Any = None,
+        data_hour: float = None,
+    ):
+        """
+        Parameters
+        ----------
+        log_dir: str
+            Directory to write segments to
+        log_name: str
+            File name of the active segment
+        rotation_policy: RotationPolicy
+            Limits of a segment (age, size and number of messages)
+        compression: str
+            Compression of the segments (`gzip` or `zstd`)
+        compression_level: int
+            Compression level (default level of the compression if not specified)
+        flush_policy: str
+            When to flush the write buffer (`batch` or `rotate`)
+        fsync_policy: str
+            When to fsync the segment file (`none`, `batch` or `rotate`)
+        buffer_size: int
+            Size of the write buffer (in bytes)
+        compression_pool: Executor
+            Worker pool to compress batches concurrently (compressed in the calling thread if not specified)
+        compression_pool_size: int
+            Number of workers of the pool (bounds the batches being compressed)
+        dictionary_store: DictionaryStore
+            Store of the zstd dictionaries (compressed without a dictionary if not specified)
+        manifest_journal: SegmentManifestJournal
+            Journal to commit the rotated segments to (not committed if not specified)
+        rotated_callback: Any
+            Called with the path of each rotated segment
+        data_hour: float
+            Start of the hour (UTC) of the samples written to the segments (see `HourlySegmentWriter`)
+        """
+        if flush_policy not in FLUSH_POLICIES:
+            raise ValueError(f"Invalid flush policy: {flush_policy}")
+        if fsync_policy not in FSYNC_POLICIES:
+            raise ValueError(f"Invalid fsync policy: {fsync_policy}")
+        if dictionary_store is not None and compression != COMPRESSION_ZSTD:
+            raise ValueError(f"Dictionary is not supported by {compression}")
+
+        self._compression = compression
+        self._compression_level = compression_level
+        self._flush_policy = flush_policy
+        self._fsync_policy = fsync_policy
+        self._buffer_size = buffer_size
+        self._compression_pool = compression_pool
+        self._max_pending = max(1, compression_pool_size) * 2
+        self._dictionary_store = dictionary_store
+        self._write_histogram = REGISTRY.histogram(
+            "opc_batch_write_seconds",
+            "Time to compress and write a batch to a segment",
+            {"segment": log_name},
+        )
+        self._raw_file = None
+        self._file = None
+
+        super(SegmentWriter, self).__init__(
+            log_dir,
+            log_name,
+            rotation_policy,
+            COMPRESSION_EXTENSIONS[compression],
+            manifest_journal,
+            rotated_callback,
+            data_hour,
+        )
+
+    def _recover(self) -> None:
+        """Rotate the active segment left by a previous run
+
+        A compressed stream cannot be appended to, so a complete segment is rotated as it is.
+        A segment truncated by a crash is discarded, its messages are read again from the
+        stream since the sequence number is saved when a segment is rotated.
+        """
+        if not os.path.exists(self._path):
+            return
+
+        dictionary = None
+        if self._dictionary_store is not None:
+            dict_id = read_dictionary_id(self._path)
+            if dict_id != 0:
+                dictionary = self._dictionary_store.get(dict_id)
+
+        if is_complete(self._path, self._compression, dictionary):
+            self._rotate_file(os.path.getmtime(self._path))
+        else:
+            logger.warning(f"discard incomplete segment: {self._path}")
+            os.remove(self._path)
+
+    def _open(self) -> None:
+        dictionary = None
+        if self._dictionary_store is not None:
+            self._dictionary_store.train_if_due()
+            dictionary = self._dictionary_store.current
+
+        self._raw_file = open(self._path, "wb", buffering=self._buffer_size)
+        if self._compression_pool is None:
+            self._file = CompressedWriter(
+                self._raw_file,
+                self._compression,
+                self._compression_level,
+                dictionary,
+            )
+        else:
+            self._file = ParallelCompressedWriter(
+                self._raw_file,
+                self._compression,
+                self._compression_level,
+                self._compression_pool,
+                self._max_pending,
+                dictionary,
+                # Every batch must be on disk before its fsync
+                flush_waits=self._fsync_policy == FSYNC_POLICY_BATCH,
+            )
+
+    def _write(self, payloads: List[bytes]) -> int:
+        data = RECORD_SEPARATOR.join(payloads) + RECORD_SEPARATOR
+        with self._write_histogram.time():
+            self._file.write(data)
+            if self._dictionary_store is not None:
+                self._dictionary_store.add_samples(payloads)
+
+            if (
+                self._flush_policy == FLUSH_POLICY_BATCH
+                or self._fsync_policy == FSYNC_POLICY_BATCH
+            ):
+                self._file.flush()
+                self._raw_file.flush()
+            if self._fsync_policy == FSYNC_POLICY_BATCH:
+                os.fsync(self._raw_file.fileno())
+
+        return len(data)
+
+    def _close_file(self) -> None:
+        """Terminate the compressed stream and close the active segment"""
+        self._file.close()
+        self._raw_file.flush()
+        if self._fsync_policy != FSYNC_POLICY_NONE:
+            os.fsync(self._raw_file.fileno())
+        self._raw_file.close()
@@ -11,7 +11,7 @@ from stream_manager import (
     ResourceNotFoundException,
     StreamManagerClient,
 )
-from stream_manager.data import Message
+from stream_manager.data import Message, MessageStreamInfo
 
 logger = logging.getLogger("opc-archiver-component-logger")
 
@@ -19,7 +19,12 @@ logger = logging.getLogger("opc-archiver-component-logger")
 class AbstractStreamManager:
     """Base class for StreamManager use class"""
 
-    def __init__(self, stream_name: str, clear_stream: bool = False):
+    def __init__(
+        self,
+        stream_name: str,
+        clear_stream: bool = False,
+        client: StreamManagerClient = None,
+    ):
         """
         Parameters
         ----------
@@ -28,15 +33,22 @@ class AbstractStreamManager:
         clear_stream: bool
             Whether or not to clear an existing stream at runtime.
             (If a stream is deleted, all data currently in the queue will be deleted.)
+        client: StreamManagerClient
+            Client of StreamManager (a new `StreamManagerClient` if not specified,
+            e.g. `LocalStreamManagerClient` to run without Greengrass)
         """
         self._stream_name = stream_name
         self._clear_stream = clear_stream
         self._stream_created = False
-        self._client = StreamManagerClient()
+        self._client = client if client is not None else StreamManagerClient()
         self._newest_seq_num = None
 
         self.create_stream()
 
+    @property
+    def stream_name(self) -> str:
+        return self._stream_name
+
     def delete_stream(self, name: str = None) -> None:
         """Delete an existing stream
 
@@ -94,37 +106,57 @@ class AbstractStreamManager:
         # See: https://aws.github.io/aws-greengrass-core-sdk-python/_apidoc/greengrasssdk.stream_manager.streammanagerclient.html?highlight=append_message#greengrasssdk.stream_manager.streammanagerclient.StreamManagerClient.append_message
         self._client.append_message(self._stream_name, data)
 
-    def read_messages(self, sequence_number: int, max: int = None) -> List[Message]:
+    def read_messages(
+        self, sequence_number: int, max: int = None, read_timeout_millis: int = 0
+    ) -> List[Message]:
         """Obtains data after the specified sequence number from stored messages
 
-        Returns an empty array if there is no message stored
+        Returns an empty array if there is no message stored. Any other error of the
+        read is raised, so that the caller can tell it from an empty stream.
 
         Parameters
         ----------
         sequence_number: int
             Sequence number to retrieve
         max: int
-            Maximum number of messages to retrieve (all if not specified)
+            Maximum number of messages to retrieve (1 if not specified, as StreamManager)
+        read_timeout_millis: int
+            Time for the server to wait for a message when none is stored (in milliseconds).
+            0 returns immediately.
 
         Returns
         -------
         List[Message]
             Message array
+
+        Raises
+        ------
+        Exception
+            The read failed (e.g. StreamManager is not reachable)
         """
         try:
             msgs = self._client.read_messages(
                 self._stream_name,
                 ReadMessagesOptions(
-                    desired_start_sequence_number=sequence_number, max_message_count=max
+                    desired_start_sequence_number=sequence_number,
+                    max_message_count=max,
+                    read_timeout_millis=read_timeout_millis,
                 ),
             )
 
             return msgs
         except NotEnoughMessagesException as e:
             return []
-        except Exception as e:
-            logger.error(e)
-            return []
+
+    def get_storage_status(self) -> MessageStreamInfo.storageStatus:
+        """Get the storage status of the stream
+
+        Returns
+        -------
+        MessageStreamInfo.storageStatus
+            Oldest and newest sequence numbers and total size (in bytes) of the stream
+        """
+        return self._client.describe_message_stream(self._stream_name).storage_status
 
     def get_latest_sequence_number(self) -> int:
         """Get the latest message sequence number
@@ -0,0 +1,429 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import json
+import logging
+import os
+import shutil
+import time
+from threading import Condition, Thread
+from typing import Dict, List
+
+from stream.s3_stream import S3ExportStream
+from util.metrics import REGISTRY
+
+logger = logging.getLogger("opc-archiver-component-logger")
+
+# What to do when the files waiting for upload exceed their budget
+EVICTION_DROP_OLDEST = "drop_oldest"  # Delete the oldest files waiting for upload
+EVICTION_DOWNSAMPLE = "downsample"  # Delete the oldest raw segments, keep the rollups
+EVICTION_REFUSE = "refuse"  # Stop reading the OPC stream until the backlog drains
+EVICTION_POLICIES = [EVICTION_DROP_OLDEST, EVICTION_DOWNSAMPLE, EVICTION_REFUSE]
+
+# Kinds of archived files
+KIND_SEGMENT = "segment"
+KIND_ROLLUP = "rollup"
+KIND_DICTIONARY = "dictionary"  # Never evicted, needed to decompress the segments
+
+DEFAULT_UPLOAD_MAX_IN_FLIGHT = 4
+DEFAULT_UPLOAD_FRESH_AGE_SEC = 300
+# Exports of a file given up before it is moved to the dead-letter directory
+DEFAULT_UPLOAD_MAX_ATTEMPTS = 5
+# Dead-letter directory of the files the export gave up, in the archive directory
+DEAD_LETTER_DIR_NAME = "failed"
+# Fresh files appended to the export stream before each file of the backlog
+DRAIN_FRESH_PER_BACKLOG = 3
+# Interval to check the files uploaded (sec)
+DRAIN_INTERVAL = 0.5
+
+# Export task of a file waiting for upload, saved next to it as `.{basename}.task.json`
+TASK_EXTENSION = ".task.json"
+
+BACKLOG_FILES = REGISTRY.gauge(
+    "opc_archive_backlog_files", "Files waiting to be appended to the export stream"
+)
+BACKLOG_BYTES = REGISTRY.gauge(
+    "opc_archive_backlog_bytes", "Size of the files waiting to be appended"
+)
+ARCHIVE_USAGE = REGISTRY.gauge(
+    "opc_archive_usage_bytes",
+    "Size of the files waiting for upload or being uploaded (counted in the budget)",
+)
+EVICTED_FILES = REGISTRY.counter(
+    "opc_archive_evicted_files_total", "Files deleted to keep the archive in budget"
+)
+EVICTED_BYTES = REGISTRY.counter(
+    "opc_archive_evicted_bytes_total", "Bytes deleted to keep the archive in budget"
+)
+REQUEUED_FILES = REGISTRY.counter(
+    "opc_archive_requeued_files_total", "Files given up by the export and queued again"
+)
+DEAD_LETTER_FILES = REGISTRY.counter(
+    "opc_archive_dead_letter_files_total",
+    "Files given up by the export too many times, moved to the dead-letter directory",
+)
+
+
+class _BacklogItem:
+    """File of the archive directory waiting to be appended to the export stream"""
+
+    def __init__(
+        self,
+        path: str,
+        key: str,
+        user_metadata: dict,
+        kind: str,
+        submitted_at: float,
+        bucket: str = None,
+        attempts: int = 0,
+    ):
+        self.path = path
+        self.key = key
+        self.bucket = bucket
+        self.user_metadata = user_metadata
+        self.kind = kind
+        self.submitted_at = submitted_at
+        self.attempts = attempts  # Exports given up
+        self.size = os.path.getsize(path)
+
+    @property
+    def task_path(self) -> str:
+        directory, basename = os.path.split(self.path)
+        return os.path.join(directory, f".{basename}{TASK_EXTENSION}")
+
+    def to_dict(self) -> dict:
+        return {
+            "key": self.key,
+            "bucket": self.bucket,
+            "user_metadata": self.user_metadata,
+            "kind": self.kind,
+            "submitted_at": self.submitted_at,
+            "attempts": self.attempts,
+        }
+
+
+class BacklogManager(Thread):
+    """
+    Store-and-forward queue of the archived files in front of the S3 export stream
+
+    Files are kept in the archive directory and only a few of them are appended to
+    the export stream at a time, since Stream Manager uploads them in order. Files
+    submitted within `fresh_age_sec` are appended first, interleaved with the backlog
+    (older files, e.g. left by an outage) drained newest-first, so that current data
+    is uploaded within a bounded delay while the backlog catches up.
+
+    The export task of each queued file is saved next to it, so the backlog survives
+    restarts. When the files queued or being uploaded exceed `max_bytes`, files waiting
+    for upload are deleted or the reader is held back, depending on the eviction
+    policy. The files already uploaded and kept (`delete_moved_file` disabled) are
+    not counted.
+
+    A file given up by the export is queued again, and moved to the `failed`
+    directory of the archive directory once it was given up `max_upload_attempts` times.
+    """
+
+    def __init__(
+        self,
+        stream: S3ExportStream,
+        archive_dir: str,
+        max_bytes: int = 0,
+        eviction_policy: str = EVICTION_DROP_OLDEST,
+        max_in_flight: int = DEFAULT_UPLOAD_MAX_IN_FLIGHT,
+        fresh_age_sec: int = DEFAULT_UPLOAD_FRESH_AGE_SEC,
+        delete_moved_file: bool = True,
+        max_upload_attempts: int = DEFAULT_UPLOAD_MAX_ATTEMPTS,
+    ):
+        """
+        Parameters
+        ----------
+        stream: S3ExportStream
+            Stream to export the files to S3
+        archive_dir: str
+            Directory of the archived files
+        max_bytes: int
+            Budget of the files queued or being uploaded (in bytes, 0 for no limit)
+        eviction_policy: str
+            What to do when the budget is exceeded (see `EVICTION_POLICIES`)
+        max_in_flight: int
+            Number of files appended to the export stream and not uploaded yet
+        fresh_age_sec: int
+            Age under which a file is uploaded ahead of the backlog (in seconds)
+        delete_moved_file: bool
+            Whether uploaded files are deleted (a file left after its export is queued again)
+        max_upload_attempts: int
+            Exports of a file given up before it is moved to the dead-letter directory
+        """
+        Thread.__init__(self)
+
+        self._stream = stream
+        self._archive_dir = archive_dir
+        self._max_bytes = max_bytes
+        self._eviction_policy = eviction_policy
+        self._max_in_flight = max_in_flight
+        self._fresh_age_sec = fresh_age_sec
+        self._delete_moved_file = delete_moved_file
+        self._max_upload_attempts = max_upload_attempts
+        self._dead_letter_dir = os.path.join(archive_dir, DEAD_LETTER_DIR_NAME)
+        self._condition = Condition()
+        self._queue: List[_BacklogItem] = []
+        self._in_flight: Dict[str, _BacklogItem] = {}  # URL of the export task -> item
+        self._fresh_streak = 0
+        self._usage_bytes = 0
+        self._stopped = False
+        self.setDaemon(True)
+
+        try:
+            os.makedirs(self._archive_dir)
+        except FileExistsError as e:
+            pass
+
+        self._load()
+
+    @property
+    def accepting(self) -> bool:
+        """False while the files waiting for upload exceed their budget with the
+        `refuse` policy"""
+        return not (self._eviction_policy == EVICTION_REFUSE and self._over_budget())
+
+    def submit(
+        self,
+        path: str,
+        key: str,
+        user_metadata: dict = None,
+        kind: str = KIND_SEGMENT,
+        bucket: str = None,
+    ) -> None:
+        """
+        Queue a file of the archive directory for upload
+
+        Parameters
+        ----------
+        path: str
+            Path of the file in the archive directory
+        key: str
+            Upload destination key
+        user_metadata: dict
+            User metadata of the S3 object
+        kind: str
+            Kind of the file (`KIND_SEGMENT`, `KIND_ROLLUP` or `KIND_DICTIONARY`)
+        bucket: str
+            Upload destination bucket (the bucket of the export stream if not specified)
+        """
+        item = _BacklogItem(path, key, user_metadata, kind, time.time(), bucket)
+        self._write_task(item)
+
+        with self._condition:
+            self._queue = [queued for queued in self._queue if queued.path != path]
+            self._queue.append(item)
+            self._usage_bytes = self._backlog_bytes()
+            self._evict()
+            self._update_metrics()
+            self._condition.notify()
+
+    def run(self):
+        while True:
+            with self._condition:
+                if self._stopped:
+                    break
+
+                self._reap()
+                items = []
+                while len(self._in_flight) + len(items) < self._max_in_flight:
+                    item = self._next_item()
+                    if item is None:
+                        break
+                    items.append(item)
+
+            for item in items:
+                self._append(item)
+
+            with self._condition:
+                if not self._stopped:
+                    self._condition.wait(DRAIN_INTERVAL)
+
+    def stop(self) -> None:
+        """Stop appending files, the queued ones are appended after the next start"""
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+        self.join()
+
+    def _load(self) -> None:
+        """Queue the files left waiting for upload by a previous run"""
+        for entry in os.scandir(self._archive_dir):
+            if not (entry.name.startswith(".") and entry.name.endswith(TASK_EXTENSION)):
+                continue
+
+            path = os.path.join(self._archive_dir, entry.name[1 : -len(TASK_EXTENSION)])
+            try:
+                with open(entry.path, "r") as f:
+                    task = json.load(f)
+                self._queue.append(
+                    _BacklogItem(
+                        path,
+                        task["key"],
+                        task.get("user_metadata"),
+                        task.get("kind", KIND_SEGMENT),
+                        task["submitted_at"],
+                        task.get("bucket"),
+                        task.get("attempts", 0),
+                    )
+                )
+            except (OSError, ValueError, KeyError) as e:
+                logger.warning(f"ignore the export task {entry.path}: {e}")
+                os.remove(entry.path)
+
+        if len(self._queue) > 0:
+            logger.info(f"{len(self._queue)} files left waiting for upload")
+
+        self._usage_bytes = self._backlog_bytes()
+        self._update_metrics()
+
+    def _write_task(self, item: _BacklogItem) -> None:
+        temp_path = f"{item.task_path}.tmp"
+        with open(temp_path, "w") as f:
+            json.dump(item.to_dict(), f)
+        os.replace(temp_path, item.task_path)
+
+    def _next_item(self) -> _BacklogItem:
+        """Take the next file to append: dictionaries, then fresh files interleaved
+        with the backlog, newest first"""
+        if len(self._queue) == 0:
+            return None
+
+        dictionaries = [item for item in self._queue if item.kind == KIND_DICTIONARY]
+        if len(dictionaries) > 0:
+            item = dictionaries[0]
+        else:
+            fresh_since = time.time() - self._fresh_age_sec
+            fresh = [item for item in self._queue if item.submitted_at >= fresh_since]
+            backlog = [item for item in self._queue if item.submitted_at < fresh_since]
+            if len(fresh) > 0 and (
+                len(backlog) == 0 or self._fresh_streak < DRAIN_FRESH_PER_BACKLOG
+            ):
+                item = min(fresh, key=lambda item: item.submitted_at)
+                self._fresh_streak += 1
+            else:
+                item = max(backlog, key=lambda item: item.submitted_at)
+                self._fresh_streak = 0
+
+        self._queue.remove(item)
+        return item
+
+    def _append(self, item: _BacklogItem) -> None:
+        try:
+            input_url = self._stream.append_message(
+                item.path, item.key, item.user_metadata, item.bucket
+            )
+        except Exception as e:
+            logger.warning(f"failed to append {item.path} to the export stream: {e}")
+            with self._condition:
+                self._queue.append(item)
+            return
+
+        with self._condition:
+            self._in_flight[input_url] = item
+            self._update_metrics()
+        try:
+            os.remove(item.task_path)
+        except FileNotFoundError as e:
+            pass
+
+    def _reap(self) -> None:
+        """Release the files uploaded (or given up) by the export"""
+        if len(self._in_flight) == 0:
+            return
+
+        in_flight = self._stream.in_flight()
+        done = [url for url in self._in_flight if url not in in_flight]
+        for url in done:
+            item = self._in_flight.pop(url)
+            if self._delete_moved_file and os.path.exists(item.path):
+                # Retries exhausted or canceled, kept until it can be uploaded
+                item.attempts += 1
+                if item.attempts >= self._max_upload_attempts:
+                    self._dead_letter(item)
+                    continue
+                logger.warning(
+                    f"{item.path} was not uploaded ({item.attempts} attempts), queued again"
+                )
+                self._write_task(item)
+                self._queue.append(item)
+                REQUEUED_FILES.inc()
+
+        if len(done) > 0:
+            self._usage_bytes = self._backlog_bytes()
+            self._update_metrics()
+
+    def _dead_letter(self, item: _BacklogItem) -> None:
+        """Move a file the export keeps giving up to the dead-letter directory, with
+        its export task"""
+        os.makedirs(self._dead_letter_dir, exist_ok=True)
+        path = os.path.join(self._dead_letter_dir, os.path.basename(item.path))
+        logger.error(
+            f"{item.path} was not uploaded after {item.attempts} attempts, moved to {path}"
+        )
+        try:
+            shutil.move(item.path, path)
+            item.path = path
+            self._write_task(item)
+        except OSError as e:
+            logger.error(f"failed to move {item.path} to {self._dead_letter_dir}: {e}")
+        DEAD_LETTER_FILES.inc()
+
+    def _evict(self) -> None:
+        """Delete files waiting for upload until the backlog is back in budget"""
+        if not self._over_budget() or self._eviction_policy == EVICTION_REFUSE:
+            return
+
+        candidates = [item for item in self._queue if item.kind != KIND_DICTIONARY]
+        if self._eviction_policy == EVICTION_DOWNSAMPLE:
+            # The rollups summarize the raw segments, so the raw values go first
+            candidates.sort(
+                key=lambda item: (item.kind == KIND_ROLLUP, item.submitted_at)
+            )
+        else:
+            candidates.sort(key=lambda item: item.submitted_at)
+
+        evicted_files = 0
+        evicted_bytes = 0
+        for item in candidates:
+            if not self._over_budget():
+                break
+
+            for path in [item.path, item.task_path]:
+                try:
+                    os.remove(path)
+                except FileNotFoundError as e:
+                    pass
+            self._queue.remove(item)
+            self._usage_bytes -= item.size
+            evicted_files += 1
+            evicted_bytes += item.size
+
+        if evicted_files > 0:
+            EVICTED_FILES.inc(evicted_files)
+            EVICTED_BYTES.inc(evicted_bytes)
+            logger.warning(
+                f"backlog over its budget of {self._max_bytes} bytes, "
+                f"{evicted_files} files ({evicted_bytes} bytes) waiting for upload deleted"
+            )
+        if self._over_budget():
+            logger.warning(
+                f"backlog over its budget of {self._max_bytes} bytes "
+                f"({self._usage_bytes} bytes) with nothing left to delete"
+            )
+
+    def _over_budget(self) -> bool:
+        return self._max_bytes > 0 and self._usage_bytes > self._max_bytes
+
+    def _backlog_bytes(self) -> int:
+        """Size of the files queued and in flight (not the files uploaded and kept)"""
+        return sum(item.size for item in self._queue) + sum(
+            item.size for item in self._in_flight.values()
+        )
+
+    def _update_metrics(self) -> None:
+        BACKLOG_FILES.set(len(self._queue))
+        BACKLOG_BYTES.set(sum(item.size for item in self._queue))
+        ARCHIVE_USAGE.set(self._usage_bytes)
@@ -4,7 +4,11 @@
 import logging
 
 from stream.abstract_streammanager import AbstractStreamManager
-from stream_manager import MessageStreamDefinition, StrategyOnFull
+from stream_manager import (
+    MessageStreamDefinition,
+    StrategyOnFull,
+    StreamManagerClient,
+)
 
 logger = logging.getLogger("opc-archiver-component-logger")
 
@@ -19,6 +23,7 @@ class OPCStream(AbstractStreamManager):
         stream_name: str,
         clear_stream: bool = False,
         stream_max_size: int = DEFAULT_STREAM_MAX_SIZE,
+        client: StreamManagerClient = None,
     ):
         """
         Parameters
@@ -30,10 +35,16 @@ class OPCStream(AbstractStreamManager):
             (If a stream is deleted, all data currently stored in the queue will be deleted.)
         stream_max_size: int
             Maximum size of the stream (in bytes)
+        client: StreamManagerClient
+            Client of StreamManager (a new one if not specified)
         """
         self._stream_max_size = stream_max_size
 
-        super(OPCStream, self).__init__(stream_name, clear_stream)
+        super(OPCStream, self).__init__(stream_name, clear_stream, client)
+
+    @property
+    def stream_max_size(self) -> int:
+        return self._stream_max_size
 
     def get_stream_definition(self) -> MessageStreamDefinition:
         """Returns stream definition information
@@ -5,7 +5,7 @@ import logging
 import os
 import platform
 import time
-from threading import Thread
+from threading import Lock, Thread
 
 from stream.abstract_streammanager import AbstractStreamManager
 from stream_manager import (
@@ -24,17 +24,32 @@ from stream_manager import (
     StreamManagerException,
 )
 from stream_manager.util import Util
-from util.shadow import ShadowController
+from util.checkpoint import (
+    DEFAULT_CHECKPOINT_DIR,
+    DEFAULT_CHECKPOINT_SYNC_INTERVAL_SEC,
+    CheckpointStore,
+)
+from util.metrics import REGISTRY
 
 logger = logging.getLogger("opc-archiver-component-logger")
 
 TIMEOUT = 10
 UPLOAD_MAX_RETRY_COUNT = 3
 UPLOAD_CHECK_INTERVAL = 3
+# Number of export statuses read at one time
+UPLOAD_CHECK_BATCH_SIZE = 100
 
 FILE_SEQUENCE_SHADOW_NAME = "file_upload_sequence_number"
 FILE_SEQUENCE_PROP_NAME = "next_sequence_number"
 
+# Upper bounds of the upload latency buckets (seconds)
+UPLOAD_LATENCY_BUCKETS = (1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+UPLOAD_LATENCY = REGISTRY.histogram(
+    "s3_export_upload_latency_seconds",
+    "Time from the hand-off of a file to its successful upload",
+    buckets=UPLOAD_LATENCY_BUCKETS,
+)
+
 
 class UploadCheckThread(Thread):
     """
@@ -48,6 +63,9 @@ class UploadCheckThread(Thread):
         clear_stream: bool,
         delete_moved_file: bool,
         retry_count: int = UPLOAD_MAX_RETRY_COUNT,
+        checkpoint_dir: str = DEFAULT_CHECKPOINT_DIR,
+        checkpoint_sync_interval_sec: int = DEFAULT_CHECKPOINT_SYNC_INTERVAL_SEC,
+        client: StreamManagerClient = None,
     ):
         """
         Parameters
@@ -63,24 +81,42 @@ class UploadCheckThread(Thread):
             Whether or not to delete exported files
         retry_count: int
             Number of retries in case of export errors
+        checkpoint_dir: str
+            Directory of the local journal of the status stream read position
+        checkpoint_sync_interval_sec: int
+            Interval to sync the read position to the shadow (in seconds)
+        client: StreamManagerClient
+            Client of StreamManager (a new one if not specified)
         """
         Thread.__init__(self)
 
         self._file_url_separator = ":///" if platform.system() == "Windows" else ":"
         self.stream_name = stream_name
         self.status_stream_name = status_stream_name
-        self._shadow = ShadowController(FILE_SEQUENCE_SHADOW_NAME)
-        self.client = StreamManagerClient()
+        self._checkpoint = CheckpointStore(
+            FILE_SEQUENCE_SHADOW_NAME, checkpoint_dir, checkpoint_sync_interval_sec
+        )
+        self.client = client if client is not None else StreamManagerClient()
         self.delete_moved_file = delete_moved_file
         self.retry_max_count = retry_count
         self.setDaemon(True)
+        self._appended_at = {}  # input url -> time appended to the export stream
+        self._appended_at_lock = Lock()
+        self._upload_counters = {
+            status: REGISTRY.counter(
+                "s3_export_uploads_total",
+                "Files exported to S3 by status",
+                {"status": status},
+            )
+            for status in ["success", "failure", "canceled"]
+        }
 
-        shadow_payload = self._shadow.get_thing_shadow_request()
-
-        if shadow_payload is None or clear_stream is True:
+        if clear_stream is True:
             self._next_sequence_number = 0
         else:
-            self._next_sequence_number = shadow_payload.get(FILE_SEQUENCE_PROP_NAME, 0)
+            self._next_sequence_number = self._checkpoint.get(
+                FILE_SEQUENCE_PROP_NAME, 0
+            )
 
         logger.info(
             f"sequence number of the file upload stream to start checking {self._next_sequence_number}"
@@ -96,6 +132,7 @@ class UploadCheckThread(Thread):
                     self.status_stream_name,
                     ReadMessagesOptions(
                         desired_start_sequence_number=self._next_sequence_number,
+                        max_message_count=UPLOAD_CHECK_BATCH_SIZE,
                         read_timeout_millis=1000,
                     ),
                 )
@@ -116,21 +153,21 @@ class UploadCheckThread(Thread):
                         logger.debug(
                             f"Successfully uploaded file at path: {target_file} to S3."
                         )
-                        self._next_sequence_number = (
-                            status_message.status_context.sequence_number + 1
-                        )
+                        self._upload_counters["success"].inc()
                         try:
                             if self.delete_moved_file:
                                 os.remove(target_file)
                         except FileNotFoundError as e:
                             logger.warning(e)
+                        # Forgotten once deleted, so a file left after its upload is a failure
+                        self._observe_latency(
+                            status_message.status_context.s3_export_task_definition.input_url
+                        )
 
                     elif status_message.status == Status.InProgress:
                         logger.debug("File upload is in Progress.")
-                        self._next_sequence_number = (
-                            status_message.status_context.sequence_number + 1
-                        )
                     elif status_message.status == Status.Failure:
+                        self._upload_counters["failure"].inc()
                         s3_export_task_definition = (
                             status_message.status_context.s3_export_task_definition
                         )
@@ -142,6 +179,7 @@ class UploadCheckThread(Thread):
                             logger.error(
                                 f"{target_file} has been sent to S3 more than the max number of times.: {status_message.message}"
                             )
+                            self._forget(s3_export_task_definition.input_url)
                         else:
                             logger.warn(
                                 f"Unable to upload file at path {target_file} to S3. Message: {status_message.message}"
@@ -150,33 +188,35 @@ class UploadCheckThread(Thread):
                                 input_url=s3_export_task_definition.input_url,
                                 bucket=s3_export_task_definition.bucket,
                                 key=s3_export_task_definition.key,
-                                user_metadata={"retry": retry_count + 1},
+                                user_metadata={
+                                    **(user_metadata or {}),
+                                    "retry": retry_count + 1,
+                                },
                             )
                             data = Util.validate_and_serialize_to_json_bytes(
                                 retry_task_definition
                             )
                             self.client.append_message(self.stream_name, data)
-
-                        self._next_sequence_number = (
-                            status_message.status_context.sequence_number + 1
-                        )
                     elif status_message.status == Status.Canceled:
                         logger.error(
                             f"{target_file} has been cancelled to be sent to S3. Message: {status_message.message}"
                         )
-
-                        self._next_sequence_number = (
-                            status_message.status_context.sequence_number + 1
+                        self._upload_counters["canceled"].inc()
+                        self._forget(
+                            status_message.status_context.s3_export_task_definition.input_url
                         )
 
-                    # Persist next_sequence_number
-                    self._shadow.update_thing_shadow_request(
+                    # Position in the status stream (not the sequence number of the export task)
+                    self._next_sequence_number = message.sequence_number + 1
+
+                # Persist next_sequence_number (synced to the shadow in the background)
+                # and read the next statuses right away, the read waits when there are none
+                if len(messages) > 0:
+                    self._checkpoint.update(
                         {FILE_SEQUENCE_PROP_NAME: self._next_sequence_number}
                     )
-
-                time.sleep(UPLOAD_CHECK_INTERVAL)
             except NotEnoughMessagesException as e:
-                time.sleep(UPLOAD_CHECK_INTERVAL)
+                # The read already waited for a status on the server
                 continue
             except StreamManagerException as e:
                 logger.exception(e)
@@ -185,6 +225,29 @@ class UploadCheckThread(Thread):
                 logger.exception(e)
                 time.sleep(UPLOAD_CHECK_INTERVAL)
 
+    def close(self) -> None:
+        """Sync the read position of the status stream to the shadow"""
+        self._checkpoint.close()
+
+    def mark_appended(self, input_url: str) -> None:
+        """Record when a file was handed off, to measure its upload latency"""
+        with self._appended_at_lock:
+            self._appended_at[input_url] = time.time()
+
+    def in_flight(self) -> set:
+        """URLs of the files handed off and not uploaded (or given up) yet"""
+        with self._appended_at_lock:
+            return set(self._appended_at)
+
+    def _observe_latency(self, input_url: str) -> None:
+        appended_at = self._forget(input_url)
+        if appended_at is not None:
+            UPLOAD_LATENCY.observe(time.time() - appended_at)
+
+    def _forget(self, input_url: str) -> float:
+        with self._appended_at_lock:
+            return self._appended_at.pop(input_url, None)
+
 
 class S3ExportStream(AbstractStreamManager):
     """Stream Manager stream operations with Export settings to S3"""
@@ -196,6 +259,9 @@ class S3ExportStream(AbstractStreamManager):
         clear_stream: bool = False,
         delete_moved_file: bool = True,
         retry_count: int = UPLOAD_MAX_RETRY_COUNT,
+        checkpoint_dir: str = DEFAULT_CHECKPOINT_DIR,
+        checkpoint_sync_interval_sec: int = DEFAULT_CHECKPOINT_SYNC_INTERVAL_SEC,
+        client: StreamManagerClient = None,
     ):
         """
         Parameters
@@ -211,13 +277,20 @@ class S3ExportStream(AbstractStreamManager):
             Whether or not to delete files already exported to S3
         retry_count: int
             Number of retries in case of export errors
+        checkpoint_dir: str
+            Directory of the local journal of the upload status read position
+        checkpoint_sync_interval_sec: int
+            Interval to sync the read position to the shadow (in seconds)
+        client: StreamManagerClient
+            Client of StreamManager (a new one if not specified, shared with the upload
+            check thread)
         """
         self.status_stream_name = stream_name + "_status"
         self.bucket = bucket
         self._file_url_prefix = (
             "file:///" if platform.system() == "Windows" else "file:"
         )
-        super(S3ExportStream, self).__init__(stream_name, clear_stream)
+        super(S3ExportStream, self).__init__(stream_name, clear_stream, client)
 
         # Create thread for deleting uploaded files
         self.upload_check_thread = UploadCheckThread(
@@ -226,6 +299,9 @@ class S3ExportStream(AbstractStreamManager):
             clear_stream,
             delete_moved_file,
             retry_count,
+            checkpoint_dir,
+            checkpoint_sync_interval_sec,
+            client,
         )
         self.upload_check_thread.start()
 
@@ -271,7 +347,17 @@ class S3ExportStream(AbstractStreamManager):
 
         return stream_definition
 
-    def append_message(self, local_file: str, key: str) -> None:
+    def close(self) -> None:
+        """Persist the upload status read position"""
+        self.upload_check_thread.close()
+
+    def in_flight(self) -> set:
+        """URLs of the files appended to the stream and not uploaded (or given up) yet"""
+        return self.upload_check_thread.in_flight()
+
+    def append_message(
+        self, local_file: str, key: str, user_metadata: dict = None, bucket: str = None
+    ) -> str:
         """Add a file to the stream to be uploaded to S3
 
         Parameters
@@ -280,14 +366,29 @@ class S3ExportStream(AbstractStreamManager):
             Local file path to upload to S3
         key: str
             Upload destination key
+        user_metadata: dict
+            User metadata of the S3 object
+        bucket: str
+            Upload destination bucket (the bucket of the stream if not specified)
+
+        Returns
+        -------
+        str
+            URL of the file in the export task
         """
         logger.debug("append %s to s3 export stream: %s" % (local_file, key))
 
         filepath = os.path.abspath(local_file)
         s3_export_task_definition = S3ExportTaskDefinition(
-            input_url=self._file_url_prefix + filepath, bucket=self.bucket, key=key
+            input_url=self._file_url_prefix + filepath,
+            bucket=bucket or self.bucket,
+            key=key,
+            user_metadata=user_metadata,
         )
 
         data = Util.validate_and_serialize_to_json_bytes(s3_export_task_definition)
 
+        self.upload_check_thread.mark_appended(s3_export_task_definition.input_url)
         super(S3ExportStream, self).append_message(data)
+
+        return s3_export_task_definition.input_url
@@ -0,0 +1,184 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import logging
+from threading import Event, Thread
+from typing import Any
+
+from stream.opc_stream import OPCStream
+from util.metrics import REGISTRY
+
+logger = logging.getLogger("opc-archiver-component-logger")
+
+# Interval to check the storage status of the stream (sec)
+STREAM_MONITOR_INTERVAL = 5
+
+# Number of messages to be read from the stream at one time (sized with the lag)
+STREAM_READ_MIN_SIZE = 1000
+STREAM_READ_MAX_SIZE = 50000
+STREAM_READ_CATCH_UP_MAX_SIZE = 200000
+# Upper bound of the size of messages read at one time (in bytes)
+STREAM_READ_MAX_BYTES = 32 * 1024 * 1024
+STREAM_READ_CATCH_UP_MAX_BYTES = 64 * 1024 * 1024
+
+# The reader catches up when the lag or the stream usage reaches a threshold,
+# and goes back to normal when both are below half of their threshold
+CATCH_UP_LAG_MESSAGES = 100000
+CATCH_UP_USAGE_RATIO = 0.5
+CATCH_UP_EXIT_RATIO = 0.5
+# Usage of the stream above which the oldest messages are about to be overwritten
+OVERWRITE_WARNING_USAGE_RATIO = 0.8
+
+
+class StreamMonitorThread(Thread):
+    """
+    Periodically checks the storage status of the OPC stream against the read position
+
+    The stream overwrites its oldest messages when it is full, so a reader falling behind
+    silently loses data. The monitor computes the lag (messages not read yet) and the
+    usage of the stream, sizes the reads with them and switches the reader into a
+    catch-up mode when they cross a threshold. In catch-up mode, the reads are larger
+    and the segments are compressed with the fastest level instead of the configured
+    one (the compression is not deferred, see `OpcStreamHandler.update_catch_up`).
+    """
+
+    def __init__(self, stream: OPCStream, next_sequence_number_getter: Any):
+        """
+        Parameters
+        ----------
+        stream: OPCStream
+            Stream to monitor
+        next_sequence_number_getter: Any
+            Returns the sequence number of the next message to be read
+        """
+        Thread.__init__(self)
+
+        self._stream = stream
+        self._next_sequence_number_getter = next_sequence_number_getter
+        self._stopped = Event()
+        self.setDaemon(True)
+
+        self.read_size = STREAM_READ_MIN_SIZE
+        self.catch_up = False
+        self.lag = 0
+        self.usage_ratio = 0.0
+        self.lost_sequence_numbers = 0
+
+        labels = {"stream": stream.stream_name}
+        self._lag_gauge = REGISTRY.gauge(
+            "opc_stream_lag_messages", "Messages of the OPC stream not read yet", labels
+        )
+        self._usage_gauge = REGISTRY.gauge(
+            "opc_stream_usage_ratio",
+            "Size of the OPC stream / its maximum size",
+            labels,
+        )
+        self._catch_up_gauge = REGISTRY.gauge(
+            "opc_stream_catch_up",
+            "1 while the reader is catching up with the OPC stream",
+            labels,
+        )
+        self._read_size_gauge = REGISTRY.gauge(
+            "opc_stream_read_size_messages",
+            "Number of messages read at one time",
+            labels,
+        )
+        self._lost_counter = REGISTRY.counter(
+            "opc_stream_lost_messages_total",
+            "Messages overwritten before being read",
+            labels,
+        )
+
+    def run(self):
+        while True:
+            try:
+                self.check()
+            except Exception as e:
+                logger.warning(f"failed to check the stream status: {e}")
+
+            if self._stopped.wait(STREAM_MONITOR_INTERVAL):
+                break
+
+    def stop(self) -> None:
+        self._stopped.set()
+
+    def check(self) -> None:
+        """Update the lag, catch-up mode and read size with the storage status of the stream"""
+        status = self._stream.get_storage_status()
+        if (
+            status.newest_sequence_number is None
+            or status.oldest_sequence_number is None
+        ):
+            return
+
+        next_sequence_number = self._next_sequence_number_getter()
+        self.lag = max(0, status.newest_sequence_number - next_sequence_number + 1)
+        self.usage_ratio = (status.total_bytes or 0) / self._stream.stream_max_size
+
+        if status.oldest_sequence_number > next_sequence_number:
+            logger.warning(
+                f"messages {next_sequence_number}-{status.oldest_sequence_number - 1} "
+                "have been overwritten before being read"
+            )
+        elif self.usage_ratio >= OVERWRITE_WARNING_USAGE_RATIO:
+            logger.warning(
+                f"the opc stream is {self.usage_ratio:.0%} full, "
+                f"the oldest messages will be overwritten (lag: {self.lag})"
+            )
+
+        if not self.catch_up and (
+            self.lag >= CATCH_UP_LAG_MESSAGES
+            or self.usage_ratio >= CATCH_UP_USAGE_RATIO
+        ):
+            self.catch_up = True
+            logger.info(
+                f"catch up with the opc stream (lag: {self.lag}, usage: {self.usage_ratio:.0%})"
+            )
+        elif (
+            self.catch_up
+            and self.lag < CATCH_UP_LAG_MESSAGES * CATCH_UP_EXIT_RATIO
+            and self.usage_ratio < CATCH_UP_USAGE_RATIO * CATCH_UP_EXIT_RATIO
+        ):
+            self.catch_up = False
+            logger.info(
+                f"caught up with the opc stream (lag: {self.lag}, usage: {self.usage_ratio:.0%})"
+            )
+
+        max_size, max_bytes = (
+            (STREAM_READ_CATCH_UP_MAX_SIZE, STREAM_READ_CATCH_UP_MAX_BYTES)
+            if self.catch_up
+            else (STREAM_READ_MAX_SIZE, STREAM_READ_MAX_BYTES)
+        )
+        stored_count = status.newest_sequence_number - status.oldest_sequence_number + 1
+        if stored_count > 0 and status.total_bytes:
+            average_size = max(1, status.total_bytes // stored_count)
+            max_size = min(max_size, max_bytes // average_size)
+
+        self.read_size = max(STREAM_READ_MIN_SIZE, min(self.lag, max_size))
+
+        self._lag_gauge.set(self.lag)
+        self._usage_gauge.set(self.usage_ratio)
+        self._catch_up_gauge.set(1 if self.catch_up else 0)
+        self._read_size_gauge.set(self.read_size)
+
+        logger.debug(
+            f"lag of {self._stream.stream_name}: {self.lag}, usage: {self.usage_ratio:.0%}, read size: {self.read_size}"
+        )
+
+    def record_gap(self, expected: int, actual: int) -> None:
+        """Record sequence numbers skipped by a read because they were overwritten
+
+        Parameters
+        ----------
+        expected: int
+            Sequence number that was requested
+        actual: int
+            Sequence number of the first message read
+        """
+        lost = actual - expected
+        self.lost_sequence_numbers += lost
+        self._lost_counter.inc(lost)
+        logger.error(
+            f"{lost} messages of the opc stream were lost ({expected}-{actual - 1}), "
+            f"{self.lost_sequence_numbers} in total"
+        )
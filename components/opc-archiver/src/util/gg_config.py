@@ -2,9 +2,35 @@
 # SPDX-License-Identifier: MIT-0
 
 import logging
+from typing import List
 
 from awsiot.greengrasscoreipc.clientv2 import GreengrassCoreIPCClientV2
 from cerberus import Validator
+from segment.compression import COMPRESSION_GZIP, COMPRESSION_ZSTD, COMPRESSIONS
+from segment.dictionary import (
+    DEFAULT_DICTIONARY_BUCKET_KEY_PREFIX,
+    DEFAULT_DICTIONARY_DIR,
+    DEFAULT_DICTIONARY_RETRAIN_INTERVAL_MIN,
+    DEFAULT_DICTIONARY_SIZE,
+)
+from segment.parquet_segment_writer import pa
+from segment.segment_writer import (
+    FLUSH_POLICIES,
+    FLUSH_POLICY_BATCH,
+    FSYNC_POLICIES,
+    FSYNC_POLICY_ROTATE,
+)
+from stream.backlog_manager import (
+    DEFAULT_UPLOAD_FRESH_AGE_SEC,
+    DEFAULT_UPLOAD_MAX_IN_FLIGHT,
+    EVICTION_DOWNSAMPLE,
+    EVICTION_DROP_OLDEST,
+    EVICTION_POLICIES,
+)
+from util.checkpoint import (
+    DEFAULT_CHECKPOINT_DIR,
+    DEFAULT_CHECKPOINT_SYNC_INTERVAL_SEC,
+)
 
 logger = logging.getLogger("opc-archiver-component-logger")
 
@@ -12,19 +38,69 @@ CONFIG_S3_BUCKET = "Bucket"
 CONFIG_BUCKET_KEY_PREFIX = "BucketPrefix"
 CONFIG_DELETE_MV_FILES = "DeleteMovedFiles"
 CONFIG_OPC_STREAM_NAME = "OpcStreamName"
+CONFIG_OPC_STREAM_NAMES = "OpcStreamNames"
 CONFIG_OPC_LOG_DIR = "OpcLogDir"
 CONFIG_OPC_LOG_NAME = "OpcLogName"
 CONFIG_OPC_LOG_INTERVAL_MIN = "OpcLogIntervalMin"
+CONFIG_OPC_LOG_MAX_BYTES = "OpcLogMaxBytes"
+CONFIG_OPC_LOG_MAX_MESSAGES = "OpcLogMaxMessages"
+CONFIG_OPC_LOG_ALIGN_DATA_HOUR = "OpcLogAlignDataHour"
+CONFIG_OPC_OUTPUT_FORMAT = "OpcOutputFormat"
+CONFIG_PARQUET_BUCKET_KEY_PREFIX = "ParquetBucketPrefix"
+CONFIG_PROCESSED_BUCKET = "ProcessedBucket"
+CONFIG_OPC_LOG_COMPRESSION = "OpcLogCompression"
+CONFIG_OPC_LOG_COMPRESSION_LEVEL = "OpcLogCompressionLevel"
+CONFIG_OPC_LOG_COMPRESSION_WORKERS = "OpcLogCompressionWorkers"
+CONFIG_OPC_LOG_COMPRESSION_DICTIONARY = "OpcLogCompressionDictionary"
+CONFIG_DICTIONARY_DIR = "DictionaryDir"
+CONFIG_DICTIONARY_SIZE = "DictionarySize"
+CONFIG_DICTIONARY_RETRAIN_INTERVAL_MIN = "DictionaryRetrainIntervalMin"
+CONFIG_DICTIONARY_BUCKET_KEY_PREFIX = "DictionaryBucketPrefix"
+CONFIG_OPC_LOG_FLUSH_POLICY = "OpcLogFlushPolicy"
+CONFIG_OPC_LOG_FSYNC_POLICY = "OpcLogFsyncPolicy"
 CONFIG_OPC_ARCHIVE_DIR = "OpcLogArchiveDir"
+CONFIG_OPC_ARCHIVE_MAX_BYTES = "OpcLogArchiveMaxBytes"
+CONFIG_OPC_ARCHIVE_EVICTION_POLICY = "OpcLogArchiveEvictionPolicy"
+CONFIG_UPLOAD_MAX_IN_FLIGHT = "UploadMaxInFlight"
+CONFIG_UPLOAD_FRESH_AGE_SEC = "UploadFreshAgeSec"
+CONFIG_DEADBAND_RULES = "DeadbandRules"
+CONFIG_ROLLUP_WINDOWS_SEC = "RollupWindowsSec"
+CONFIG_ROLLUP_BUCKET_KEY_PREFIX = "RollupBucketPrefix"
+CONFIG_CHECKPOINT_DIR = "CheckpointDir"
+CONFIG_CHECKPOINT_SYNC_INTERVAL_SEC = "CheckpointSyncIntervalSec"
+CONFIG_METRICS_PORT = "MetricsPort"
+CONFIG_METRICS_EMF_INTERVAL_SEC = "MetricsEmfIntervalSec"
 CONFIG_LOG_LEVEL = "LogLevel"
 
 DEFAULT_OPC_LOG_INTERVAL_MIN = 1
+# The processed format writes one object per tag and hour of each segment: a longer
+# rotation keeps the number of small objects down (e.g. 500 tags rotated every minute
+# make 500 objects per minute)
+DEFAULT_PROCESSED_LOG_INTERVAL_MIN = 15
+# The rows of a parquet segment are held in memory until it is rotated: the longer
+# rotation of the processed format is bounded by size as well
+DEFAULT_PROCESSED_LOG_MAX_BYTES = 64 * 1024 * 1024  # Payload bytes
+DEFAULT_PROCESSED_LOG_MAX_MESSAGES = 200000
 DEFAULT_OPC_ARCHIVE_TEMP_DIR = "./opclogs/archive/"
 DEFAULT_OPC_LOG_DIR = "./opclogs/"
 DEFAULT_OPC_LOG_NAME = "opc-log"
 DEFAULT_BUCKET_KEY_PREFIX = (
     "!{timestamp:YYYY}/!{timestamp:MM}/!{timestamp:dd}/!{timestamp:HH}"
 )
+# Parquet segments are kept apart from the JSON segments read by the `opc_raw` table
+DEFAULT_PARQUET_BUCKET_KEY_PREFIX = (
+    "parquet/!{timestamp:YYYY}/!{timestamp:MM}/!{timestamp:dd}/!{timestamp:HH}"
+)
+# Rollup segments are kept apart from the raw segments
+DEFAULT_ROLLUP_BUCKET_KEY_PREFIX = (
+    "rollup/!{timestamp:YYYY}/!{timestamp:MM}/!{timestamp:dd}/!{timestamp:HH}"
+)
+
+OUTPUT_FORMAT_JSONL = "jsonl"  # Compressed JSON lines of the SiteWise payloads
+OUTPUT_FORMAT_PARQUET = "parquet"  # Parquet with flattened property values
+# Parquet split by tag and hour in the layout of the `opc_processed` table
+OUTPUT_FORMAT_PROCESSED = "processed"
+OUTPUT_FORMATS = [OUTPUT_FORMAT_JSONL, OUTPUT_FORMAT_PARQUET, OUTPUT_FORMAT_PROCESSED]
 
 
 class GGConfig:
@@ -40,17 +116,174 @@ class GGConfig:
                 "default": DEFAULT_BUCKET_KEY_PREFIX,
             },
             CONFIG_DELETE_MV_FILES: {"type": "boolean", "default": True},
-            CONFIG_OPC_STREAM_NAME: {"type": "string", "required": True},
+            CONFIG_OPC_STREAM_NAME: {
+                "type": "string",
+                "nullable": True,
+                "default": None,
+            },
+            # Streams read by their own pipeline in addition to `OpcStreamName`
+            CONFIG_OPC_STREAM_NAMES: {
+                "type": "list",
+                "default": [],
+                "schema": {"type": "string", "empty": False},
+            },
             CONFIG_OPC_LOG_DIR: {"type": "string", "default": DEFAULT_OPC_LOG_DIR},
             CONFIG_OPC_LOG_NAME: {"type": "string", "default": DEFAULT_OPC_LOG_NAME},
             CONFIG_OPC_LOG_INTERVAL_MIN: {
                 "type": "integer",
-                "default": DEFAULT_OPC_LOG_INTERVAL_MIN,
+                "min": 1,
+                "default_setter": lambda document: (
+                    DEFAULT_PROCESSED_LOG_INTERVAL_MIN
+                    if document.get(CONFIG_OPC_OUTPUT_FORMAT) == OUTPUT_FORMAT_PROCESSED
+                    else DEFAULT_OPC_LOG_INTERVAL_MIN
+                ),
+            },
+            CONFIG_OPC_LOG_MAX_BYTES: {
+                "type": "integer",
+                "min": 0,
+                "default_setter": lambda document: (
+                    DEFAULT_PROCESSED_LOG_MAX_BYTES
+                    if document.get(CONFIG_OPC_OUTPUT_FORMAT) == OUTPUT_FORMAT_PROCESSED
+                    else 0
+                ),
+            },
+            CONFIG_OPC_LOG_MAX_MESSAGES: {
+                "type": "integer",
+                "min": 0,
+                "default_setter": lambda document: (
+                    DEFAULT_PROCESSED_LOG_MAX_MESSAGES
+                    if document.get(CONFIG_OPC_OUTPUT_FORMAT) == OUTPUT_FORMAT_PROCESSED
+                    else 0
+                ),
+            },
+            # One segment per hour of the sample timestamps, instead of the time of reading
+            CONFIG_OPC_LOG_ALIGN_DATA_HOUR: {"type": "boolean", "default": False},
+            CONFIG_OPC_OUTPUT_FORMAT: {
+                "type": "string",
+                "default": OUTPUT_FORMAT_JSONL,
+                "allowed": OUTPUT_FORMATS,
+            },
+            # Bucket of the `opc_processed` table (required by the processed output format)
+            CONFIG_PROCESSED_BUCKET: {
+                "type": "string",
+                "nullable": True,
+                "default": None,
+            },
+            CONFIG_PARQUET_BUCKET_KEY_PREFIX: {
+                "type": "string",
+                "default": DEFAULT_PARQUET_BUCKET_KEY_PREFIX,
+            },
+            CONFIG_OPC_LOG_COMPRESSION: {
+                "type": "string",
+                "default": COMPRESSION_GZIP,
+                "allowed": COMPRESSIONS,
+            },
+            CONFIG_OPC_LOG_COMPRESSION_LEVEL: {
+                "type": "integer",
+                "nullable": True,
+                "default": None,
+            },
+            CONFIG_OPC_LOG_COMPRESSION_WORKERS: {
+                "type": "integer",
+                "min": 0,
+                "default": 0,
+            },
+            CONFIG_OPC_LOG_COMPRESSION_DICTIONARY: {
+                "type": "boolean",
+                "default": False,
+            },
+            CONFIG_DICTIONARY_DIR: {
+                "type": "string",
+                "default": DEFAULT_DICTIONARY_DIR,
+            },
+            CONFIG_DICTIONARY_SIZE: {
+                "type": "integer",
+                "min": 1024,
+                "default": DEFAULT_DICTIONARY_SIZE,
+            },
+            CONFIG_DICTIONARY_RETRAIN_INTERVAL_MIN: {
+                "type": "integer",
+                "min": 1,
+                "default": DEFAULT_DICTIONARY_RETRAIN_INTERVAL_MIN,
+            },
+            CONFIG_DICTIONARY_BUCKET_KEY_PREFIX: {
+                "type": "string",
+                "default": DEFAULT_DICTIONARY_BUCKET_KEY_PREFIX,
+            },
+            CONFIG_OPC_LOG_FLUSH_POLICY: {
+                "type": "string",
+                "default": FLUSH_POLICY_BATCH,
+                "allowed": FLUSH_POLICIES,
+            },
+            CONFIG_OPC_LOG_FSYNC_POLICY: {
+                "type": "string",
+                "default": FSYNC_POLICY_ROTATE,
+                "allowed": FSYNC_POLICIES,
             },
             CONFIG_OPC_ARCHIVE_DIR: {
                 "type": "string",
                 "default": DEFAULT_OPC_ARCHIVE_TEMP_DIR,
             },
+            CONFIG_OPC_ARCHIVE_MAX_BYTES: {"type": "integer", "min": 0, "default": 0},
+            CONFIG_OPC_ARCHIVE_EVICTION_POLICY: {
+                "type": "string",
+                "default": EVICTION_DROP_OLDEST,
+                "allowed": EVICTION_POLICIES,
+            },
+            CONFIG_UPLOAD_MAX_IN_FLIGHT: {
+                "type": "integer",
+                "min": 1,
+                "default": DEFAULT_UPLOAD_MAX_IN_FLIGHT,
+            },
+            CONFIG_UPLOAD_FRESH_AGE_SEC: {
+                "type": "integer",
+                "min": 0,
+                "default": DEFAULT_UPLOAD_FRESH_AGE_SEC,
+            },
+            # [{"Pattern": "/Plant1/*", "Absolute": 0.5, "Percent": 1.0, "HeartbeatSec": 600}]
+            CONFIG_DEADBAND_RULES: {
+                "type": "list",
+                "default": [],
+                "schema": {
+                    "type": "dict",
+                    "schema": {
+                        "Pattern": {"type": "string", "required": True},
+                        "Absolute": {"type": "number", "min": 0, "default": 0},
+                        "Percent": {"type": "number", "min": 0, "default": 0},
+                        "HeartbeatSec": {"type": "integer", "min": 0, "default": 0},
+                    },
+                },
+            },
+            # e.g. [60, 3600] for minute and hour rollups
+            CONFIG_ROLLUP_WINDOWS_SEC: {
+                "type": "list",
+                "default": [],
+                "schema": {"type": "integer", "min": 1},
+            },
+            CONFIG_ROLLUP_BUCKET_KEY_PREFIX: {
+                "type": "string",
+                "default": DEFAULT_ROLLUP_BUCKET_KEY_PREFIX,
+            },
+            CONFIG_CHECKPOINT_DIR: {
+                "type": "string",
+                "default": DEFAULT_CHECKPOINT_DIR,
+            },
+            CONFIG_CHECKPOINT_SYNC_INTERVAL_SEC: {
+                "type": "integer",
+                "min": 0,
+                "default": DEFAULT_CHECKPOINT_SYNC_INTERVAL_SEC,
+            },
+            CONFIG_METRICS_PORT: {
+                "type": "integer",
+                "min": 0,
+                "max": 65535,
+                "default": 0,
+            },
+            CONFIG_METRICS_EMF_INTERVAL_SEC: {
+                "type": "integer",
+                "min": 0,
+                "default": 0,
+            },
             CONFIG_LOG_LEVEL: {
                 "type": "string",
                 "default": "info",
@@ -64,6 +297,43 @@ class GGConfig:
 
         if not self._validator.validate(self._config):
             raise Exception(f"Configuration validate error: {self._validator.errors}")
+        if len(self.opc_stream_names) == 0:
+            raise Exception(
+                f"Configuration validate error: {CONFIG_OPC_STREAM_NAME} "
+                f"or {CONFIG_OPC_STREAM_NAMES} is required"
+            )
+        if (
+            self.opc_output_format in [OUTPUT_FORMAT_PARQUET, OUTPUT_FORMAT_PROCESSED]
+            and pa is None
+        ):
+            raise Exception(
+                f"Configuration validate error: {CONFIG_OPC_OUTPUT_FORMAT} "
+                f"{self.opc_output_format} requires pyarrow (pip install pyarrow on the device)"
+            )
+        if (
+            self.opc_output_format == OUTPUT_FORMAT_PROCESSED
+            and not self.processed_bucket
+        ):
+            raise Exception(
+                f"Configuration validate error: {CONFIG_OPC_OUTPUT_FORMAT} "
+                f"{OUTPUT_FORMAT_PROCESSED} requires {CONFIG_PROCESSED_BUCKET}"
+            )
+        if (
+            self.opc_log_compression_dictionary
+            and self.opc_log_compression != COMPRESSION_ZSTD
+        ):
+            raise Exception(
+                f"Configuration validate error: {CONFIG_OPC_LOG_COMPRESSION_DICTIONARY} "
+                f"requires {CONFIG_OPC_LOG_COMPRESSION} {COMPRESSION_ZSTD}"
+            )
+        if (
+            self.opc_archive_eviction_policy == EVICTION_DOWNSAMPLE
+            and len(self.rollup_windows_sec) == 0
+        ):
+            raise Exception(
+                f"Configuration validate error: {CONFIG_OPC_ARCHIVE_EVICTION_POLICY} "
+                f"{EVICTION_DOWNSAMPLE} requires {CONFIG_ROLLUP_WINDOWS_SEC}"
+            )
 
     def component_configuration(self):
         """
@@ -96,6 +366,16 @@ class GGConfig:
     def opc_stream_name(self) -> str:
         return self._config[CONFIG_OPC_STREAM_NAME]
 
+    @property
+    def opc_stream_names(self) -> List[str]:
+        """`OpcStreamName` (if any) followed by the other streams of `OpcStreamNames`"""
+        names = [self.opc_stream_name] if self.opc_stream_name else []
+        for name in self._config[CONFIG_OPC_STREAM_NAMES]:
+            if name not in names:
+                names.append(name)
+
+        return names
+
     @property
     def opc_log_dir(self) -> str:
         return self._config[CONFIG_OPC_LOG_DIR]
@@ -108,10 +388,118 @@ class GGConfig:
     def opc_log_interval_min(self) -> int:
         return self._config[CONFIG_OPC_LOG_INTERVAL_MIN]
 
+    @property
+    def opc_log_max_bytes(self) -> int:
+        return self._config[CONFIG_OPC_LOG_MAX_BYTES]
+
+    @property
+    def opc_log_max_messages(self) -> int:
+        return self._config[CONFIG_OPC_LOG_MAX_MESSAGES]
+
+    @property
+    def opc_log_align_data_hour(self) -> bool:
+        return self._config[CONFIG_OPC_LOG_ALIGN_DATA_HOUR]
+
+    @property
+    def opc_output_format(self) -> str:
+        return self._config[CONFIG_OPC_OUTPUT_FORMAT]
+
+    @property
+    def processed_bucket(self) -> str:
+        return self._config[CONFIG_PROCESSED_BUCKET]
+
+    @property
+    def parquet_bucket_prefix(self) -> str:
+        return self._config[CONFIG_PARQUET_BUCKET_KEY_PREFIX]
+
+    @property
+    def opc_log_compression(self) -> str:
+        return self._config[CONFIG_OPC_LOG_COMPRESSION]
+
+    @property
+    def opc_log_compression_level(self) -> int:
+        return self._config[CONFIG_OPC_LOG_COMPRESSION_LEVEL]
+
+    @property
+    def opc_log_compression_workers(self) -> int:
+        return self._config[CONFIG_OPC_LOG_COMPRESSION_WORKERS]
+
+    @property
+    def opc_log_compression_dictionary(self) -> bool:
+        return self._config[CONFIG_OPC_LOG_COMPRESSION_DICTIONARY]
+
+    @property
+    def dictionary_dir(self) -> str:
+        return self._config[CONFIG_DICTIONARY_DIR]
+
+    @property
+    def dictionary_size(self) -> int:
+        return self._config[CONFIG_DICTIONARY_SIZE]
+
+    @property
+    def dictionary_retrain_interval_min(self) -> int:
+        return self._config[CONFIG_DICTIONARY_RETRAIN_INTERVAL_MIN]
+
+    @property
+    def dictionary_bucket_prefix(self) -> str:
+        return self._config[CONFIG_DICTIONARY_BUCKET_KEY_PREFIX]
+
+    @property
+    def opc_log_flush_policy(self) -> str:
+        return self._config[CONFIG_OPC_LOG_FLUSH_POLICY]
+
+    @property
+    def opc_log_fsync_policy(self) -> str:
+        return self._config[CONFIG_OPC_LOG_FSYNC_POLICY]
+
     @property
     def opc_archive_dir(self) -> str:
         return self._config[CONFIG_OPC_ARCHIVE_DIR]
 
+    @property
+    def opc_archive_max_bytes(self) -> int:
+        return self._config[CONFIG_OPC_ARCHIVE_MAX_BYTES]
+
+    @property
+    def opc_archive_eviction_policy(self) -> str:
+        return self._config[CONFIG_OPC_ARCHIVE_EVICTION_POLICY]
+
+    @property
+    def upload_max_in_flight(self) -> int:
+        return self._config[CONFIG_UPLOAD_MAX_IN_FLIGHT]
+
+    @property
+    def upload_fresh_age_sec(self) -> int:
+        return self._config[CONFIG_UPLOAD_FRESH_AGE_SEC]
+
+    @property
+    def deadband_rules(self) -> list:
+        return self._config[CONFIG_DEADBAND_RULES]
+
+    @property
+    def rollup_windows_sec(self) -> list:
+        return self._config[CONFIG_ROLLUP_WINDOWS_SEC]
+
+    @property
+    def rollup_bucket_prefix(self) -> str:
+        return self._config[CONFIG_ROLLUP_BUCKET_KEY_PREFIX]
+
+    @property
+    def checkpoint_dir(self) -> str:
+        return self._config[CONFIG_CHECKPOINT_DIR]
+
+    @property
+    def checkpoint_sync_interval_sec(self) -> int:
+        return self._config[CONFIG_CHECKPOINT_SYNC_INTERVAL_SEC]
+
+    @property
+    def metrics_port(self) -> int:
+        return self._config[CONFIG_METRICS_PORT]
+
+    @property
+    def metrics_emf_interval_sec(self) -> int:
+        return self._config[CONFIG_METRICS_EMF_INTERVAL_SEC]
+
     @property
     def log_level(self) -> str:
         return self._config[CONFIG_LOG_LEVEL]
@@ -0,0 +1,66 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import json
+from typing import Any, Iterator, Tuple
+
+# Value types of a SiteWise property value (`{"value": {"doubleValue": 1.0}}`)
+INTEGER_VALUE = "integerValue"
+DOUBLE_VALUE = "doubleValue"
+STRING_VALUE = "stringValue"
+BOOLEAN_VALUE = "booleanValue"
+VALUE_TYPES = [INTEGER_VALUE, DOUBLE_VALUE, STRING_VALUE, BOOLEAN_VALUE]
+
+NANOS_PER_SECOND = 1000000000
+
+
+def parse_payload(payload: bytes) -> dict:
+    """Parse a message appended by the SiteWise collector
+
+    A message is an entry of `{"propertyAlias": str, "propertyValues": [...]}`.
+
+    Parameters
+    ----------
+    payload: bytes
+        Message payload
+
+    Returns
+    -------
+    dict
+        Entry of the message
+    """
+    return json.loads(payload)
+
+
+def timestamp_ns(property_value: dict) -> int:
+    """Timestamp of a property value in nanoseconds since the epoch"""
+    timestamp = property_value.get("timestamp", {})
+    return timestamp.get("timeInSeconds", 0) * NANOS_PER_SECOND + timestamp.get(
+        "offsetInNanos", 0
+    )
+
+
+def iter_property_values(entry: dict) -> Iterator[Tuple[str, int, str, Any, str]]:
+    """Flatten the property values of an entry
+
+    Parameters
+    ----------
+    entry: dict
+        Entry of a message (see `parse_payload`)
+
+    Returns
+    -------
+    Iterator[Tuple[str, int, str, Any, str]]
+        (property alias, timestamp in nanoseconds, value type, value, quality)
+    """
+    alias = entry.get("propertyAlias")
+    for property_value in entry.get("propertyValues", []):
+        value = property_value.get("value", {})
+        value_type = next((t for t in VALUE_TYPES if t in value), None)
+        yield (
+            alias,
+            timestamp_ns(property_value),
+            value_type,
+            value.get(value_type) if value_type else None,
+            property_value.get("quality"),
+        )
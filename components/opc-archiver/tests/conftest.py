@@ -0,0 +1,260 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import gzip
+import json
+import os
+import sys
+import time
+from threading import Thread
+from typing import Any, Callable, Dict, List
+
+import pytest
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+)
+
+import util.checkpoint  # noqa: E402
+from opc_stream_archiver import OpcStreamHandler  # noqa: E402
+from stream.backlog_manager import BacklogManager  # noqa: E402
+from stream.opc_stream import OPCStream  # noqa: E402
+from stream.s3_stream import S3ExportStream  # noqa: E402
+from util.gg_config import GGConfig  # noqa: E402
+from util.local_client import METADATA_DIR, LocalStreamManagerClient  # noqa: E402
+
+BUCKET = "test-bucket"
+STREAM_NAME = "opc_test"
+
+# Time to wait for the pipeline to read or export the messages (sec)
+WAIT_TIMEOUT_SEC = 30
+WAIT_INTERVAL_SEC = 0.05
+
+
+class LocalShadows:
+    """Reported state of the shadows, kept across the restarts of a test"""
+
+    def __init__(self):
+        self.reported: Dict[str, dict] = {}
+        self.updates: Dict[str, int] = {}
+
+    def controller(self, shadow_name: str) -> "LocalShadowController":
+        return LocalShadowController(self, shadow_name)
+
+
+class LocalShadowController:
+    """In-memory stand-in for `ShadowController` (tests run without Greengrass IPC)"""
+
+    def __init__(self, shadows: LocalShadows, shadow_name: str):
+        self._shadows = shadows
+        self._shadow_name = shadow_name
+
+    def get_thing_shadow_request(self) -> dict:
+        return dict(self._shadows.reported.get(self._shadow_name, {}))
+
+    def update_thing_shadow_request(self, payload: dict) -> Any:
+        # Merged into the reported state, a null value deletes its key
+        reported = self._shadows.reported.setdefault(self._shadow_name, {})
+        reported.update(payload)
+        for key, value in payload.items():
+            if value is None:
+                del reported[key]
+        self._shadows.updates[self._shadow_name] = (
+            self._shadows.updates.get(self._shadow_name, 0) + 1
+        )
+        return {"state": {"reported": payload}}
+
+
+class LocalConfig(GGConfig):
+    """Component configuration given by the test instead of the recipe"""
+
+    def __init__(self, configuration: dict):
+        self._configuration = configuration
+        super(LocalConfig, self).__init__()
+
+    def component_configuration(self):
+        return self._configuration
+
+
+class Pipeline:
+    """OPC stream, backlog and S3 export of the component over `LocalStreamManagerClient`
+
+    The handler can be started and stopped several times over the same directories and
+    shadows, as the component is restarted on a device.
+    """
+
+    def __init__(
+        self, config: GGConfig, client: LocalStreamManagerClient, export_dir: str
+    ):
+        self.config = config
+        self.export_dir = export_dir
+        self.s3_stream = S3ExportStream(
+            f"{config.opc_stream_name}_s3_export",
+            config.bucket,
+            delete_moved_file=config.delete_moved_file,
+            checkpoint_dir=config.checkpoint_dir,
+            checkpoint_sync_interval_sec=config.checkpoint_sync_interval_sec,
+            client=client,
+        )
+        self.opc_stream = OPCStream(config.opc_stream_name, client=client)
+
+    def append(self, payloads: List[bytes]) -> None:
+        for payload in payloads:
+            self.opc_stream.append_message(payload)
+
+    def run(self, until_sequence_number: int) -> OpcStreamHandler:
+        """Archive the stream until a sequence number has been read, then stop the handler"""
+        # Segments are named after their start time to the second: a run started within
+        # the same second as the previous one would reuse the names of its segments
+        time.sleep(1 - time.time() % 1)
+        backlog = BacklogManager(
+            self.s3_stream,
+            self.config.opc_archive_dir,
+            delete_moved_file=self.config.delete_moved_file,
+        )
+        backlog.start()
+        handler = OpcStreamHandler(self.config, self.opc_stream, backlog)
+        thread = Thread(target=handler.start, daemon=True)
+        thread.start()
+        try:
+            wait_for(
+                lambda: handler.get_next_sequence_number() >= until_sequence_number
+            )
+        finally:
+            handler.stop()
+            thread.join(WAIT_TIMEOUT_SEC)
+            # The uploaded segments are deleted from the archive directory
+            wait_for(lambda: len(self.archived_files()) == 0)
+            backlog.stop()
+        return handler
+
+    def archived_files(self) -> List[str]:
+        """Files of the archive directory waiting for upload"""
+        archive_dir = self.config.opc_archive_dir
+        return [
+            name
+            for name in os.listdir(archive_dir)
+            if os.path.isfile(os.path.join(archive_dir, name))
+        ]
+
+    def exported(self) -> Dict[str, bytes]:
+        """Objects exported to the bucket (key -> content)"""
+        root = os.path.join(self.export_dir, self.config.bucket)
+        objects = {}
+        for directory, _, files in os.walk(root):
+            for name in files:
+                path = os.path.join(directory, name)
+                with open(path, "rb") as f:
+                    objects[os.path.relpath(path, root).replace(os.sep, "/")] = f.read()
+        return objects
+
+    def exported_metadata(self) -> Dict[str, dict]:
+        """User metadata of the objects exported to the bucket (key -> metadata)"""
+        metadata = {}
+        for key in self.exported():
+            path = os.path.join(self.export_dir, METADATA_DIR, self.config.bucket, key)
+            if os.path.exists(f"{path}.json"):
+                with open(f"{path}.json", "r") as f:
+                    metadata[key] = json.load(f)
+        return metadata
+
+    def exported_payloads(self) -> List[bytes]:
+        """Payloads of the exported segments, in the order of their keys"""
+        payloads = []
+        for key, content in sorted(self.exported().items()):
+            payloads.extend(gzip.decompress(content).splitlines())
+        return payloads
+
+    def close(self) -> None:
+        self.s3_stream.close()
+
+
+def wait_for(condition: Callable[[], bool], timeout_sec: float = WAIT_TIMEOUT_SEC):
+    """Wait until a condition is true (fails the test on timeout)"""
+    deadline = time.time() + timeout_sec
+    while not condition():
+        if time.time() > deadline:
+            raise TimeoutError("condition not met in time")
+        time.sleep(WAIT_INTERVAL_SEC)
+
+
+def payload(alias: str, timestamp_sec: float, value: Any, quality: str = "GOOD"):
+    """Message of the SiteWise collector with a single property value"""
+    if isinstance(value, bool):
+        typed = {"booleanValue": value}
+    elif isinstance(value, int):
+        typed = {"integerValue": value}
+    elif isinstance(value, float):
+        typed = {"doubleValue": value}
+    else:
+        typed = {"stringValue": value}
+    return json.dumps(
+        {
+            "propertyAlias": alias,
+            "propertyValues": [
+                {
+                    "value": typed,
+                    "timestamp": {
+                        "timeInSeconds": int(timestamp_sec),
+                        "offsetInNanos": int(timestamp_sec % 1 * 1e9),
+                    },
+                    "quality": quality,
+                }
+            ],
+        },
+        separators=(",", ":"),
+    ).encode()
+
+
+@pytest.fixture
+def shadows(monkeypatch) -> LocalShadows:
+    """Device shadows of the test, the checkpoints are synced to them"""
+    local_shadows = LocalShadows()
+    monkeypatch.setattr(util.checkpoint, "ShadowController", local_shadows.controller)
+    return local_shadows
+
+
+@pytest.fixture
+def make_config(tmp_path) -> Callable[..., GGConfig]:
+    """Component configuration in the temporary directory of the test"""
+
+    def make(**overrides) -> GGConfig:
+        return LocalConfig(
+            {
+                "Bucket": BUCKET,
+                "OpcStreamName": STREAM_NAME,
+                "OpcLogDir": os.path.join(str(tmp_path), "opclogs", ""),
+                "OpcLogArchiveDir": os.path.join(
+                    str(tmp_path), "opclogs", "archive", ""
+                ),
+                "CheckpointDir": os.path.join(str(tmp_path), "opclogs", "checkpoint"),
+                "DictionaryDir": os.path.join(str(tmp_path), "opclogs", "dictionary"),
+                "CheckpointSyncIntervalSec": 0,
+                **overrides,
+            }
+        )
+
+    return make
+
+
+@pytest.fixture
+def client(tmp_path):
+    """In-process Stream Manager, exporting to `{tmp_path}/s3/{bucket}`"""
+    local_client = LocalStreamManagerClient(os.path.join(str(tmp_path), "s3"))
+    yield local_client
+    local_client.close()
+
+
+@pytest.fixture
+def make_pipeline(tmp_path, client, shadows) -> Callable[[GGConfig], Pipeline]:
+    """Pipeline of the component over the in-process Stream Manager"""
+    pipelines = []
+
+    def make(config: GGConfig) -> Pipeline:
+        pipeline = Pipeline(config, client, os.path.join(str(tmp_path), "s3"))
+        pipelines.append(pipeline)
+        return pipeline
+
+    yield make
+    for pipeline in pipelines:
+        pipeline.close()
@@ -0,0 +1,62 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import json
+import os
+
+from conftest import wait_for
+from stream.backlog_manager import (
+    DEAD_LETTER_DIR_NAME,
+    DEAD_LETTER_FILES,
+    TASK_EXTENSION,
+    BacklogManager,
+)
+
+
+class GivingUpStream:
+    """Export stream stand-in whose tasks are given up as soon as they are appended"""
+
+    def __init__(self):
+        self.appended = []
+
+    def append_message(self, path, key, user_metadata=None, bucket=None) -> str:
+        self.appended.append(path)
+        return f"file://{path}#{len(self.appended)}"
+
+    def in_flight(self) -> set:
+        return set()
+
+
+def test_file_given_up_too_many_times_is_moved_to_the_dead_letter_directory(
+    tmp_path,
+):
+    archive_dir = os.path.join(str(tmp_path), "archive")
+    os.makedirs(archive_dir)
+    path = os.path.join(archive_dir, "opc-log.2023-11-14_22-59-00.gz")
+    with open(path, "wb") as f:
+        f.write(b"segment")
+    dead_letter_files = DEAD_LETTER_FILES.value
+
+    stream = GivingUpStream()
+    backlog = BacklogManager(stream, archive_dir, max_upload_attempts=3)
+    backlog.submit(path, "2023/11/14/22/opc-log.gz")
+    backlog.start()
+    dead_letter = os.path.join(archive_dir, DEAD_LETTER_DIR_NAME)
+    wait_for(lambda: os.path.exists(os.path.join(dead_letter, os.path.basename(path))))
+    backlog.stop()
+
+    assert len(stream.appended) == 3
+    assert not os.path.exists(path)
+    assert DEAD_LETTER_FILES.value == dead_letter_files + 1
+    with open(
+        os.path.join(dead_letter, f".{os.path.basename(path)}{TASK_EXTENSION}")
+    ) as f:
+        task = json.load(f)
+    assert task["key"] == "2023/11/14/22/opc-log.gz"
+    assert task["attempts"] == 3
+
+    # Not queued again after a restart
+    restarted = BacklogManager(stream, archive_dir)
+    restarted.start()
+    restarted.stop()
+    assert len(stream.appended) == 3
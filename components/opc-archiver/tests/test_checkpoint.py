@@ -0,0 +1,58 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+from conftest import wait_for
+from util.checkpoint import CheckpointStore
+
+SHADOW_NAME = "test_checkpoint"
+
+
+def test_updates_are_synced_on_the_interval(tmp_path, shadows):
+    checkpoint = CheckpointStore(SHADOW_NAME, str(tmp_path), 1)
+
+    checkpoint.update({"next_sequence_number": 5})
+    assert SHADOW_NAME not in shadows.reported
+
+    # Synced by the background thread, without any later update
+    wait_for(lambda: SHADOW_NAME in shadows.reported, timeout_sec=5)
+    assert shadows.reported[SHADOW_NAME] == {"next_sequence_number": 5}
+    checkpoint.close()
+
+
+def test_unchanged_checkpoint_is_not_synced_again(tmp_path, shadows):
+    checkpoint = CheckpointStore(SHADOW_NAME, str(tmp_path), 0)
+    checkpoint.update({"next_sequence_number": 5})
+
+    checkpoint.sync()
+    checkpoint.close()
+
+    assert shadows.updates[SHADOW_NAME] == 1
+
+
+def test_journal_ahead_of_the_shadow_wins(tmp_path, shadows):
+    checkpoint = CheckpointStore(SHADOW_NAME, str(tmp_path), 60)
+    checkpoint.update({"next_sequence_number": 7})
+    # Killed before the sync
+    shadows.reported[SHADOW_NAME] = {"next_sequence_number": 3}
+
+    restarted = CheckpointStore(SHADOW_NAME, str(tmp_path), 60)
+
+    assert restarted.get("next_sequence_number") == 7
+    assert shadows.reported[SHADOW_NAME] == {"next_sequence_number": 7}
+    checkpoint.close()
+    restarted.close()
+
+
+def test_local_keys_are_not_synced(tmp_path, shadows):
+    # Synced by a previous version
+    shadows.reported[SHADOW_NAME] = {"position": 3, "manifests": {"a.gz": [0, 2]}}
+    checkpoint = CheckpointStore(SHADOW_NAME, str(tmp_path), 0, ["manifests"])
+    assert checkpoint.get("manifests") is None
+
+    checkpoint.update({"position": 5, "manifests": {"b.gz": [3, 4]}})
+
+    assert shadows.reported[SHADOW_NAME] == {"position": 5}
+    restarted = CheckpointStore(SHADOW_NAME, str(tmp_path), 0, ["manifests"])
+    assert restarted.get("manifests") == {"b.gz": [3, 4]}
+    checkpoint.close()
+    restarted.close()
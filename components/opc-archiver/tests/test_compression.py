@@ -0,0 +1,70 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import gzip
+import io
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+import zstandard
+from segment.compression import (
+    COMPRESSION_GZIP,
+    COMPRESSION_ZSTD,
+    ParallelCompressedWriter,
+    compress_chunk,
+)
+
+DATA = b'{"propertyAlias":"/Plant1/T","propertyValues":[]}\n' * 20000
+
+
+@pytest.fixture
+def executor():
+    pool = ThreadPoolExecutor(max_workers=2)
+    yield pool
+    pool.shutdown()
+
+
+def test_flush_waits_for_the_chunks_being_compressed(executor):
+    fileobj = io.BytesIO()
+    writer = ParallelCompressedWriter(
+        fileobj, COMPRESSION_GZIP, 9, executor, 4, flush_waits=True
+    )
+
+    writer.write(DATA)
+    writer.write(DATA)
+    writer.flush()
+
+    assert gzip.decompress(fileobj.getvalue()) == DATA * 2
+
+
+def test_chunks_are_written_in_order(executor):
+    fileobj = io.BytesIO()
+    writer = ParallelCompressedWriter(fileobj, COMPRESSION_ZSTD, 3, executor, 1)
+    chunks = [DATA[:1000] + bytes([i]) for i in range(10)]
+
+    for chunk in chunks:
+        writer.write(chunk)
+    writer.close()
+
+    reader = zstandard.ZstdDecompressor().stream_reader(
+        io.BytesIO(fileobj.getvalue()), read_across_frames=True
+    )
+    assert reader.read() == b"".join(chunks)
+
+
+def test_compressor_of_a_worker_follows_the_dictionary():
+    samples = [
+        b'{"propertyAlias":"/Plant1/T%d","value":%d}' % (i, i) for i in range(1000)
+    ]
+    dictionary = zstandard.train_dictionary(1024, samples)
+
+    with_dictionary = compress_chunk(DATA, COMPRESSION_ZSTD, 3, dictionary)
+    without_dictionary = compress_chunk(DATA, COMPRESSION_ZSTD, 3)
+
+    decompressor = zstandard.ZstdDecompressor(dict_data=dictionary)
+    assert decompressor.decompress(with_dictionary) == DATA
+    assert zstandard.ZstdDecompressor().decompress(without_dictionary) == DATA
+    assert (
+        zstandard.get_frame_parameters(with_dictionary).dict_id == dictionary.dict_id()
+    )
+    assert zstandard.get_frame_parameters(without_dictionary).dict_id == 0
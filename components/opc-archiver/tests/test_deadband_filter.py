@@ -0,0 +1,97 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+from conftest import payload
+from message_filter.deadband_filter import DeadbandFilter, DeadbandRule
+from stream_manager.data import Message
+
+T0 = 1700000000
+
+
+def messages(*payloads) -> list:
+    return [
+        Message(stream_name="opc", sequence_number=i, payload=p)
+        for i, p in enumerate(payloads)
+    ]
+
+
+def kept(deadband_filter: DeadbandFilter, *payloads) -> list:
+    return [
+        message.sequence_number
+        for message in deadband_filter.filter(messages(*payloads))
+    ]
+
+
+def test_absolute_deadband_is_measured_from_the_last_archived_value():
+    deadband_filter = DeadbandFilter([DeadbandRule("/Plant1/*", absolute=1.0)])
+
+    assert kept(
+        deadband_filter,
+        payload("/Plant1/T", T0, 10.0),
+        payload("/Plant1/T", T0 + 1, 10.5),
+        payload("/Plant1/T", T0 + 2, 10.9),
+        payload("/Plant1/T", T0 + 3, 11.5),
+        payload("/Plant1/T", T0 + 4, 12.0),
+    ) == [0, 3]
+
+
+def test_percent_deadband():
+    deadband_filter = DeadbandFilter([DeadbandRule("*", percent=10)])
+
+    assert kept(
+        deadband_filter,
+        payload("/T", T0, 100.0),
+        payload("/T", T0 + 1, 109.0),
+        payload("/T", T0 + 2, 89.0),
+    ) == [0, 2]
+
+
+def test_repeated_values_are_archived_on_the_heartbeat():
+    deadband_filter = DeadbandFilter([DeadbandRule("*", heartbeat_sec=60)])
+
+    assert kept(
+        deadband_filter,
+        payload("/S", T0, "on"),
+        payload("/S", T0 + 30, "on"),
+        payload("/S", T0 + 60, "on"),
+        payload("/S", T0 + 61, "off"),
+    ) == [0, 2, 3]
+
+
+def test_quality_change_is_always_archived():
+    deadband_filter = DeadbandFilter([DeadbandRule("*", absolute=5.0)])
+
+    assert kept(
+        deadband_filter,
+        payload("/T", T0, 1.0),
+        payload("/T", T0 + 1, 1.0, quality="BAD"),
+        payload("/T", T0 + 2, 1.0, quality="BAD"),
+    ) == [0, 1]
+
+
+def test_state_is_kept_per_tag_across_batches():
+    deadband_filter = DeadbandFilter([DeadbandRule("/Plant1/*", absolute=1.0)])
+    kept(deadband_filter, payload("/Plant1/A", T0, 1.0), payload("/Plant1/B", T0, 5.0))
+
+    assert kept(
+        deadband_filter,
+        payload("/Plant1/A", T0 + 1, 1.5),
+        payload("/Plant1/B", T0 + 1, 7.0),
+        # Without a matching rule, always archived
+        payload("/Plant2/C", T0 + 1, 1.0),
+        payload("/Plant2/C", T0 + 2, 1.0),
+    ) == [1, 2, 3]
+
+
+def test_payloads_that_are_not_messages_are_archived():
+    deadband_filter = DeadbandFilter([DeadbandRule("*", absolute=1.0)])
+
+    assert kept(
+        deadband_filter,
+        b"not json",
+        b"[1, 2]",
+        b"42",
+        b'{"propertyAlias": "/T", "propertyValues": [1]}',
+        b'{"propertyAlias": "/T", "propertyValues": 1}',
+        payload("/T", T0, 1.0),
+    ) == [0, 1, 2, 3, 4, 5]
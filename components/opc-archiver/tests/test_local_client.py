@@ -0,0 +1,64 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import pytest
+from stream_manager import (
+    MessageStreamDefinition,
+    NotEnoughMessagesException,
+    ReadMessagesOptions,
+    StrategyOnFull,
+)
+
+STREAM_NAME = "test_stream"
+
+
+@pytest.fixture
+def stream(client):
+    client.create_message_stream(
+        MessageStreamDefinition(
+            name=STREAM_NAME,
+            max_size=100,
+            strategy_on_full=StrategyOnFull.OverwriteOldestData,
+        )
+    )
+    return client
+
+
+def test_read_returns_one_message_without_max_message_count(stream):
+    for i in range(5):
+        stream.append_message(STREAM_NAME, b"%d" % i)
+
+    # As StreamManager does when `max_message_count` is not set
+    messages = stream.read_messages(
+        STREAM_NAME, ReadMessagesOptions(desired_start_sequence_number=1)
+    )
+    assert [message.sequence_number for message in messages] == [1]
+
+    messages = stream.read_messages(
+        STREAM_NAME,
+        ReadMessagesOptions(desired_start_sequence_number=1, max_message_count=10),
+    )
+    assert [message.sequence_number for message in messages] == [1, 2, 3, 4]
+
+
+def test_oldest_messages_are_overwritten_when_full(stream):
+    for i in range(30):
+        stream.append_message(STREAM_NAME, b"0123456789")
+
+    messages = stream.read_messages(
+        STREAM_NAME, ReadMessagesOptions(max_message_count=100)
+    )
+
+    assert messages[0].sequence_number > 0
+    assert messages[-1].sequence_number == 29
+    assert sum(len(message.payload) for message in messages) <= 100
+
+
+def test_read_waits_for_the_minimum_count(stream):
+    stream.append_message(STREAM_NAME, b"a")
+
+    with pytest.raises(NotEnoughMessagesException):
+        stream.read_messages(
+            STREAM_NAME,
+            ReadMessagesOptions(min_message_count=2, read_timeout_millis=100),
+        )
@@ -0,0 +1,79 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import os
+
+from segment.manifest import SegmentManifest, SegmentManifestJournal
+from util.checkpoint import CheckpointStore
+
+SHADOW_NAME = "test_sequence_number"
+
+
+def create_journal(checkpoint_dir: str) -> SegmentManifestJournal:
+    return SegmentManifestJournal(
+        CheckpointStore(
+            SHADOW_NAME, checkpoint_dir, 0, ["pending_segments", "committed_hours"]
+        ),
+        "next_sequence_number",
+        "pending_segments",
+        "committed_hours",
+    )
+
+
+def test_commit_moves_the_position_past_the_segment(tmp_path, shadows):
+    journal = create_journal(str(tmp_path))
+
+    journal.commit(SegmentManifest("a.gz", 0, 9, 10, 100, "sha-a"))
+    journal.commit(SegmentManifest("b.gz", 10, 14, 5, 50, "sha-b"))
+
+    assert journal.next_sequence_number == 15
+    assert [manifest.name for manifest in journal.pending()] == ["a.gz", "b.gz"]
+    assert journal.get("b.gz").sha256 == "sha-b"
+
+
+def test_handed_off_segments_are_not_pending(tmp_path, shadows):
+    journal = create_journal(str(tmp_path))
+    journal.commit(SegmentManifest("a.gz", 0, 9))
+    journal.commit(SegmentManifest("b.gz", 10, 14))
+
+    journal.handed_off("a.gz")
+
+    assert [manifest.name for manifest in journal.pending()] == ["b.gz"]
+    assert journal.get("a.gz") is None
+
+
+def test_range_without_segment_moves_the_position_only(tmp_path, shadows):
+    journal = create_journal(str(tmp_path))
+
+    # Every message of the range was filtered out
+    journal.commit(SegmentManifest(None, 0, 9))
+    journal.commit_position(12, {"2024010100": 20})
+
+    assert journal.next_sequence_number == 12
+    assert journal.pending() == []
+    assert journal.committed_hours() == {"2024010100": 20}
+
+
+def test_journal_survives_a_restart_without_the_shadow(tmp_path, shadows):
+    journal = create_journal(str(tmp_path))
+    journal.commit(SegmentManifest("a.gz", 0, 9, sha256="sha-a"), 5, {"2024010100": 9})
+    shadows.reported.clear()
+
+    restarted = create_journal(str(tmp_path))
+
+    assert restarted.next_sequence_number == 5
+    assert restarted.committed_hours() == {"2024010100": 9}
+    assert restarted.get("a.gz").last_sequence_number == 9
+
+
+def test_shadow_restores_the_position_of_a_lost_journal(tmp_path, shadows):
+    journal = create_journal(str(tmp_path))
+    journal.commit(SegmentManifest("a.gz", 0, 9), 10, {"2024010100": 9})
+    # Only the read position is synced to the shadow
+    assert shadows.reported[SHADOW_NAME] == {"next_sequence_number": 10}
+    os.remove(os.path.join(str(tmp_path), f"{SHADOW_NAME}.json"))
+
+    restarted = create_journal(str(tmp_path))
+
+    assert restarted.next_sequence_number == 10
+    assert restarted.pending() == []
@@ -0,0 +1,288 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import gzip
+import json
+import os
+import time
+
+import opc_stream_archiver
+import pytest
+from conftest import STREAM_NAME, payload
+from opc_stream_archiver import (
+    FAILED_DIR_NAME,
+    OPC_COMMITTED_HOURS_PROP_NAME,
+    OPC_NEXT_SEQUENCE_PROP_NAME,
+    OPC_PENDING_SEGMENTS_PROP_NAME,
+    OPC_SEQUENCE_SHADOW_NAME,
+    SegmentUploadThread,
+)
+from segment.abstract_segment_writer import RotationPolicy
+from segment.hourly_segment_writer import HourlySegmentWriter
+from segment.manifest import (
+    FIRST_SEQUENCE_NUMBER_METADATA_KEY,
+    LAST_SEQUENCE_NUMBER_METADATA_KEY,
+    SegmentManifestJournal,
+)
+from segment.segment_writer import SegmentWriter
+from util.checkpoint import CheckpointStore
+
+ALIAS = "/Plant1/Line1/Temperature"
+
+
+class SimulatedCrash(Exception):
+    """Stops a writer where the process would have been killed"""
+
+
+def create_journal(config) -> SegmentManifestJournal:
+    """Manifest journal of the stream of `OpcStreamName`, as opened by the handler"""
+    checkpoint = CheckpointStore(
+        OPC_SEQUENCE_SHADOW_NAME,
+        config.checkpoint_dir,
+        config.checkpoint_sync_interval_sec,
+        [OPC_PENDING_SEGMENTS_PROP_NAME, OPC_COMMITTED_HOURS_PROP_NAME],
+    )
+    return SegmentManifestJournal(
+        checkpoint,
+        OPC_NEXT_SEQUENCE_PROP_NAME,
+        OPC_PENDING_SEGMENTS_PROP_NAME,
+        OPC_COMMITTED_HOURS_PROP_NAME,
+    )
+
+
+def sequence_ranges(metadata: dict) -> list:
+    return sorted(
+        (
+            int(value[FIRST_SEQUENCE_NUMBER_METADATA_KEY]),
+            int(value[LAST_SEQUENCE_NUMBER_METADATA_KEY]),
+        )
+        for value in metadata.values()
+    )
+
+
+def test_restart_resumes_after_the_committed_segments(make_config, make_pipeline):
+    pipeline = make_pipeline(make_config(OpcLogMaxMessages=10))
+    payloads = [payload(ALIAS, 1700000000 + i, float(i)) for i in range(25)]
+
+    pipeline.append(payloads[:15])
+    pipeline.run(15)
+    pipeline.append(payloads[15:])
+    handler = pipeline.run(25)
+
+    assert handler.get_next_sequence_number() == 25
+    assert sorted(pipeline.exported_payloads()) == sorted(payloads)
+    # Each message is in the sequence range of exactly one segment
+    assert sequence_ranges(pipeline.exported_metadata()) == [(0, 9), (10, 14), (15, 24)]
+
+
+def test_failed_reads_are_retried_with_a_growing_wait(
+    make_config, make_pipeline, client, monkeypatch
+):
+    monkeypatch.setattr(opc_stream_archiver, "STREAM_READ_ERROR_WAIT_SEC", 0.1)
+    pipeline = make_pipeline(make_config())
+    pipeline.append([payload(ALIAS, 1700000000 + i, float(i)) for i in range(5)])
+    read_messages = client.read_messages
+    failed_at = []
+
+    def unavailable(stream_name, options=None):
+        if stream_name == STREAM_NAME and len(failed_at) < 4:
+            failed_at.append(time.monotonic())
+            raise ConnectionError("StreamManager is not reachable")
+        return read_messages(stream_name, options)
+
+    monkeypatch.setattr(client, "read_messages", unavailable)
+    handler = pipeline.run(5)
+
+    assert handler.get_next_sequence_number() == 5
+    waits = [end - start for start, end in zip(failed_at, failed_at[1:])]
+    assert waits[0] >= 0.1 and waits[1] >= 0.2 and waits[2] >= 0.4
+
+
+def test_segment_not_committed_before_a_crash_is_read_again(make_config, make_pipeline):
+    config = make_config()
+    pipeline = make_pipeline(config)
+    payloads = [payload(ALIAS, 1700000000 + i, float(i)) for i in range(20)]
+    pipeline.append(payloads)
+
+    # Killed while writing the active segment: the writer is never closed
+    journal = create_journal(config)
+    writer = SegmentWriter(
+        config.opc_log_dir,
+        config.opc_log_name,
+        RotationPolicy(60),
+        manifest_journal=journal,
+    )
+    messages = pipeline.opc_stream.read_messages(0, 12)
+    writer.write_batch(
+        [message.payload for message in messages],
+        [message.sequence_number for message in messages],
+    )
+    assert journal.next_sequence_number == 0
+
+    pipeline.run(20)
+
+    assert sorted(pipeline.exported_payloads()) == sorted(payloads)
+    assert sequence_ranges(pipeline.exported_metadata()) == [(0, 19)]
+
+
+def test_segment_committed_before_a_crash_is_handed_off_once(
+    make_config, make_pipeline, monkeypatch
+):
+    config = make_config()
+    pipeline = make_pipeline(config)
+    payloads = [payload(ALIAS, 1700000000 + i, float(i)) for i in range(20)]
+    pipeline.append(payloads)
+
+    # Killed after the commit of the segment, before its rename
+    journal = create_journal(config)
+    writer = SegmentWriter(
+        config.opc_log_dir,
+        config.opc_log_name,
+        RotationPolicy(60),
+        manifest_journal=journal,
+    )
+    messages = pipeline.opc_stream.read_messages(0, 12)
+    writer.write_batch(
+        [message.payload for message in messages],
+        [message.sequence_number for message in messages],
+    )
+    commit = journal.commit
+
+    def commit_and_crash(*args, **kwargs):
+        commit(*args, **kwargs)
+        raise SimulatedCrash()
+
+    monkeypatch.setattr(journal, "commit", commit_and_crash)
+    with pytest.raises(SimulatedCrash):
+        writer.rotate()
+    assert journal.next_sequence_number == 12
+    assert os.path.exists(f"{config.opc_log_dir}{config.opc_log_name}")
+
+    pipeline.run(20)
+
+    assert sorted(pipeline.exported_payloads()) == sorted(payloads)
+    assert sequence_ranges(pipeline.exported_metadata()) == [(0, 11), (12, 19)]
+
+
+def test_segment_renamed_before_a_crash_is_handed_off_once(make_config, make_pipeline):
+    config = make_config()
+    pipeline = make_pipeline(config)
+    payloads = [payload(ALIAS, 1700000000 + i, float(i)) for i in range(20)]
+    pipeline.append(payloads)
+
+    # Killed after the rename of the segment, before its hand-off
+    journal = create_journal(config)
+    writer = SegmentWriter(
+        config.opc_log_dir,
+        config.opc_log_name,
+        RotationPolicy(60),
+        manifest_journal=journal,
+    )
+    messages = pipeline.opc_stream.read_messages(0, 12)
+    writer.write_batch(
+        [message.payload for message in messages],
+        [message.sequence_number for message in messages],
+    )
+    writer.rotate()
+    assert len(journal.pending()) == 1
+
+    pipeline.run(20)
+
+    assert sorted(pipeline.exported_payloads()) == sorted(payloads)
+    assert sequence_ranges(pipeline.exported_metadata()) == [(0, 11), (12, 19)]
+
+
+def test_hours_committed_ahead_of_the_position_are_skipped_after_a_crash(
+    make_config, make_pipeline
+):
+    config = make_config(OpcLogAlignDataHour=True, OpcLogMaxMessages=3)
+    pipeline = make_pipeline(config)
+    # Alternates between two hours, so that the segments of one hour are committed
+    # while the other one is still open
+    hour = int(time.time()) // 3600 * 3600 - 3 * 3600
+    payloads = [payload(ALIAS, hour + (i % 2) * 3600 + i, float(i)) for i in range(14)]
+    pipeline.append(payloads)
+
+    journal = create_journal(config)
+    writer = HourlySegmentWriter(
+        config.opc_log_dir,
+        config.opc_log_name,
+        RotationPolicy(60, max_messages=3),
+        lambda data_hour, manifest_journal: SegmentWriter(
+            config.opc_log_dir,
+            config.opc_log_name,
+            RotationPolicy(60, max_messages=3),
+            manifest_journal=manifest_journal,
+            data_hour=data_hour,
+        ),
+        manifest_journal=journal,
+    )
+    messages = pipeline.opc_stream.read_messages(0, 10)
+    writer.write_batch(
+        [message.payload for message in messages],
+        [message.sequence_number for message in messages],
+    )
+    # Killed with a segment of each hour still open
+    committed_hours = journal.committed_hours()
+    assert len(committed_hours) > 0
+    assert all(
+        sequence_number >= journal.next_sequence_number
+        for sequence_number in committed_hours.values()
+    )
+
+    pipeline.run(14)
+
+    assert sorted(pipeline.exported_payloads()) == sorted(payloads)
+    # Each segment lands in the hour of its samples
+    hours = {
+        time.strftime("%Y/%m/%d/%H", time.gmtime(hour)),
+        time.strftime("%Y/%m/%d/%H", time.gmtime(hour + 3600)),
+    }
+    exported = pipeline.exported()
+    assert {key.rsplit("/", 1)[0] for key in exported} == hours
+    for key, content in exported.items():
+        for line in gzip.decompress(content).splitlines():
+            timestamp = json.loads(line)["propertyValues"][0]["timestamp"]
+            assert key.startswith(
+                time.strftime("%Y/%m/%d/%H", time.gmtime(timestamp["timeInSeconds"]))
+            )
+
+
+def test_segment_that_cannot_be_recovered_is_quarantined(
+    make_config, make_pipeline, monkeypatch
+):
+    config = make_config()
+    pipeline = make_pipeline(config)
+    payloads = [payload(ALIAS, 1700000000 + i, float(i)) for i in range(20)]
+    pipeline.append(payloads)
+
+    # Killed after the rename of a segment, next to a corrupted one
+    journal = create_journal(config)
+    writer = SegmentWriter(
+        config.opc_log_dir,
+        config.opc_log_name,
+        RotationPolicy(60),
+        manifest_journal=journal,
+    )
+    messages = pipeline.opc_stream.read_messages(0, 12)
+    writer.write_batch(
+        [message.payload for message in messages],
+        [message.sequence_number for message in messages],
+    )
+    writer.rotate()
+    corrupted_name = f"{config.opc_log_name}.2020-01-01_00-00.gz"
+    with open(os.path.join(config.opc_log_dir, corrupted_name), "wb") as f:
+        f.write(b"corrupted")
+    archive_segment = SegmentUploadThread.archive_segment
+
+    def archive_or_fail(self, path):
+        if os.path.basename(path) == corrupted_name:
+            raise OSError("unreadable segment")
+        archive_segment(self, path)
+
+    monkeypatch.setattr(SegmentUploadThread, "archive_segment", archive_or_fail)
+    pipeline.run(20)
+
+    assert sorted(pipeline.exported_payloads()) == sorted(payloads)
+    failed_dir = os.path.join(config.opc_log_dir, FAILED_DIR_NAME)
+    assert os.listdir(failed_dir) == [corrupted_name]
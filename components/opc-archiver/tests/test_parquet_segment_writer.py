@@ -0,0 +1,46 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import os
+
+import pyarrow.parquet as pq
+import pytest
+import util.gg_config
+from conftest import payload
+from segment.abstract_segment_writer import RotationPolicy
+from segment.parquet_segment_writer import MALFORMED_PAYLOADS, ParquetSegmentWriter
+
+
+def test_malformed_payloads_are_skipped(tmp_path):
+    rotated = []
+    writer = ParquetSegmentWriter(
+        os.path.join(str(tmp_path), ""),
+        "opc-log",
+        RotationPolicy(60),
+        rotated_callback=rotated.append,
+    )
+    malformed_payloads = MALFORMED_PAYLOADS.value
+
+    writer.write_batch(
+        [
+            payload("/Plant1/T", 1700000000, 1.5),
+            b"not json",
+            b"[1, 2]",
+            b"42",
+            b'{"propertyAlias": "/Plant1/T", "propertyValues": 1}',
+            payload("/Plant1/T", 1700000001, 2.5),
+        ]
+    )
+    writer.rotate()
+    writer.close()
+
+    assert MALFORMED_PAYLOADS.value == malformed_payloads + 4
+    table = pq.read_table(rotated[0])
+    assert table.column("double_value").to_pylist() == [1.5, 2.5]
+
+
+def test_parquet_format_requires_pyarrow(make_config, monkeypatch):
+    monkeypatch.setattr(util.gg_config, "pa", None)
+
+    with pytest.raises(Exception, match="requires pyarrow"):
+        make_config(OpcOutputFormat="parquet")
@@ -0,0 +1,54 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import os
+
+from conftest import payload
+from segment.abstract_segment_writer import RotationPolicy
+from segment.parquet_segment_writer import ParquetSegmentWriter
+from segment.processed_layout import split_processed_segment
+from util.gg_config import (
+    DEFAULT_PROCESSED_LOG_MAX_BYTES,
+    DEFAULT_PROCESSED_LOG_MAX_MESSAGES,
+)
+
+
+def test_partitions_are_the_sample_hours_not_the_segment_hour(tmp_path):
+    rotated = []
+    writer = ParquetSegmentWriter(
+        os.path.join(str(tmp_path), ""),
+        "opc-log",
+        RotationPolicy(60),
+        rotated_callback=rotated.append,
+    )
+    # 2023-11-14 22:59:59 and 23:00:01 UTC, read in one segment
+    writer.write_batch(
+        [
+            payload("/Plant1/T", 1700002799, 1.5),
+            payload("/Plant1/T", 1700002801, 2.5),
+        ]
+    )
+    writer.rotate()
+    writer.close()
+
+    partitions = [
+        (alias, datehour, table.num_rows)
+        for alias, datehour, table in split_processed_segment(rotated[0])
+    ]
+
+    # The cloud INSERT would keep both rows in the `opc_raw` hour of the segment
+    # (the time in its file name), the processed format splits them
+    assert partitions == [
+        ("/Plant1/T", "2023/11/14/22", 1),
+        ("/Plant1/T", "2023/11/14/23", 1),
+    ]
+
+
+def test_processed_segments_are_bounded_by_default(make_config):
+    processed = make_config(OpcOutputFormat="processed", ProcessedBucket="processed")
+    jsonl = make_config()
+
+    assert processed.opc_log_max_bytes == DEFAULT_PROCESSED_LOG_MAX_BYTES
+    assert processed.opc_log_max_messages == DEFAULT_PROCESSED_LOG_MAX_MESSAGES
+    assert jsonl.opc_log_max_bytes == 0
+    assert jsonl.opc_log_max_messages == 0
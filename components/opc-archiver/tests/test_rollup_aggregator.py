@@ -0,0 +1,88 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import json
+import time
+
+from conftest import payload
+from rollup.rollup_aggregator import LATE_VALUES, RollupAggregator
+
+
+def window_start(now: float, minutes_ago: int) -> int:
+    return int(now) // 60 * 60 - minutes_ago * 60
+
+
+def rollups(raw: list) -> list:
+    return [
+        (rollup["propertyAlias"], rollup["windowStart"], rollup["count"])
+        for rollup in map(json.loads, raw)
+    ]
+
+
+def test_window_is_closed_by_the_data_time_of_its_tag(monkeypatch):
+    start = window_start(time.time(), 10)
+    aggregator = RollupAggregator([60], allowed_lateness_sec=10)
+    aggregator.add_batch([payload("/A", start, 1.0), payload("/A", start + 30, 3.0)])
+    # Over on the wall clock, but the data time of the tag is still in the window
+    assert aggregator.collect_closed() == []
+
+    aggregator.add_batch([payload("/A", start + 75, 2.0)])
+    # Checked again after an interval
+    assert aggregator.collect_closed() == []
+    now = time.time_ns()
+    monkeypatch.setattr(time, "time_ns", lambda: now + 2 * 10**9)
+
+    raw = aggregator.collect_closed()
+    assert rollups(raw) == [("/A", start, 2)]
+    assert json.loads(raw[0])["avg"] == 2.0
+
+
+def test_tag_ahead_of_the_others_does_not_close_their_windows():
+    start = window_start(time.time(), 10)
+    aggregator = RollupAggregator([60], allowed_lateness_sec=10)
+    # A sample one day in the future
+    aggregator.add_batch([payload("/A", start + 86400, 1.0), payload("/B", start, 1.0)])
+    late_values = LATE_VALUES.value
+
+    aggregator.add_batch([payload("/B", start + 1, 2.0)])
+
+    assert LATE_VALUES.value == late_values
+    assert rollups(aggregator.collect_all()) == [
+        ("/B", start, 2),
+        ("/A", start + 86400, 1),
+    ]
+
+
+def test_value_behind_the_watermark_of_its_tag_is_dropped():
+    start = window_start(time.time(), 10)
+    aggregator = RollupAggregator([60], allowed_lateness_sec=10)
+    aggregator.add_batch([payload("/A", start, 1.0), payload("/A", start + 120, 1.0)])
+    assert rollups(aggregator.collect_closed()) == [("/A", start, 1)]
+    late_values = LATE_VALUES.value
+
+    aggregator.add_batch([payload("/A", start + 1, 5.0)])
+
+    assert LATE_VALUES.value == late_values + 1
+    assert aggregator.collect_closed() == []
+
+
+def test_window_of_an_idle_tag_is_closed_on_the_wall_clock(monkeypatch):
+    start = window_start(time.time(), 10)
+    aggregator = RollupAggregator([60], allowed_lateness_sec=10)
+    aggregator.add_batch([payload("/A", start, 1.0)])
+    assert aggregator.collect_closed() == []
+
+    now = time.time_ns()
+    monkeypatch.setattr(time, "time_ns", lambda: now + 11 * 10**9)
+
+    assert rollups(aggregator.collect_closed()) == [("/A", start, 1)]
+
+
+def test_windows_not_due_are_not_checked():
+    aggregator = RollupAggregator([60], allowed_lateness_sec=10)
+    now = time.time()
+    aggregator.add_batch([payload(f"/T{i}", now, 1.0) for i in range(1000)])
+
+    assert aggregator.collect_closed() == []
+    assert len(aggregator.collect_all()) == 1000
+    assert aggregator.collect_closed() == []
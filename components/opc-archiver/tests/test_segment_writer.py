@@ -0,0 +1,86 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import gzip
+import os
+
+from segment.abstract_segment_writer import RotationPolicy
+from segment.manifest import SegmentManifestJournal, file_sha256
+from segment.segment_writer import SegmentWriter
+from util.checkpoint import CheckpointStore
+
+LOG_NAME = "opc-log"
+
+
+def create_journal(checkpoint_dir: str) -> SegmentManifestJournal:
+    return SegmentManifestJournal(
+        CheckpointStore(
+            "test_sequence_number", checkpoint_dir, 0, ["pending_segments"]
+        ),
+        "next_sequence_number",
+        "pending_segments",
+    )
+
+
+def create_writer(log_dir: str, journal: SegmentManifestJournal, rotated=None):
+    return SegmentWriter(
+        os.path.join(log_dir, ""),
+        LOG_NAME,
+        RotationPolicy(60, max_messages=3),
+        manifest_journal=journal,
+        rotated_callback=rotated,
+    )
+
+
+def test_rotated_segment_is_committed_with_its_checksum(tmp_path, shadows):
+    journal = create_journal(str(tmp_path / "checkpoint"))
+    rotated = []
+    writer = create_writer(str(tmp_path), journal, rotated.append)
+
+    writer.write_batch([b"a", b"b", b"c", b"d"], [10, 11, 12, 13])
+
+    assert len(rotated) == 1
+    manifest = journal.get(os.path.basename(rotated[0]))
+    assert (manifest.first_sequence_number, manifest.last_sequence_number) == (10, 12)
+    assert manifest.messages == 3
+    assert manifest.sha256 == file_sha256(rotated[0])
+    assert gzip.decompress(open(rotated[0], "rb").read()) == b"a\nb\nc\n"
+    assert journal.next_sequence_number == 13
+
+
+def test_filtered_messages_move_the_position_on_close(tmp_path, shadows):
+    journal = create_journal(str(tmp_path / "checkpoint"))
+    writer = create_writer(str(tmp_path), journal)
+
+    # Every message of the batch was filtered out
+    writer.write_batch([], [], last_sequence_number=4)
+    writer.close()
+
+    assert journal.next_sequence_number == 5
+    assert journal.pending() == []
+    assert not os.path.exists(os.path.join(str(tmp_path), LOG_NAME))
+
+
+def test_active_segment_is_matched_to_the_pending_manifests_by_checksum(
+    tmp_path, shadows
+):
+    journal = create_journal(str(tmp_path / "checkpoint"))
+    rotated = []
+    writer = create_writer(str(tmp_path), journal, rotated.append)
+    # The first segment is committed and renamed, the second one is still active
+    writer.write_batch([b"a", b"b", b"c", b"d"], [0, 1, 2, 3])
+    active_path = os.path.join(str(tmp_path), LOG_NAME)
+    assert os.path.exists(active_path)
+
+    # Killed: on restart, the active segment matches no pending manifest
+    restarted = create_journal(str(tmp_path / "checkpoint"))
+    create_writer(str(tmp_path), restarted)
+
+    assert os.path.exists(rotated[0])
+    assert [manifest.name for manifest in restarted.pending()] == [
+        os.path.basename(rotated[0])
+    ]
+    assert restarted.next_sequence_number == 3
+    # Discarded (message 3 is read again from the stream), a new one is active
+    with open(active_path, "rb") as f:
+        assert b"d" not in gzip.decompress(f.read())
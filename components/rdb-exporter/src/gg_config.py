@@ -11,12 +11,25 @@ logger = logging.getLogger()
 
 CONFIG_LOG_LEVEL = "LogLevel"
 CONFIG_RUN_INTERVAL_SEC = "RunIntervalSec"
+CONFIG_METRICS_PORT = "MetricsPort"
+CONFIG_METRICS_EMF_INTERVAL_SEC = "MetricsEmfIntervalSec"
 
 
 class GGConfig:
     def __init__(self):
         config_schema = {
             CONFIG_RUN_INTERVAL_SEC: {"type": "integer", "default": 3600},
+            CONFIG_METRICS_PORT: {
+                "type": "integer",
+                "min": 0,
+                "max": 65535,
+                "default": 0,
+            },
+            CONFIG_METRICS_EMF_INTERVAL_SEC: {
+                "type": "integer",
+                "min": 0,
+                "default": 0,
+            },
             CONFIG_LOG_LEVEL: {
                 "type": "string",
                 "default": "info",
@@ -47,6 +60,14 @@ class GGConfig:
     def run_interval_sec(self) -> int:
         return self._config[CONFIG_RUN_INTERVAL_SEC]
 
+    @property
+    def metrics_port(self) -> int:
+        return self._config[CONFIG_METRICS_PORT]
+
+    @property
+    def metrics_emf_interval_sec(self) -> int:
+        return self._config[CONFIG_METRICS_EMF_INTERVAL_SEC]
+
     @property
     def log_level(self) -> str:
         return self._config[CONFIG_LOG_LEVEL]
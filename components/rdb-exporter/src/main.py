@@ -6,9 +6,11 @@ import re
 import shutil
 import signal
 import sys
+import time
 
 import requests
 from gg_config import GGConfig
+from util.metrics import REGISTRY, EmfLogThread, start_http_server
 
 logger = logging.getLogger("opc-archiver-component-logger")
 logger.setLevel(logging.INFO)
@@ -21,6 +23,11 @@ logger.addHandler(handler)
 
 exit_event = asyncio.Event()
 
+METRICS_NAMESPACE = "IndustrialDataPlatform/rdb-exporter"
+
+# Upper bounds of the embulk run duration buckets (seconds)
+EMBULK_RUN_BUCKETS = (1, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+
 DECOMPRESSED_PATH = os.environ.get("DECOMPRESSED_PATH")
 EMBULK_VERSION = os.environ.get("EMBULK_VERSION")
 EMBULK_EXEC_PATH = os.path.join(DECOMPRESSED_PATH, f"embulk-{EMBULK_VERSION}.jar")
@@ -78,7 +85,22 @@ async def embulk_task(config: GGConfig):
             stdout=asyncio.subprocess.PIPE,
             stderr=asyncio.subprocess.PIPE,
         )
+        started_at = time.perf_counter()
         stdout, stderr = await process.communicate()
+        REGISTRY.histogram(
+            "embulk_run_seconds",
+            "Duration of an embulk run",
+            {"config": base_name},
+            buckets=EMBULK_RUN_BUCKETS,
+        ).observe(time.perf_counter() - started_at)
+        REGISTRY.counter(
+            "embulk_runs_total",
+            "Embulk runs by result",
+            {
+                "config": base_name,
+                "result": "success" if process.returncode == 0 else "failure",
+            },
+        ).inc()
         if stdout:
             logger.info(stdout.decode().strip())
         if stderr:
@@ -128,6 +150,12 @@ async def main():
 
         config.print_config()
 
+        # Local metrics (Prometheus text endpoint and/or periodic EMF log lines)
+        if config.metrics_port > 0:
+            start_http_server(config.metrics_port)
+        if config.metrics_emf_interval_sec > 0:
+            EmfLogThread(METRICS_NAMESPACE, config.metrics_emf_interval_sec).start()
+
         await run_task(config)
     except Exception as e:
         logger.exception(e)
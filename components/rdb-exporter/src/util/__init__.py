@@ -0,0 +1,19 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import os
+
+# The modules shared by the components (e.g. `metrics`) are kept once in
+# `components/common/src/util` and copied here when the component is built. When run
+# from a checkout of the repository, they are found there instead.
+_SHARED_DIR = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)),
+    "..",
+    "..",
+    "..",
+    "common",
+    "src",
+    "util",
+)
+if os.path.isdir(_SHARED_DIR):
+    __path__.append(os.path.normpath(_SHARED_DIR))